@@ -1,63 +1,91 @@
+import functools
 from flask import jsonify
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import select, func
 from sqlalchemy.exc import OperationalError
-from data_management.database import engine
+from data_management.database import SessionLocal, ReadSessionLocal, time_bucket
+from data_management.read_cache import cached_read
+from custom_logging import setup_logger
 from models import (
-    WaterLevel, Hygrometry, SystemState, Precipitation, RainForecast, WateringSession,
-    HourlyRain, HourlyTemperature, HourlyWind, HourlySunlight, HourlyHumidity,
-    CpuTemperature, TechnicalCabinetConditions
+    WaterLevel, Hygrometry, SystemState, Precipitation, RainForecast, WateringSession, HourlyTemperature,
+    CpuTemperature, TechnicalCabinetConditions, DailyAggregate
 )
 from datetime import datetime, timedelta
 import calendar
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Même logger que le front-end (application.py) : les erreurs de lecture vont dans log_flask_garden.log
+logger = setup_logger('log_flask_garden.log', 'flask_app')
 
-def convert_to_dict(obj):
-    """Convert SQLAlchemy object to dictionary."""
-    if obj is None:
-        return None
-    return {c.name: getattr(obj, c.name) for c in obj.__table__.columns}
-
-def with_reconnect(func):
-    def wrapper(*args, **kwargs):
-        session = SessionLocal()
-        try:
-            return func(session, *args, **kwargs)
-        except OperationalError:
-            session.rollback()
-            # Reconnect logic
-            session.close()
-            session = SessionLocal()
-            return func(session, *args, **kwargs)
-        finally:
-            session.close()
-    return wrapper
+# Au-delà d'une semaine, les graphiques reçoivent des moyennes par tranche (en secondes) calculées en SQL
+CHART_BUCKETS = {'30d': 900, 'month': 900, '365d': 3600, 'year': 3600}
+
+def series(session, time_column, value_column, start_date, end_date=None, bucket=None, aggregate=func.avg,
+           group_column=None):
+    """
+    Lit une série (time, valeur[, groupe]) en ne sélectionnant que les colonnes utiles ;
+    avec `bucket`, les valeurs sont agrégées en SQL par tranche de `bucket` secondes.
+    Renvoie une liste de tuples (str(time), valeur[, groupe]).
+    """
+    time_expression = time_bucket(time_column, bucket) if bucket else time_column
+    columns = [time_expression.label('time'), aggregate(value_column) if bucket else value_column]
+    if group_column is not None:
+        columns.append(group_column)
+    query = select(*columns).where(time_column >= start_date)
+    if end_date is not None:
+        query = query.where(time_column <= end_date)
+    if bucket:
+        query = query.group_by(*([time_expression] + ([group_column] if group_column is not None else [])))
+    query = query.order_by(time_expression)
+    return [(str(row[0]),) + tuple(row[1:]) for row in session.execute(query)]
+
+def with_reconnect_on(session_factory):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            session = session_factory()
+            try:
+                return func(session, *args, **kwargs)
+            except OperationalError:
+                session.rollback()
+                # Reconnect logic
+                session.close()
+                session = session_factory()
+                return func(session, *args, **kwargs)
+            finally:
+                session.close()
+        return wrapper
+    return decorator
+
+with_reconnect = with_reconnect_on(SessionLocal)
+# Graphiques et historiques : moteur de lecture (pool et délai dédiés, réplique éventuelle)
+with_read_session = with_reconnect_on(ReadSessionLocal)
 
 @with_reconnect
 def get_water_level_data(session):
     try:
-        result = session.query(WaterLevel).order_by(WaterLevel.time.desc()).first()
-        return f"{result.level:.2f}" if result else "NaN"
+        level = session.execute(select(WaterLevel.level).order_by(WaterLevel.time.desc()).limit(1)).scalar()
+        return f"{level:.2f}" if level is not None else "NaN"
     except Exception as error:
-        print(f"Erreur lors de la récupération du niveau d'eau depuis la base de données : {error}")
+        logger.error(f"Erreur lors de la récupération du niveau d'eau depuis la base de données : {error}")
         return "NaN"
 
 @with_reconnect
 def get_moisture_data(session, zone):
     try:
-        result = session.query(Hygrometry).filter(Hygrometry.zone == zone).order_by(Hygrometry.time.desc()).first()
+        result = session.execute(select(Hygrometry.level, Hygrometry.time).where(Hygrometry.zone == zone)
+                                 .order_by(Hygrometry.time.desc()).limit(1)).first()
         return {
             "level": f"{result.level:.2f}",
             "time": result.time.strftime("%Y-%m-%d %H:%M:%S")
         } if result else {"level": "NaN", "time": None}
     except Exception as error:
-        print(f"Erreur lors de la récupération de l'humidité pour {zone} depuis la base de données: {error}")
+        logger.error(f"Erreur lors de la récupération de l'humidité pour {zone} depuis la base de données: {error}")
         return {"level": "NaN", "time": None}
 
 @with_reconnect
 def get_system_state(session):
     try:
-        result = session.query(SystemState).order_by(SystemState.time.desc()).first()
+        result = session.execute(select(SystemState.state, SystemState.zone, SystemState.source, SystemState.mode,
+                                        SystemState.time).order_by(SystemState.time.desc()).limit(1)).first()
         return {
             "state": result.state,
             "zone": result.zone,
@@ -66,19 +94,108 @@ def get_system_state(session):
             "time": result.time.strftime("%Y-%m-%d %H:%M:%S")
         } if result else {"state": "Unknown", "zone": "N/A", "source": "N/A", "mode": "N/A", "time": None}
     except Exception as error:
-        print(f"Erreur lors de la récupération de l'état du système depuis la base de données: {error}")
+        logger.error(f"Erreur lors de la récupération de l'état du système depuis la base de données: {error}")
         return {"state": "Unknown", "zone": "N/A", "source": "N/A", "mode": "N/A", "time": None}
 
 @with_reconnect
 def get_last_rain_data(session):
     try:
-        result = session.query(Precipitation).order_by(Precipitation.time.desc()).first()
-        return f"{result.amount:.2f}" if result else "0.00"
+        amount = session.execute(select(Precipitation.amount).order_by(Precipitation.time.desc()).limit(1)).scalar()
+        return f"{amount:.2f}" if amount is not None else "0.00"
     except Exception as error:
-        print(f"Erreur lors de la récupération des données de pluie : {error}")
+        logger.error(f"Erreur lors de la récupération des données de pluie : {error}")
         return "0.00"
 
-@with_reconnect
+SPARKLINE_BUCKET = 900
+
+def latest(*columns, where=None):
+    """ Sous-requête scalaire : valeur de la dernière ligne de la table de `columns[0]` """
+    table = columns[0].table
+    query = select(*columns).order_by(table.c.time.desc()).limit(1)
+    if where is not None:
+        query = query.where(where)
+    return query.scalar_subquery()
+
+def format_time(value):
+    # SQLite renvoie les sous-requêtes scalaires sous forme de texte
+    return value.strftime("%Y-%m-%d %H:%M:%S") if isinstance(value, datetime) else value
+
+@with_read_session
+def get_data_version(session, *models):
+    """
+    Version des données de `models` pour les validateurs HTTP : (dernier id de chaque table,
+    horodatage le plus récent de ces dernières lignes). La lecture par clé primaire ne parcourt pas les tables.
+    """
+    try:
+        columns = []
+        for model in models:
+            columns.append(select(model.id).order_by(model.id.desc()).limit(1).scalar_subquery())
+            columns.append(select(model.time).order_by(model.id.desc()).limit(1).scalar_subquery())
+        row = session.execute(select(*columns)).one()
+        times = [value if isinstance(value, datetime) else datetime.fromisoformat(value)
+                 for value in row[1::2] if value is not None]
+        return ",".join(str(value) for value in row[0::2]), max(times, default=None)
+    except Exception as error:
+        logger.error(f"Erreur lors de la lecture de la version des données : {error}")
+        return None, None
+
+@cached_read(bucket=5)
+@with_read_session
+def get_dashboard_snapshot(session, zones=()):
+    """
+    État complet du tableau de bord : une requête à sous-requêtes scalaires pour les dernières valeurs
+    (dont l'humidité de chacune des `zones`, tuple de noms) et une pour la courbe des dernières 24 heures
+    (moyennes par quart d'heure).
+    """
+    try:
+        columns = {
+            "water_level": latest(WaterLevel.level),
+            "water_level_time": latest(WaterLevel.time),
+            "last_rain": latest(Precipitation.amount),
+            "rain_forecast": latest(RainForecast.amount),
+            "rain_forecast_time": latest(RainForecast.time),
+            "state": latest(SystemState.state),
+            "state_zone": latest(SystemState.zone),
+            "state_source": latest(SystemState.source),
+            "state_mode": latest(SystemState.mode),
+            "state_time": latest(SystemState.time),
+        }
+        for index, zone in enumerate(zones):
+            columns[f"moisture_{index}"] = latest(Hygrometry.level, where=Hygrometry.zone == zone)
+            columns[f"moisture_{index}_time"] = latest(Hygrometry.time, where=Hygrometry.zone == zone)
+        row = session.execute(select(*(column.label(name) for name, column in columns.items()))).one()._mapping
+        sparkline = series(session, WaterLevel.time, WaterLevel.level, datetime.now() - timedelta(days=1),
+                           bucket=SPARKLINE_BUCKET)
+
+        return {
+            "water_level": f"{row['water_level']:.2f}" if row['water_level'] is not None else "NaN",
+            "water_level_time": format_time(row['water_level_time']),
+            "moisture": {
+                zone: {
+                    "level": f"{row[f'moisture_{index}']:.2f}" if row[f'moisture_{index}'] is not None else "NaN",
+                    "time": format_time(row[f'moisture_{index}_time'])
+                } for index, zone in enumerate(zones)
+            },
+            "system_state": {
+                "state": row['state'] or "Unknown",
+                "zone": row['state_zone'] or "N/A",
+                "source": row['state_source'] or "N/A",
+                "mode": row['state_mode'] or "N/A",
+                "time": format_time(row['state_time'])
+            },
+            "last_rain": f"{row['last_rain']:.2f}" if row['last_rain'] is not None else "0.00",
+            "rain_forecast": {"amount": row['rain_forecast'], "time": format_time(row['rain_forecast_time'])},
+            "sparkline": {
+                "timestamps": [point[0] for point in sparkline],
+                "water_levels": [point[1] for point in sparkline]
+            }
+        }
+    except Exception as error:
+        logger.error(f"Erreur lors de la récupération de l'état du tableau de bord : {error}")
+        return None
+
+@cached_read(bucket=60)
+@with_read_session
 def get_water_level_chart_data(session, duration='24h', month=None, year=None):
     try:
         if duration == '24h':
@@ -107,81 +224,63 @@ def get_water_level_chart_data(session, duration='24h', month=None, year=None):
 
         end_date = end_date if 'end_date' in locals() else None
 
-        query = session.query(WaterLevel).filter(WaterLevel.time >= start_date)
-        if end_date:
-            query = query.filter(WaterLevel.time <= end_date)
-        results = query.order_by(WaterLevel.time.asc()).all()
-
-        timestamps = [str(result.time) for result in results]
-        water_levels = [result.level for result in results]
+        rows = series(session, WaterLevel.time, WaterLevel.level, start_date, end_date,
+                      bucket=CHART_BUCKETS.get(duration))
 
         return {
-            'timestamps': timestamps,
-            'water_levels': water_levels
+            'timestamps': [row[0] for row in rows],
+            'water_levels': [row[1] for row in rows]
         }
     except Exception as error:
-        print(f"Database error: {error}")
+        logger.error(f"Database error: {error}")
         return None
 
-@with_reconnect
+@cached_read(bucket=30)
+@with_read_session
 def get_watering_sessions(session, limit=20):
     try:
-        results = session.query(WateringSession).order_by(WateringSession.time.desc()).limit(limit).all()
-        sessions = [convert_to_dict(row) for row in results]
-        for session in sessions:
-            print(f"Session time: {session['time']}")  # Log the session times
-        return sessions
+        # Lignes nommées : le gabarit y accède par attribut (session.zone, session.duration...)
+        return session.execute(
+            select(WateringSession.time, WateringSession.zone, WateringSession.duration, WateringSession.source,
+                   WateringSession.soil_moisture_before, WateringSession.mode)
+            .order_by(WateringSession.time.desc()).limit(limit)).all()
     except Exception as error:
-        print(f"Erreur lors de la récupération des sessions d'arrosage: {error}")
-        return []
+        logger.error(f"Erreur lors de la récupération des sessions d'arrosage: {error}")
+        return None
 
-@with_reconnect
-def get_yearly_data(session):
+@cached_read(bucket=300)
+@with_read_session
+def get_yearly_series(session, name, year=None):
+    """ Agrégats journaliers d'une série pour une année (au plus 366 points, précalculés chaque heure) """
     try:
-        start_date = datetime(datetime.now().year, 1, 1)
-        end_date = datetime(datetime.now().year, 12, 31)
-
-        water_level_data = session.query(WaterLevel).filter(WaterLevel.time.between(start_date, end_date)).all()
-        hygrometry_data = session.query(Hygrometry).filter(Hygrometry.time.between(start_date, end_date)).all()
-        rain_data = session.query(HourlyRain).filter(HourlyRain.time.between(start_date, end_date)).all()
-        watering_sessions_data = session.query(WateringSession).filter(WateringSession.time.between(start_date, end_date)).all()
-        temperature_data = session.query(HourlyTemperature).filter(HourlyTemperature.time.between(start_date, end_date)).all()
-        sunlight_data = session.query(HourlySunlight).filter(HourlySunlight.time.between(start_date, end_date)).all()
-        humidity_data = session.query(HourlyHumidity).filter(HourlyHumidity.time.between(start_date, end_date)).all()
-        wind_data = session.query(HourlyWind).filter(HourlyWind.time.between(start_date, end_date)).all()
-
-        return {
-            'water_level': [(str(item.time), item.level) for item in water_level_data],
-            'hygrometry': [(str(item.time), item.level, item.zone) for item in hygrometry_data],
-            'rain': [(str(item.time), item.amount) for item in rain_data],
-            'watering_sessions': [(str(item.time), item.zone, item.duration) for item in watering_sessions_data],
-            'temperature': [(str(item.time), item.temperature) for item in temperature_data],
-            'sunlight': [(str(item.time), item.solar_radiation) for item in sunlight_data],
-            'humidity': [(str(item.time), item.humidity) for item in humidity_data],
-            'wind': [(str(item.time), item.wind_speed) for item in wind_data]
-        }
+        year = year or datetime.now().year
+        rows = session.execute(
+            select(DailyAggregate.time, DailyAggregate.value)
+            .where(DailyAggregate.series == name,
+                   DailyAggregate.time >= datetime(year, 1, 1), DailyAggregate.time < datetime(year + 1, 1, 1))
+            .order_by(DailyAggregate.time)).all()
+        return [(time.strftime("%Y-%m-%d"), value) for time, value in rows]
     except Exception as error:
-        print(f"Erreur lors de la récupération des données de l'année en cours : {error}")
-        return {}
+        logger.error(f"Erreur lors de la récupération de la série annuelle {name} : {error}")
+        return None
 
-@with_reconnect
+@cached_read(bucket=300)
+@with_read_session
 def get_technical_cabinet_data(session):
     try:
         start_date = datetime.now() - timedelta(days=7)
 
-        technical_cabinet_data = session.query(TechnicalCabinetConditions).filter(TechnicalCabinetConditions.time >= start_date).all()
-        cpu_temperature_data = session.query(CpuTemperature).filter(CpuTemperature.time >= start_date).all()
-        external_temperature_data = session.query(HourlyTemperature).filter(HourlyTemperature.time >= start_date).all()
+        technical_cabinet_data = session.execute(
+            select(TechnicalCabinetConditions.time, TechnicalCabinetConditions.temperature,
+                   TechnicalCabinetConditions.humidity)
+            .where(TechnicalCabinetConditions.time >= start_date).order_by(TechnicalCabinetConditions.time)).all()
 
         return {
-            'technical_cabinet': [(str(item.time), item.temperature, item.humidity) for item in technical_cabinet_data],
-            'cpu_temperature': [(str(item.time), item.temperature) for item in cpu_temperature_data],
-            'external_temperature': [(str(item.time), item.temperature) for item in external_temperature_data]
+            'technical_cabinet': [(str(time), temperature, humidity)
+                                  for time, temperature, humidity in technical_cabinet_data],
+            'cpu_temperature': series(session, CpuTemperature.time, CpuTemperature.temperature, start_date),
+            'external_temperature': series(session, HourlyTemperature.time, HourlyTemperature.temperature, start_date)
         }
     except Exception as error:
-        print(f"Erreur lors de la récupération des données de la semaine : {error}")
-        return {
-            'technical_cabinet': [],
-            'cpu_temperature': [],
-            'external_temperature': []
-        }
\ No newline at end of file
+        logger.error(f"Erreur lors de la récupération des données de la semaine : {error}")
+        return None
\ No newline at end of file
@@ -0,0 +1,167 @@
+"""
+Couche HTTP du front-end : compression gzip/brotli, URLs statiques versionnées par empreinte
+(mises en cache un an par le navigateur) et validateurs ETag/Last-Modified pour les données.
+"""
+import functools
+import gzip
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import timezone
+
+from flask import request, make_response
+
+try:
+    import brotli
+except ImportError:  # brotli est facultatif, gzip est toujours disponible
+    brotli = None
+
+COMPRESSIBLE_TYPES = {"text/html", "text/css", "text/plain", "application/json", "application/javascript",
+                      "text/javascript", "application/manifest+json", "image/svg+xml", "image/x-icon",
+                      "image/vnd.microsoft.icon"}
+MIN_COMPRESS_SIZE = 500
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+# Nombre de fichiers statiques compressés gardés en mémoire
+STATIC_CACHE_SIZE = 64
+
+# Change à chaque démarrage : une page mise en cache avant un déploiement référence d'anciens fichiers statiques
+BOOT_ID = str(time.time())
+
+_static_hashes = {}
+_compressed_static = OrderedDict()
+_lock = threading.Lock()
+
+
+def static_hash(static_folder, filename):
+    """ Empreinte du contenu d'un fichier statique, recalculée seulement si le fichier change """
+    path = os.path.join(static_folder, filename)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    cached = _static_hashes.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with open(path, "rb") as static_file:
+        digest = hashlib.md5(static_file.read()).hexdigest()[:12]
+    _static_hashes[path] = (mtime, digest)
+    return digest
+
+
+def choose_encoding(accept_encoding):
+    if brotli is not None and "br" in accept_encoding:
+        return "br"
+    if "gzip" in accept_encoding:
+        return "gzip"
+    return None
+
+
+def compress(data, encoding):
+    if encoding == "br":
+        return brotli.compress(data, quality=5)
+    return gzip.compress(data, compresslevel=6)
+
+
+def _compressed_body(response, encoding):
+    # Les fichiers statiques ne changent qu'au déploiement : leur version compressée est réutilisée
+    key = (request.path, response.get_etag()[0], encoding) if request.endpoint == "static" else None
+    if key is not None:
+        with _lock:
+            if key in _compressed_static:
+                _compressed_static.move_to_end(key)
+                return _compressed_static[key]
+    body = compress(response.get_data(), encoding)
+    if key is not None:
+        with _lock:
+            _compressed_static[key] = body
+            while len(_compressed_static) > STATIC_CACHE_SIZE:
+                _compressed_static.popitem(last=False)
+    return body
+
+
+def init_http_cache(app):
+    """ Installe la compression, le versionnage des URLs statiques et leurs en-têtes de cache """
+
+    @app.url_defaults
+    def add_static_version(endpoint, values):
+        if endpoint == "static" and "filename" in values and "v" not in values:
+            version = static_hash(app.static_folder, values["filename"])
+            if version:
+                values["v"] = version
+
+    @app.after_request
+    def cache_and_compress(response):
+        if request.endpoint == "static" and response.status_code == 200:
+            if request.args.get("v"):
+                # L'URL change avec le contenu : le navigateur peut la garder sans jamais revalider
+                response.headers["Cache-Control"] = IMMUTABLE_CACHE
+            else:
+                response.headers["Cache-Control"] = "no-cache"
+        return compress_response(response)
+
+    return app
+
+
+def compress_response(response):
+    if (response.status_code != 200 or "Content-Encoding" in response.headers
+            or response.mimetype not in COMPRESSIBLE_TYPES
+            or (response.is_streamed and not response.direct_passthrough)):
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = choose_encoding(request.headers.get("Accept-Encoding", ""))
+    if encoding is None:
+        return response
+    if response.content_length is not None and response.content_length < MIN_COMPRESS_SIZE:
+        return response
+    etag, weak = response.get_etag()
+    if etag:
+        # Une représentation compressée différente doit avoir son propre validateur
+        etag = f"{etag}-{encoding}"
+        if request.if_none_match.contains_weak(etag):
+            response.status_code = 304
+            response.set_data(b"")
+            response.set_etag(etag, weak)
+            return response
+    # send_file renvoie le fichier en flux direct : on le lit pour le compresser
+    response.direct_passthrough = False
+    response.set_data(_compressed_body(response, encoding))
+    response.headers["Content-Encoding"] = encoding
+    if etag:
+        response.set_etag(etag, weak)
+    return response
+
+
+def conditional(validators):
+    """
+    Rend une vue conditionnelle : `validators()` renvoie (marqueur, dernière modification) à partir
+    des dernières lignes des tables concernées. Si le client a déjà cette version, la vue n'est pas
+    exécutée et la réponse est un 304 vide.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            marker, last_modified = validators()
+            if marker is None:
+                return view(*args, **kwargs)
+            etag = hashlib.sha1(f"{BOOT_ID}|{request.full_path}|{marker}".encode()).hexdigest()
+            if last_modified is not None:
+                # Les horodatages de la base sont en heure locale naïve, HTTP compare en UTC à la seconde près
+                last_modified = last_modified.astimezone(timezone.utc).replace(microsecond=0)
+            if request.if_none_match:
+                # Le client renvoie l'ETag de la représentation reçue, éventuellement compressée
+                not_modified = any(request.if_none_match.contains_weak(candidate)
+                                   for candidate in (etag, f"{etag}-gzip", f"{etag}-br"))
+            else:
+                not_modified = (last_modified is not None and request.if_modified_since is not None
+                                and last_modified <= request.if_modified_since)
+            response = make_response("", 304) if not_modified else make_response(view(*args, **kwargs))
+            if response.status_code in (200, 304):
+                response.set_etag(etag)
+                if last_modified is not None:
+                    response.last_modified = last_modified
+                response.headers["Cache-Control"] = "no-cache"
+            return response
+        return wrapper
+    return decorator
@@ -12,46 +12,20 @@ function convertToLocaleString(timestamp) {
     return date.toLocaleString(); // Conversion en chaîne de caractères locale
 }
 
-// Exemple : Lorsque le bouton "Arroser le jardin" est cliqué
-document.getElementById("btn-water-garden")?.addEventListener("click", function () {
-    // Envoyer une demande au serveur Flask pour démarrer l'arrosage du jardin
-    fetch("/water-garden")
-        .then(response => response.json())
-        .then(data => {
-            // Traitez la réponse du serveur si nécessaire
-            console.log(data);
-        })
-        .catch(error => {
-            console.error("Erreur lors de la demande au serveur :", error);
-        });
-});
-
-// Lorsque le bouton "Arroser les tomates" est cliqué
-document.getElementById("btn-water-tomatoes")?.addEventListener("click", function () {
-    // Envoyer une demande au serveur Flask pour démarrer l'arrosage des tomates
-    fetch("/water-tomatoes")
-        .then(response => response.json())
-        .then(data => {
-            // Traitez la réponse du serveur si nécessaire
-            console.log(data);
-        })
-        .catch(error => {
-            console.error("Erreur lors de la demande au serveur :", error);
-        });
-});
-
-// Lorsque le bouton "Activer le robinet auxiliaire" est cliqué
-document.getElementById("btn-activate-faucet")?.addEventListener("click", function () {
-    // Envoyer une demande au serveur Flask pour activer le robinet auxiliaire
-    fetch("/activate-faucet")
-        .then(response => response.json())
-        .then(data => {
-            // Traitez la réponse du serveur si nécessaire
-            console.log(data);
-        })
-        .catch(error => {
-            console.error("Erreur lors de la demande au serveur :", error);
-        });
+// Lorsqu'un bouton d'arrosage de zone est cliqué
+document.querySelectorAll(".btn-water-zone").forEach(button => {
+    button.addEventListener("click", function () {
+        // Envoyer une demande au serveur Flask pour démarrer l'arrosage de la zone
+        fetch(`/water/${button.dataset.zone}`)
+            .then(response => response.json())
+            .then(data => {
+                // Traitez la réponse du serveur si nécessaire
+                console.log(data);
+            })
+            .catch(error => {
+                console.error("Erreur lors de la demande au serveur :", error);
+            });
+    });
 });
 
 // Exemple : Lorsque le bouton "Arrêter tous les arrosages" est cliqué
@@ -68,94 +42,87 @@ document.getElementById("btn-stop-watering")?.addEventListener("click", function
         });
 });
 
-// Récupérer le niveau d'eau depuis le serveur Flask et mettre à jour la balise HTML
-function getWaterLevel() {
+// Récupérer tout l'état du tableau de bord en une requête et mettre à jour les balises HTML.
+// Le navigateur renvoie l'ETag reçu : si rien n'a changé, le serveur répond 304 sans contenu.
+function refreshSnapshot() {
     const waterLevelSpan = document.getElementById('water-level');
-    if (!waterLevelSpan) return;  // Ajout de vérification d'existence
-    fetch('/get-water-level')
+    if (!waterLevelSpan) return;  // Uniquement sur la page d'accueil
+    fetch('/api/snapshot')
         .then(response => response.json())
         .then(data => {
-            // Extraire le niveau d'eau des données et le formater
-            const waterLevel = parseFloat(data.water_level).toFixed(2); // Formater la valeur à deux chiffres après la virgule
-
-            // Mettre à jour la balise HTML avec le niveau d'eau
-            waterLevelSpan.textContent = `${waterLevel} cm`; // Ajouter l'unité
+            waterLevelSpan.textContent = `${parseFloat(data.water_level).toFixed(2)} cm`;
+            document.getElementById('rain-data').textContent = `${data.last_rain} mm`;
+            document.querySelectorAll('.zone-moisture').forEach(span => {
+                const moisture = data.moisture[span.dataset.zone];
+                if (moisture) span.textContent = `${moisture.level}%`;
+            });
+            const state = data.system_state;
+            document.getElementById('system-state').textContent =
+                `${state.state} (Zone: ${state.zone}, Source: ${state.source}, Mode: ${state.mode})`;
+            drawWaterLevelChart(data.sparkline);
         })
         .catch(error => {
-            console.error('Erreur lors de la récupération du niveau d\'eau :', error);
+            console.error('Erreur lors de la récupération de l\'état du tableau de bord :', error);
         });
 }
 
-// Appeler la fonction pour afficher le niveau d'eau au chargement de la page
-getWaterLevel();
-
-// Récupérer la valeur de pluie tombée les 12 dernières heures depuis le serveur Flask et mettre à jour la balise HTML
-function getLastRainData() {
-    const rainDataSpan = document.getElementById('rain-data');
-    if (!rainDataSpan) return;  // Ajout de vérification d'existence
-    fetch('/get-last-rain-data')
-        .then(response => response.json())
-        .then(data => {
-            rainDataSpan.textContent = `${data.rain_data} mm`; // Ajouter l'unité de mesure
-        })
-        .catch(error => {
-            console.error('Erreur lors de la récupération des données de pluie:', error);
-        });
+// Appeler la fonction au chargement de la page puis toutes les 30 secondes
+refreshSnapshot();
+setInterval(refreshSnapshot, 30000);
+
+// Générer le graphique du niveau d'eau
+function drawWaterLevelChart(data) {
+    // Convertir les timestamps en format ISO pour Plotly sans ajustement d'heure
+    const timestamps = convertToLocaleStringISO(data.timestamps);
+    const waterLevels = data.water_levels;
+
+    const chartData = [{
+        x: timestamps,
+        y: waterLevels,
+        type: 'scatter',  // Utilisez 'scatter' pour les graphiques à points et lignes
+        mode: 'lines+markers',  // Ligne avec des points à chaque donnée
+        name: 'Niveau d\'eau (cm)',
+        fill: 'tozeroy',  // Remplissage jusqu'à l'axe des x (zéro)
+        fillcolor: 'rgba(173, 216, 230, 0.5)',  // Bleu clair avec une transparence
+        line: {  // Définir la couleur et la largeur de la ligne
+            color: 'blue',
+            width: 2
+        },
+        marker: {  // Style des marqueurs
+            color: 'blue',
+            size: 6
+        }
+    }];
+
+    const chartLayout = {
+        title: 'Évolution du niveau d\'eau de la citerne',
+        xaxis: {
+            title: 'Horodatage',
+            type: 'date'
+        },
+        yaxis: {
+            title: 'Niveau d\'eau (cm)'
+        },
+        autosize: true,
+        margin: {
+            l: 50,
+            r: 50,
+            b: 100,
+            t: 100,
+            pad: 4
+        },
+        paper_bgcolor: 'white',
+        plot_bgcolor: 'white'
+    };
+
+    Plotly.newPlot('water-level-chart', chartData, chartLayout, {responsive: true});
 }
 
-// Appeler cette fonction au chargement de la page
-getLastRainData();
-
-// Récupérer les données du niveau d'eau depuis le serveur Flask et générer le graphique
+// Récupérer les données du niveau d'eau sur une autre durée depuis le serveur Flask et générer le graphique
 function getWaterLevelChartData(duration) {
     fetch(`/water-level-chart-data?duration=${duration}`)
         .then(response => response.json())
-        .then(data => {
-            // Convertir les timestamps en format ISO pour Plotly sans ajustement d'heure
-            const timestamps = convertToLocaleStringISO(data.timestamps);
-            const waterLevels = data.water_levels;
-
-            const chartData = [{
-                x: timestamps,
-                y: waterLevels,
-                type: 'scatter',  // Utilisez 'scatter' pour les graphiques à points et lignes
-                mode: 'lines+markers',  // Ligne avec des points à chaque donnée
-                name: 'Niveau d\'eau (cm)',
-                fill: 'tozeroy',  // Remplissage jusqu'à l'axe des x (zéro)
-                fillcolor: 'rgba(173, 216, 230, 0.5)',  // Bleu clair avec une transparence
-                line: {  // Définir la couleur et la largeur de la ligne
-                    color: 'blue',
-                    width: 2
-                },
-                marker: {  // Style des marqueurs
-                    color: 'blue',
-                    size: 6
-                }
-            }];
-
-            const chartLayout = {
-                title: 'Évolution du niveau d\'eau de la citerne',
-                xaxis: {
-                    title: 'Horodatage',
-                    type: 'date'
-                },
-                yaxis: {
-                    title: 'Niveau d\'eau (cm)'
-                },
-                autosize: true,
-                margin: {
-                    l: 50,
-                    r: 50,
-                    b: 100,
-                    t: 100,
-                    pad: 4
-                },
-                paper_bgcolor: 'white',
-                plot_bgcolor: 'white'
-            };
-
-            Plotly.newPlot('water-level-chart', chartData, chartLayout, {responsive: true});
-        })
+        .then(drawWaterLevelChart)
         .catch(error => {
             console.error('Erreur lors de la récupération des données du niveau d\'eau :', error);
         });
@@ -1,9 +1,10 @@
 import sys
 import json
+import hmac
 import threading
 import logging
 import time
-from flask import Flask, render_template, jsonify
+from flask import Flask, render_template, jsonify, request, g, Response
 from app.flask_functions import (
     get_water_level_data,
     get_moisture_data,
@@ -11,57 +12,189 @@ from app.flask_functions import (
     get_last_rain_data as fetch_last_rain_data,
     get_water_level_chart_data,
     get_watering_sessions,
-    get_yearly_data,
-    get_technical_cabinet_data
+    get_yearly_series,
+    get_technical_cabinet_data,
+    get_dashboard_snapshot,
+    get_data_version,
+    SPARKLINE_BUCKET
 )
-from garden_app_instance import GardenWateringApp
+from app.http_cache import init_http_cache, conditional
+from control import send_command, ControlError, DEFAULT_SOCKET_PATH
 from custom_logging import setup_logger
+from config import load_config, get_config_service
+from monitoring.metrics import registry, http_request_seconds, CONTENT_TYPE_LATEST
+from monitoring.profiler import SamplingProfiler, RequestProfile, ProfilerBusyError
+from models import (
+    WaterLevel, WateringSession, HourlyTemperature, TechnicalCabinetConditions, CpuTemperature, DailyAggregate,
+    Precipitation, RainForecast, SystemState, Hygrometry
+)
+from data_management.aggregates import series_definitions
+from watering import build_zones
 
 sys.path.append('/home/PiGardenV6/app')
 
 app = Flask(__name__, static_folder='app/static', template_folder='app/templates')
+init_http_cache(app)
 
-# Charger le fichier de configuration
-with open('/home/PiGardenV6/config/config.json') as config_file:
-    config = json.load(config_file)
-
-# Initialisation de GardenWateringApp avec l'instance app Flask
-garden_app = GardenWateringApp()
+# Charger le fichier de configuration (rechargé automatiquement en cas de modification)
+get_config_service().start_watching()
 
 # setup_logger()
 flask_logger = setup_logger('log_flask_garden.log', 'flask_app')
 app.logger.handlers = flask_logger.handlers
 app.logger.setLevel(flask_logger.level)
 
+MAX_PROFILE_SECONDS = 120
+
+def is_admin_request():
+    """ Vérifie le jeton d'administration transmis dans l'en-tête X-Admin-Token """
+    admin_token = load_config().get('admin_token')
+    # Comparaison en temps constant (en octets : un en-tête non ASCII est refusé sans erreur)
+    return bool(admin_token) and hmac.compare_digest(request.headers.get('X-Admin-Token', '').encode(),
+                                                     admin_token.encode())
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    if request.headers.get('X-Profile') and is_admin_request():
+        request_profile = RequestProfile(request.endpoint)
+        try:
+            request_profile.start()
+            g.request_profile = request_profile
+        except ValueError:
+            app.logger.warning("Another profiler is already active, request not profiled.")
+
+@app.after_request
+def record_request_duration(response):
+    request_profile = g.pop('request_profile', None)
+    if request_profile is not None:
+        response.headers['X-Profile-Output'] = request_profile.stop()
+    start = g.pop('request_start', None)
+    if start is not None:
+        http_request_seconds.observe(time.perf_counter() - start, endpoint=request.endpoint or "unknown",
+                                     method=request.method, status=str(response.status_code))
+    return response
+
+def get_zones():
+    """ Registre des zones, reconstruit depuis la configuration courante (rechargée à chaud) """
+    return build_zones(load_config())
+
+def snapshot_zones():
+    return tuple(zone.name for zone in get_zones().sensed_zones())
+
 @app.route('/')
 def index():
+    zones = get_zones()
+    snapshot = get_dashboard_snapshot(snapshot_zones())
+    if snapshot is not None:
+        return render_template('index.html', zones=zones, water_level=snapshot['water_level'],
+                               moisture=snapshot['moisture'], system_state=snapshot['system_state'],
+                               last_rain_data=snapshot['last_rain'])
     water_level_data = get_water_level_data()
-    tomato_moisture = get_moisture_data("Tomato")
-    garden_moisture = get_moisture_data("Garden")
+    moisture = {zone.name: get_moisture_data(zone.name) for zone in zones.sensed_zones()}
     system_state = get_system_state()
     last_rain_data = fetch_last_rain_data()
-    return render_template('index.html', water_level=water_level_data, tomato_moisture=tomato_moisture,
-                           garden_moisture=garden_moisture, system_state=system_state, last_rain_data=last_rain_data)
+    return render_template('index.html', zones=zones, water_level=water_level_data, moisture=moisture,
+                           system_state=system_state, last_rain_data=last_rain_data)
+
+def daemon_command(command, message, **args):
+    """ Transmet une commande au démon d'arrosage (le front-end ne pilote jamais le matériel lui-même) """
+    try:
+        send_command(command, load_config().get('control_socket', DEFAULT_SOCKET_PATH), **args)
+    except ControlError as error:
+        app.logger.error(f"Command {command} failed: {error}")
+        return jsonify({"error": "Le démon d'arrosage est injoignable"}), 503
+    return jsonify({"message": message})
 
+def daemon_status():
+    """ Arrosage en cours selon le démon, ou None s'il ne répond pas """
+    try:
+        return send_command('status', load_config().get('control_socket', DEFAULT_SOCKET_PATH), timeout=1)
+    except ControlError:
+        return None
+
+def snapshot_version():
+    """
+    Validateur de /api/snapshot : dernières lignes des tables affichées, arrosage en cours selon le démon,
+    zones et quart d'heure de la courbe. Sans Last-Modified, l'état du démon n'ayant pas d'horodatage.
+    """
+    g.active_job = daemon_status()
+    marker, _ = get_data_version(WaterLevel, Precipitation, RainForecast, SystemState, Hygrometry)
+    if marker is None:
+        return None, None
+    sparkline_bucket = int(time.time()) // SPARKLINE_BUCKET
+    return json.dumps([marker, g.active_job, snapshot_zones(), sparkline_bucket], sort_keys=True, default=str), None
+
+@app.route('/api/snapshot')
+@conditional(snapshot_version)
+def api_snapshot():
+    """ État complet du tableau de bord en une réponse ; 304 sans le construire si rien n'a changé """
+    snapshot = get_dashboard_snapshot(snapshot_zones())
+    if snapshot is None:
+        return jsonify({'error': 'No data available'}), 503
+    body = json.dumps(dict(snapshot, active_job=g.active_job), sort_keys=True, separators=(',', ':'))
+    return Response(body, mimetype='application/json')
+
+@app.route('/water/<zone_name>')
+def water_zone(zone_name):
+    zone = get_zones().get(zone_name)
+    if zone is None:
+        return jsonify({'error': f'Unknown zone: {zone_name}'}), 404
+    try:
+        result = send_command('start_zone_watering', load_config().get('control_socket', DEFAULT_SOCKET_PATH),
+                              zone=zone.name, requested_by='web')
+    except ControlError as error:
+        app.logger.error(f"Command start_zone_watering failed: {error}")
+        return jsonify({"error": "Le démon d'arrosage est injoignable"}), 503
+    status = result.get("status")
+    if status == "queued":
+        return jsonify(dict(result, message=f"Arrosage de la zone {zone.name} programmé"))
+    if status == "duplicate":
+        return jsonify(dict(result, message=f"Arrosage de la zone {zone.name} déjà demandé"))
+    if status == "cooldown":
+        response = jsonify(dict(result, error=f"Zone {zone.name} arrosée récemment, "
+                                              f"réessayez dans {result.get('retry_after')} secondes"))
+        response.headers['Retry-After'] = str(result.get('retry_after', 0))
+        return response, 429
+    if status == "full":
+        return jsonify(dict(result, error="Trop d'arrosages en attente")), 409
+    return jsonify(dict(result, error=f"Zone inconnue du démon : {zone.name}")), 404
+
+# Anciennes routes du client iPhone : alias de /water/<zone> pour les zones historiques
 @app.route('/water-garden')
 def water_garden():
-    success = garden_app.start_garden_watering()
-    return jsonify({"message": "Arrosage du jardin en cours"})
+    return water_zone('Garden')
 
 @app.route('/water-tomatoes')
 def water_tomatoes():
-    success = garden_app.start_tomato_watering()
-    return jsonify({"message": "Arrosage des tomates en cours"})
+    return water_zone('Tomato')
 
 @app.route('/activate-faucet')
 def activate_faucet():
-    success = garden_app.start_annex_faucet()
-    return jsonify({"message": "Activation du robinet auxiliaire en cours"})
+    return water_zone('Annex')
+
+@app.route('/api/queue')
+def api_queue():
+    """ Arrosage en cours, arrosages en attente et délais entre arrosages manuels """
+    try:
+        return jsonify(send_command('queue', load_config().get('control_socket', DEFAULT_SOCKET_PATH), timeout=1))
+    except ControlError:
+        return jsonify({"error": "Le démon d'arrosage est injoignable"}), 503
+
+@app.route('/api/queue/<job_id>', methods=['DELETE'])
+def cancel_queued_job(job_id):
+    try:
+        result = send_command('cancel_job', load_config().get('control_socket', DEFAULT_SOCKET_PATH), job_id=job_id)
+    except ControlError as error:
+        app.logger.error(f"Command cancel_job failed: {error}")
+        return jsonify({"error": "Le démon d'arrosage est injoignable"}), 503
+    if not result.get("cancelled"):
+        return jsonify({"error": f"Arrosage inconnu ou terminé : {job_id}"}), 404
+    return jsonify({"message": "Arrosage annulé"})
 
 @app.route('/stop-watering')
 def stop_watering():
-    success = garden_app.stop_all_watering()
-    return jsonify({"message": "Tous les arrosages ont été arrêtés"})
+    return daemon_command('stop_watering', "Tous les arrosages ont été arrêtés")
 
 @app.route('/get-water-level')
 def get_water_level():
@@ -74,27 +207,64 @@ def get_last_rain_data():
     return jsonify({"rain_data": rain_data})
 
 @app.route('/water-level-chart-data')
+@conditional(lambda: get_data_version(WaterLevel))
 def water_level_chart_data():
-    water_level_data = get_water_level_chart_data()
+    water_level_data = get_water_level_chart_data(request.args.get('duration', '24h'))
     if not water_level_data:
         return jsonify({'error': 'No data available'}), 404
     return jsonify(water_level_data)
 
 @app.route('/watering-history')
+@conditional(lambda: get_data_version(WateringSession))
 def watering_history():
-    watering_sessions = get_watering_sessions()
+    # None : base injoignable, la page s'affiche vide
+    watering_sessions = get_watering_sessions() or []
     return render_template('watering_history.html', watering_sessions=watering_sessions)
 
 @app.route('/yearly-graph')
 def yearly_graph():
-    data = get_yearly_data()
-    return render_template('yearly_graph.html', data=data)
+    # Page légère : les séries sont chargées à la demande depuis /api/yearly/<series>
+    zones = [{'name': zone.name, 'slug': zone.slug, 'sensed': zone.soil_channel is not None}
+             for zone in get_zones()]
+    return render_template('yearly_graph.html', year=request.args.get('year', type=int), zones=zones)
+
+@app.route('/api/yearly/<series_name>')
+@conditional(lambda: get_data_version(DailyAggregate))
+def yearly_series(series_name):
+    if series_name not in series_definitions(get_zones()):
+        return jsonify({'error': f'Unknown series: {series_name}'}), 404
+    points = get_yearly_series(series_name, request.args.get('year', type=int))
+    if points is None:
+        return jsonify({'error': 'No data available'}), 503
+    return jsonify({'series': series_name, 'points': points})
 
 @app.route('/technical-cabinet-temperature')
+@conditional(lambda: get_data_version(TechnicalCabinetConditions, CpuTemperature, HourlyTemperature))
 def technical_cabinet_temperature():
-    data = get_technical_cabinet_data()
+    data = get_technical_cabinet_data() or {'technical_cabinet': [], 'cpu_temperature': [], 'external_temperature': []}
     return render_template('technical_cabinet_temperature.html', data=data)
 
+@app.route('/metrics')
+def metrics():
+    return Response(registry.render(), content_type=CONTENT_TYPE_LATEST)
+
+@app.route('/admin/profile', methods=['POST'])
+def admin_profile():
+    if not is_admin_request():
+        return jsonify({'error': 'Forbidden'}), 403
+    seconds = min(request.args.get('seconds', 10, type=float), MAX_PROFILE_SECONDS)
+    output_format = request.args.get('format', 'collapsed')
+    if output_format not in ('collapsed', 'speedscope'):
+        return jsonify({'error': 'Unknown format'}), 400
+    try:
+        profiler = SamplingProfiler().run(seconds)
+    except ProfilerBusyError:
+        return jsonify({'error': 'A profile is already running'}), 409
+    content, mimetype = profiler.render(output_format)
+    extension = 'speedscope.json' if output_format == 'speedscope' else 'collapsed'
+    return Response(content, mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename=profile-web.{extension}'})
+
 @app.route('/shutdown', methods=['POST'])
 def shutdown():
     stop_application()
@@ -0,0 +1,61 @@
+"""
+Mesure le temps jusqu'à la première requête servie par le front-end Flask.
+
+Chaque essai lance un interpréteur neuf qui importe `application`, puis sert une requête
+avec le client de test Flask. Le temps est mesuré depuis le processus parent
+(démarrage de l'interpréteur compris). Les essais des différentes versions sont entrelacés,
+pour qu'une variation de charge de la machine les touche toutes de la même façon.
+
+Pour comparer avec une version antérieure :
+    git worktree add /tmp/pigarden-baseline <commit>
+    python benchmarks/startup_benchmark.py --tree /tmp/pigarden-baseline --tree .
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+CHILD_CODE = """
+import sys
+import application
+response = application.app.test_client().get(sys.argv[1])
+sys.exit(0 if response.status_code < 500 else 1)
+"""
+
+
+def measure(tree, path):
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-c", CHILD_CODE, path], cwd=tree,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(f"Startup failed in {tree}:\n{result.stderr.decode(errors='replace')}")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tree", action="append", help="Répertoire contenant application.py (répétable)")
+    parser.add_argument("--path", default="/static/favicon.ico",
+                        help="URL demandée (par défaut un fichier statique, présent dans toutes les versions)")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    trees = args.tree or [os.path.dirname(os.path.dirname(os.path.realpath(__file__)))]
+    durations = {tree: [] for tree in trees}
+    for _ in range(args.runs):
+        for tree in trees:
+            durations[tree].append(measure(tree, args.path))
+    reference = statistics.median(durations[trees[0]])
+    for tree in trees:
+        median = statistics.median(durations[tree])
+        # Écart relatif à la première version indiquée (la référence)
+        delta = f", {(median - reference) * 1000:+.0f} ms vs {trees[0]}" if tree != trees[0] else ""
+        print(f"{tree}: median {median * 1000:.0f} ms, "
+              f"min {min(durations[tree]) * 1000:.0f} ms over {args.runs} runs{delta}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,2 +1,2 @@
 # config/__init__.py
-from .config_loader import load_config
+from .config_loader import load_config, get_config_service, ConfigService, ConfigError
@@ -1,13 +1,308 @@
+import ctypes
+import ctypes.util
 import json
+import logging
 import os
+import re
+import struct
+import threading
+import time
+from types import MappingProxyType
 
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), "config.json")
 
-def load_config():
-    # Get the absolute path to the directory where this script is located
-    script_dir = os.path.dirname(os.path.realpath(__file__))
+NUMBER = (int, float)
+
+# Schéma de config.json : clé -> (type(s) attendu(s), obligatoire)
+SCHEMA = {
+    "button_pins": (list, True),
+    "button_debounce_time": (int, True),
+    "relay_pins": (list, True),
+    "pump_relay_pin": (int, True),
+    "city_water_relay_pin": (int, True),
+    "tomato_relay_pin": (int, True),
+    "garden_relay_pin": (int, True),
+    "annex_relay_pin": (int, True),
+    "tomato_watering_duration": (NUMBER, True),
+    "garden_watering_duration": (NUMBER, True),
+    "annex_watering_duration": (NUMBER, True),
+    "minimum_water_level": (NUMBER, True),
+    "distance_sensor": (dict, True),
+    "dht11_pin": (int, True),
+    "email_address": (str, True),
+    "email_password": (str, True),
+    "smtp_server": (str, True),
+    "smtp_port": (int, True),
+    "recipient_address": (str, True),
+    "weatherapi_api_key": (str, True),
+    "latitude": (NUMBER, True),
+    "longitude": (NUMBER, True),
+    "ecowitt_application_key": (str, True),
+    "ecowitt_api_key": (str, True),
+    "meteo_station_mac_adresse": (str, True),
+    "database": (dict, True),
+    "moisture_threshold": (NUMBER, False),
+    "watering_times": (list, False),
+    "metrics_textfile": (str, False),
+    "admin_token": (str, False),
+    "profile_duration": (NUMBER, False),
+    "profile_format": (str, False),
+    "alerting": (dict, False),
+    "alert_rules": (list, False),
+    "control_socket": (str, False),
+    "retention": (dict, False),
+    "zones": (list, False),
+    "stop_button_pin": (int, False),
+    "closed_loop": (dict, False),
+    "rain_decision": (dict, False),
+    "cistern": (dict, False),
+    "journal_path": (str, False),
+    "job_queue": (dict, False),
+    "button_gestures": (dict, False),
+    "sampling": (dict, False),
+    "backfill": (dict, False),
+}
+
+# Anciennes clés des zones, facultatives lorsque la section zones est présente
+LEGACY_ZONE_KEYS = ("tomato_relay_pin", "garden_relay_pin", "annex_relay_pin", "tomato_watering_duration",
+                    "garden_watering_duration", "annex_watering_duration")
+
+# Champs d'une zone : champ -> (type(s) attendu(s), obligatoire)
+ZONE_SCHEMA = {
+    "name": (str, True),
+    "relay_pin": (int, True),
+    "soil_channel": (str, False),
+    "moisture_threshold": (NUMBER, False),
+    "manual_duration": (NUMBER, False),
+    "flow_rate": (NUMBER, False),
+    "priority": (int, False),
+    "button_pin": (int, False),
+    "automatic": (bool, False),
+    "target_moisture": (NUMBER, False),
+    "closed_loop": (bool, False),
+}
+
+NESTED_SCHEMA = {
+    "distance_sensor": {"trigger_pin": int, "echo_pin": int, "max_distance": NUMBER},
+    "database": {"user": str, "password": str, "host": str, "database": str},
+}
+
+# La section database dépend du moteur choisi (database.backend, "mariadb" par défaut)
+SQLITE_DATABASE_SCHEMA = {"path": str}
+DATABASE_BACKENDS = ("mariadb", "sqlite")
+MANUAL_POLICIES = ("queue", "preempt")
+# Heure quotidienne acceptée par schedule (.day.at) : HH:MM
+CLOCK_TIME = re.compile(r"^([01]\d|2[0-3]):[0-5]\d$")
+
+
+class ConfigError(ValueError):
+    """ Levée lorsque config.json est illisible ou ne respecte pas le schéma """
+
+
+def validate_config(config):
+    """ Vérifie les clés et les types de la configuration ; lève ConfigError avec toutes les erreurs """
+    if not isinstance(config, dict):
+        raise ConfigError("config.json must contain a JSON object")
+    errors = []
+    for key, (expected_type, required) in SCHEMA.items():
+        if key not in config:
+            if required and not (key in LEGACY_ZONE_KEYS and "zones" in config):
+                errors.append(f"missing key '{key}'")
+            continue
+        value = config[key]
+        # bool est une sous-classe d'int : on le refuse explicitement pour les nombres
+        if isinstance(value, bool) or not isinstance(value, expected_type):
+            errors.append(f"'{key}' has type {type(value).__name__}")
+    for key, fields in NESTED_SCHEMA.items():
+        section = config.get(key)
+        if not isinstance(section, dict):
+            continue
+        if key == "database":
+            backend = section.get("backend", "mariadb")
+            if backend not in DATABASE_BACKENDS:
+                errors.append(f"'database.backend' must be one of {', '.join(DATABASE_BACKENDS)}")
+            elif backend == "sqlite":
+                fields = SQLITE_DATABASE_SCHEMA
+        for field, expected_type in fields.items():
+            if field not in section:
+                errors.append(f"missing key '{key}.{field}'")
+            elif isinstance(section[field], bool) or not isinstance(section[field], expected_type):
+                errors.append(f"'{key}.{field}' has type {type(section[field]).__name__}")
+    if isinstance(config.get("zones"), list):
+        errors.extend(validate_zones(config["zones"]))
+    if isinstance(config.get("watering_times"), list):
+        for index, watering_time in enumerate(config["watering_times"]):
+            if not isinstance(watering_time, str) or not CLOCK_TIME.match(watering_time):
+                errors.append(f"'watering_times[{index}]' must be a time formatted as HH:MM")
+    if isinstance(config.get("job_queue"), dict):
+        policy = config["job_queue"].get("manual_policy", "preempt")
+        if policy not in MANUAL_POLICIES:
+            errors.append(f"'job_queue.manual_policy' must be one of {', '.join(MANUAL_POLICIES)}")
+    if errors:
+        raise ConfigError("Invalid configuration: " + "; ".join(errors))
+    return config
+
+
+def validate_zones(zones):
+    errors = []
+    names = set()
+    for index, zone in enumerate(zones):
+        if not isinstance(zone, dict):
+            errors.append(f"'zones[{index}]' must be an object")
+            continue
+        for field, (expected_type, required) in ZONE_SCHEMA.items():
+            if field not in zone:
+                if required:
+                    errors.append(f"missing key 'zones[{index}].{field}'")
+                continue
+            value = zone[field]
+            if (expected_type is not bool and isinstance(value, bool)) or not isinstance(value, expected_type):
+                errors.append(f"'zones[{index}].{field}' has type {type(value).__name__}")
+        for field in set(zone) - set(ZONE_SCHEMA):
+            errors.append(f"unknown key 'zones[{index}].{field}'")
+        name = str(zone.get("name", "")).lower()
+        if name in names:
+            errors.append(f"duplicate zone name '{zone['name']}'")
+        names.add(name)
+    return errors
+
+
+def freeze(value):
+    """ Rend une configuration immuable (dict -> mappingproxy, list -> tuple) """
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+class ConfigService:
+    """
+    Charge config.json une seule fois, le valide et partage un instantané immuable.
+    Sur modification du fichier, le nouvel instantané est publié atomiquement aux abonnés
+    (callback(nouvelle_config, ancienne_config)) ; une configuration invalide est ignorée.
+    """
+
+    def __init__(self, path=CONFIG_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.subscribers = []
+        self.watcher = None
+        self.snapshot = self._read()
+
+    def _read(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as config_file:
+                return freeze(validate_config(json.load(config_file)))
+        except json.JSONDecodeError as e:
+            raise ConfigError(f"Invalid JSON in {self.path}: {e}") from e
 
-    # Combine the script directory with the relative path to form an absolute path to config.json
-    config_path = os.path.join(script_dir, "config.json")
+    def get(self):
+        return self.snapshot
 
-    with open(config_path, "r", encoding="utf-8") as config_file:
-        return json.load(config_file)
+    def subscribe(self, callback):
+        with self.lock:
+            self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        with self.lock:
+            if callback in self.subscribers:
+                self.subscribers.remove(callback)
+
+    def reload(self):
+        """ Relit le fichier ; renvoie True si une nouvelle configuration a été publiée """
+        try:
+            new_snapshot = self._read()
+        except (OSError, ConfigError) as e:
+            logging.error(f"Configuration reload rejected, keeping the current one: {e}")
+            return False
+        with self.lock:
+            old_snapshot = self.snapshot
+            if new_snapshot == old_snapshot:
+                return False
+            self.snapshot = new_snapshot
+            subscribers = list(self.subscribers)
+        logging.info("Configuration reloaded from %s", self.path)
+        for callback in subscribers:
+            try:
+                callback(new_snapshot, old_snapshot)
+            except Exception as e:
+                logging.error(f"Error in configuration subscriber {callback}: {e}")
+        return True
+
+    def start_watching(self, poll_interval=5):
+        """ Surveille le fichier (inotify sous Linux, sinon scrutation de la date de modification) """
+        if self.watcher is not None:
+            return
+        target = self._watch_inotify if _libc_inotify() is not None else self._watch_polling
+        self.watcher = threading.Thread(target=target, args=(poll_interval,), name="config-watcher", daemon=True)
+        self.watcher.start()
+
+    def _watch_inotify(self, poll_interval):
+        libc = _libc_inotify()
+        directory, file_name = os.path.split(self.path)
+        fd = libc.inotify_init1(os.O_CLOEXEC)
+        # Les éditeurs remplacent souvent le fichier : on surveille le répertoire
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+        if fd < 0 or libc.inotify_add_watch(fd, directory.encode(), mask) < 0:
+            logging.warning("inotify unavailable, falling back to polling for config changes")
+            self._watch_polling(poll_interval)
+            return
+        header_size = struct.calcsize("iIII")
+        while True:
+            data = os.read(fd, 4096)
+            changed = False
+            offset = 0
+            while offset + header_size <= len(data):
+                _, _, _, name_length = struct.unpack_from("iIII", data, offset)
+                name = data[offset + header_size:offset + header_size + name_length].rstrip(b"\0").decode()
+                offset += header_size + name_length
+                changed = changed or name == file_name
+            if changed:
+                self.reload()
+
+    def _watch_polling(self, poll_interval):
+        last_mtime = None
+        while True:
+            try:
+                mtime = os.stat(self.path).st_mtime
+            except OSError:
+                mtime = None
+            if last_mtime is not None and mtime is not None and mtime != last_mtime:
+                self.reload()
+            last_mtime = mtime
+            time.sleep(poll_interval)
+
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+
+_libc = None
+
+
+def _libc_inotify():
+    global _libc
+    if _libc is None:
+        library = ctypes.util.find_library("c")
+        libc = ctypes.CDLL(library, use_errno=True) if library else None
+        _libc = libc if libc is not None and hasattr(libc, "inotify_init1") else False
+    return _libc or None
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_config_service():
+    """ Renvoie le service de configuration partagé par tout le processus """
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = ConfigService()
+        return _service
+
+
+def load_config():
+    """ Renvoie l'instantané courant (immuable) de config.json, chargé une seule fois par processus """
+    return get_config_service().get()
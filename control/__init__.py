@@ -0,0 +1,2 @@
+# control/__init__.py
+from .channel import CommandServer, ControlError, send_command, DEFAULT_SOCKET_PATH
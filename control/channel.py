@@ -0,0 +1,82 @@
+import json
+import logging
+import os
+import socket
+import socketserver
+import threading
+
+DEFAULT_SOCKET_PATH = "/tmp/pigarden.sock"
+
+
+class ControlError(RuntimeError):
+    """ Levée lorsque le démon d'arrosage est injoignable ou refuse la commande """
+
+
+class _CommandHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        try:
+            request = json.loads(line)
+            response = self.server.dispatch(request.get("command"), request.get("args") or {})
+        except Exception as e:
+            logging.error(f"Control command failed: {e}")
+            response = {"ok": False, "error": str(e)}
+        self.wfile.write(json.dumps(response, default=str).encode() + b"\n")
+
+
+class _ThreadingUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class CommandServer(_ThreadingUnixServer):
+    """
+    Canal de commande du démon : une requête JSON par connexion sur une socket Unix.
+    Les commandes `background` (arrosages) sont lancées dans un thread et la réponse est immédiate.
+    """
+
+    def __init__(self, socket_path, commands, background_commands=()):
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        self.socket_path = socket_path
+        self.commands = commands
+        self.background_commands = set(background_commands)
+        super().__init__(socket_path, _CommandHandler)
+        os.chmod(socket_path, 0o660)
+
+    def dispatch(self, command, args):
+        if command not in self.commands:
+            return {"ok": False, "error": f"Unknown command: {command}"}
+        handler = self.commands[command]
+        if command in self.background_commands:
+            threading.Thread(target=handler, kwargs=args, name=f"command-{command}", daemon=True).start()
+            return {"ok": True, "result": "started"}
+        return {"ok": True, "result": handler(**args)}
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="control-channel", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+
+def send_command(command, socket_path=DEFAULT_SOCKET_PATH, timeout=5, **args):
+    """ Envoie une commande au démon et renvoie son résultat ; lève ControlError en cas d'échec """
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.settimeout(timeout)
+            client.connect(socket_path)
+            client.sendall(json.dumps({"command": command, "args": args}).encode() + b"\n")
+            with client.makefile("rb") as stream:
+                line = stream.readline()
+    except OSError as e:
+        raise ControlError(f"Watering daemon unreachable on {socket_path}: {e}") from e
+    if not line:
+        raise ControlError("Empty response from the watering daemon")
+    response = json.loads(line)
+    if not response.get("ok"):
+        raise ControlError(response.get("error", "Command failed"))
+    return response.get("result")
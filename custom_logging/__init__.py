@@ -1,2 +1,2 @@
 # logging/__init__.py
-from .logger_setup import setup_logger
+from .logger_setup import setup_logger, stop_logging
@@ -1,8 +1,128 @@
+import atexit
+import json
 import logging
 import os
+import queue
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, WatchedFileHandler
+
+from monitoring.metrics import registry
+
+QUEUE_SIZE = 10000
+
+CONSOLE_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+dropped_records = registry.counter(
+    "pigarden_log_records_dropped_total", "Enregistrements de log perdus car la file était pleine", ("file",))
+
+# Un pipeline (file d'attente + thread d'écriture) par fichier de log, partagé par tous les loggers
+_pipelines = {}
+_pipelines_lock = threading.Lock()
+
+
+class JsonFormatter(logging.Formatter):
+    """ Formate chaque enregistrement en une ligne JSON """
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "module": record.module,
+            "line": record.lineno,
+            "thread": record.threadName,
+        }
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    QueueHandler qui ne bloque jamais : si la file est pleine, les messages inférieurs à WARNING
+    sont abandonnés, les autres remplacent le plus ancien message en attente.
+    """
+
+    def __init__(self, record_queue, file_name):
+        super().__init__(record_queue)
+        self.file_name = file_name
+
+    def prepare(self, record):
+        # Le message est figé ici (les arguments peuvent être modifiés après l'appel),
+        # mais la trace de l'exception reste séparée pour le formateur JSON.
+        record.message = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg = record.message
+        record.args = None
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            if record.levelno < logging.WARNING:
+                dropped_records.inc(file=self.file_name)
+                return
+            try:
+                self.queue.get_nowait()
+                dropped_records.inc(file=self.file_name)
+            except queue.Empty:
+                pass
+            try:
+                self.queue.put_nowait(record)
+            except queue.Full:
+                dropped_records.inc(file=self.file_name)
+
+
+def _build_file_handler(log_path):
+    # Démon, front-end et workers écrivent dans les mêmes fichiers (lignes ajoutées en O_APPEND) :
+    # aucun processus ne fait tourner les fichiers, logrotate s'en charge (voir custom_logging/logrotate.conf)
+    # et chaque processus rouvre le fichier dès qu'il a été déplacé
+    file_handler = WatchedFileHandler(log_path, encoding="utf-8")
+    file_handler.setFormatter(JsonFormatter())
+    return file_handler
+
+
+def _get_pipeline(log_file_name, log_path):
+    with _pipelines_lock:
+        queue_handler = _pipelines.get(log_path)
+        if queue_handler is None:
+            stream_handler = logging.StreamHandler()
+            stream_handler.setFormatter(logging.Formatter(CONSOLE_FORMAT))
+            listener = QueueListener(
+                queue.Queue(maxsize=QUEUE_SIZE),
+                _build_file_handler(log_path),
+                stream_handler,
+                respect_handler_level=True,
+            )
+            queue_handler = DroppingQueueHandler(listener.queue, log_file_name)
+            queue_handler.listener = listener
+            listener.start()
+            _pipelines[log_path] = queue_handler
+        return queue_handler
+
+
+def stop_logging():
+    """ Vide les files d'attente et arrête les threads d'écriture (appelé à la sortie du programme) """
+    with _pipelines_lock:
+        for queue_handler in _pipelines.values():
+            queue_handler.listener.stop()
+        _pipelines.clear()
+
+
+atexit.register(stop_logging)
 
 
 def setup_logger(log_file_name, logger_name=None):
+    """
+    Configure un logger qui écrit de façon asynchrone dans custom_logging/<log_file_name>.
+    Peut être appelé plusieurs fois pour le même logger sans dupliquer les lignes.
+    La rotation des fichiers est laissée à logrotate.
+    """
     # Get the absolute path to the directory where this script is located
     script_dir = os.path.dirname(os.path.realpath(__file__))
 
@@ -11,23 +131,15 @@ def setup_logger(log_file_name, logger_name=None):
 
     logger = logging.getLogger(logger_name)
     logger.setLevel(logging.INFO)
+    # Les lignes ne remontent pas aux handlers du logger racine : elles seraient affichées deux fois
+    logger.propagate = False
 
-    # Formatter for the logs
-    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-
-    # File handler
-    file_handler = logging.FileHandler(log_path)
-    file_handler.setFormatter(formatter)
-    logger.addHandler(file_handler)
-
-    # Stream handler for console output (optional)
-    stream_handler = logging.StreamHandler()
-    stream_handler.setFormatter(formatter)
-    logger.addHandler(stream_handler)
+    queue_handler = _get_pipeline(log_file_name, log_path)
+    if queue_handler not in logger.handlers:
+        logger.addHandler(queue_handler)
 
     # Setting log level for requests and urllib3 to WARNING to avoid DEBUG messages
     logging.getLogger("requests").setLevel(logging.WARNING)
     logging.getLogger("urllib3").setLevel(logging.WARNING)
 
     return logger
-
@@ -0,0 +1,81 @@
+"""
+Agrégats journaliers des séries du graphique annuel.
+
+Les agrégats sont recalculés toutes les heures à partir du dernier jour agrégé (inclus, car il était
+incomplet) : chaque rafraîchissement ne lit qu'un jour de mesures brutes, quelle que soit la date.
+"""
+from sqlalchemy import delete, func, select
+
+from custom_logging import setup_logger
+from data_management.database import get_engine, time_bucket
+from models import (
+    DailyAggregate, WaterLevel, Hygrometry, HourlyRain, WateringSession, HourlyTemperature, HourlySunlight,
+    HourlyHumidity, HourlyWind
+)
+
+DAY = 86400
+
+# Série -> (colonne horodatée, colonne agrégée, fonction d'agrégation, filtre éventuel)
+SERIES = {
+    "water_level": (WaterLevel.time, WaterLevel.level, func.avg, None),
+    "rain": (HourlyRain.time, HourlyRain.amount, func.sum, None),
+    "temperature": (HourlyTemperature.time, HourlyTemperature.temperature, func.avg, None),
+    "sunlight": (HourlySunlight.time, HourlySunlight.solar_radiation, func.avg, None),
+    "humidity": (HourlyHumidity.time, HourlyHumidity.humidity, func.avg, None),
+    "wind": (HourlyWind.time, HourlyWind.wind_speed, func.avg, None),
+}
+
+
+def series_definitions(zones):
+    """ Séries communes et, pour chaque zone du registre, son humidité et sa durée d'arrosage journalières """
+    definitions = dict(SERIES)
+    for zone in zones:
+        if zone.soil_channel is not None:
+            definitions[f"hygrometry_{zone.slug}"] = (Hygrometry.time, Hygrometry.level, func.avg,
+                                                      Hygrometry.zone == zone.name)
+        definitions[f"watering_{zone.slug}"] = (WateringSession.time, WateringSession.duration, func.sum,
+                                                WateringSession.zone == zone.name)
+    return definitions
+
+
+logger = setup_logger('log_watering_garden.log', 'aggregates')
+
+
+def refresh_series(connection, name, definition, since=None):
+    """
+    Recalcule les agrégats d'une série depuis son dernier jour agrégé, ou depuis le jour de `since` s'il est
+    antérieur (mesures rattrapées) ; renvoie le nombre de jours écrits
+    """
+    time_column, value_column, aggregate, condition = definition
+    last = connection.execute(
+        select(func.max(DailyAggregate.time)).where(DailyAggregate.series == name)).scalar()
+    if last is not None and since is not None:
+        since = min(last, since.replace(hour=0, minute=0, second=0, microsecond=0))
+    else:
+        since = last
+    day = time_bucket(time_column, DAY)
+    query = select(day.label("day"), aggregate(value_column)).group_by(day)
+    if condition is not None:
+        query = query.where(condition)
+    if since is not None:
+        query = query.where(time_column >= since)
+    rows = [{"series": name, "time": row_day, "value": value}
+            for row_day, value in connection.execute(query) if value is not None]
+    if since is not None:
+        connection.execute(delete(DailyAggregate).where(DailyAggregate.series == name,
+                                                        DailyAggregate.time >= since))
+    if rows:
+        connection.execute(DailyAggregate.__table__.insert(), rows)
+    return len(rows)
+
+
+def refresh_aggregates(engine=None, zones=(), since=None):
+    """ Rafraîchit toutes les séries, dont celles des `zones` (une transaction courte par série) """
+    engine = engine or get_engine()
+    for name, definition in series_definitions(zones).items():
+        try:
+            with engine.begin() as connection:
+                count = refresh_series(connection, name, definition, since)
+            logger.debug("Daily aggregates refreshed for %s: %s days", name, count)
+        except Exception as error:
+            logger.error("Failed to refresh daily aggregates for %s. Exception: %s", name, str(error))
@@ -0,0 +1,200 @@
+"""
+Rattrapage des trous de l'historique météo à partir de l'historique Ecowitt.
+
+Lorsque le Raspberry est éteint ou le réseau coupé, les tables hourly_* ont des trous. Une seule requête
+(fonction de fenêtre LEAD sur chaque table, réunies par UNION ALL) liste les écarts trop longs entre deux
+mesures consécutives, ou entre la dernière mesure et maintenant (arrêt que le démon vient de rattraper au
+démarrage). Les heures manquantes de toutes les tables sont regroupées en plages puis demandées par blocs de
+`chunk_hours` heures (une requête d'historique pour les cinq variables), dans la limite de `max_requests`
+requêtes et du budget Ecowitt partagé. Chaque heure est écrite avec l'horodatage de sa fin par
+un upsert sur la clé naturelle (time) de la table : un nouveau passage ne crée pas de doublon.
+
+    python -m data_management.backfill     # liste les trous sans rien rattraper
+
+Réglages dans la section `backfill` de config.json.
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, literal, select, union_all
+
+from config import load_config
+from custom_logging import setup_logger
+from data_management.aggregates import refresh_aggregates
+from data_management.database import get_engine, seconds_between, upsert
+from models import HourlyRain, HourlyTemperature, HourlyWind, HourlySunlight, HourlyHumidity
+from monitoring.metrics import registry
+
+HOUR = 3600
+
+DEFAULT_SETTINGS = {
+    "enabled": True,
+    "time": "00:20",
+    "lookback_days": 30,
+    "max_gap": 3 * HOUR,  # écart entre deux mesures au-delà duquel des heures manquent
+    "sample_window": 2 * HOUR,  # période que peut couvrir une mesure, jamais recouverte par le rattrapage
+    "chunk_hours": 24,
+    "max_requests": 24,  # requêtes d'historique par passage
+    "reserve": 20,  # requêtes du budget Ecowitt laissées à l'échantillonnage
+    "pause": 1.0,
+}
+
+# Table -> (modèle, colonne de la valeur, variable de WeatherAPI.RECENT_WEATHER)
+TABLES = {
+    "hourly_rain": (HourlyRain, "amount", "rain"),
+    "hourly_temperature": (HourlyTemperature, "temperature", "temperature"),
+    "hourly_wind": (HourlyWind, "wind_speed", "wind"),
+    "hourly_sunlight": (HourlySunlight, "solar_radiation", "sunlight"),
+    "hourly_humidity": (HourlyHumidity, "humidity", "humidity"),
+}
+
+# Résolution des relevés Ecowitt selon leur ancienneté (jours de conservation de chaque cycle)
+CYCLE_TYPES = ((90, "5min"), (365, "30min"), (730, "4hour"))
+
+rows_backfilled = registry.counter(
+    "pigarden_backfill_rows_total", "Lignes ajoutées par le rattrapage de l'historique", ("table",))
+
+logger = setup_logger('log_watering_garden.log', 'backfill')
+
+
+def backfill_settings(config):
+    settings = dict(DEFAULT_SETTINGS)
+    settings.update(config.get("backfill", {}))
+    return settings
+
+
+def find_gaps(connection, since, max_gap, until=None):
+    """
+    Écarts de plus de `max_gap` secondes entre deux mesures consécutives, la dernière mesure étant suivie
+    de `until` (maintenant par défaut) : [(table, début, fin)]
+    """
+    until = until or datetime.now()
+    selects = [
+        select(literal(table).label("series"), model.time.label("gap_start"),
+               func.coalesce(func.lead(model.time, type_=model.time.type).over(order_by=model.time),
+                             literal(until, type_=model.time.type), type_=model.time.type).label("gap_end"))
+        .where(model.time >= since)
+        for table, (model, _, _) in TABLES.items()
+    ]
+    gaps = union_all(*selects).subquery()
+    query = (select(gaps.c.series, gaps.c.gap_start, gaps.c.gap_end)
+             .where(seconds_between(gaps.c.gap_start, gaps.c.gap_end) > max_gap)
+             .order_by(gaps.c.gap_start))
+    return [tuple(row) for row in connection.execute(query)]
+
+
+def missing_hours(gap_start, gap_end, sample_window):
+    """
+    Fins des heures entières à rattraper dans un trou : après la mesure qui l'ouvre,
+    et avant la période que peut couvrir la mesure qui le ferme
+    """
+    # Première heure entièrement après la mesure d'ouverture : celle qui suit l'heure pleine atteinte ou dépassée
+    hour_start = gap_start.replace(minute=0, second=0, microsecond=0)
+    if hour_start < gap_start:
+        hour_start += timedelta(hours=1)
+    hour_end = hour_start + timedelta(hours=1)
+    last = gap_end - timedelta(seconds=sample_window)
+    hours = []
+    while hour_end <= last:
+        hours.append(hour_end)
+        hour_end += timedelta(hours=1)
+    return hours
+
+
+def hour_ranges(hours, chunk_hours):
+    """ Regroupe des fins d'heures triées en plages contiguës d'au plus `chunk_hours` heures : [(début, fin)] """
+    ranges = []
+    for hour_end in hours:
+        if ranges and hour_end - ranges[-1][1] == timedelta(hours=1) \
+                and ranges[-1][1] - ranges[-1][0] < timedelta(hours=chunk_hours):
+            ranges[-1][1] = hour_end
+        else:
+            ranges.append([hour_end - timedelta(hours=1), hour_end])
+    return [tuple(hour_range) for hour_range in ranges]
+
+
+def cycle_type(start):
+    age = (datetime.now() - start).days
+    for days, cycle in CYCLE_TYPES:
+        if age < days:
+            return cycle
+    return "1day"
+
+
+def hourly_values(samples, hours, aggregate):
+    """ Agrège des relevés {horodatage unix: valeur} par heure : {fin de l'heure: valeur} """
+    buckets = {}
+    for timestamp, value in samples.items():
+        moment = datetime.fromtimestamp(timestamp)
+        hour_end = moment.replace(minute=0, second=0, microsecond=0)
+        if moment != hour_end:
+            hour_end += timedelta(hours=1)
+        if hour_end in hours:
+            buckets.setdefault(hour_end, []).append(value)
+    return {hour_end: aggregate(values) for hour_end, values in buckets.items()}
+
+
+def upsert_hours(connection, table, rows):
+    """ Écrit {heure: valeur} en un lot, sur la clé naturelle (time) de la table ; renvoie le nombre de lignes """
+    model, column, _ = TABLES[table]
+    upsert(connection, model, [{"time": hour_end, column: round(value, 2)} for hour_end, value in sorted(rows.items())])
+    return len(rows)
+
+
+def run_backfill(weather_api, config=None, engine=None, budget=None):
+    """ Rattrape les heures manquantes des tables hourly_* ; renvoie le nombre de lignes ajoutées par table """
+    config = config or load_config()
+    settings = backfill_settings(config)
+    engine = engine or get_engine()
+    since = datetime.now() - timedelta(days=settings["lookback_days"])
+    with engine.connect() as connection:
+        gaps = find_gaps(connection, since, settings["max_gap"])
+
+    missing = {}
+    for table, gap_start, gap_end in gaps:
+        for hour_end in missing_hours(gap_start, gap_end, settings["sample_window"]):
+            missing.setdefault(hour_end, set()).add(table)
+    if not missing:
+        logger.info("Backfill: no gap in the weather history")
+        return {}
+
+    inserted = {}
+    ranges = hour_ranges(sorted(missing), settings["chunk_hours"])
+    logger.info("Backfill: %s missing hours in %s ranges", len(missing), len(ranges))
+    for index, (start, end) in enumerate(ranges):
+        if index >= settings["max_requests"]:
+            logger.info("Backfill: request limit reached, %s ranges left for the next run", len(ranges) - index)
+            break
+        if budget is not None and budget.available() <= settings["reserve"]:
+            logger.info("Backfill: Ecowitt budget reserved for sampling, %s ranges left", len(ranges) - index)
+            break
+        # L'API attend des dates UTC ; les tables sont en heure locale
+        history = weather_api.get_weather_history(datetime.utcfromtimestamp(start.timestamp()),
+                                                  datetime.utcfromtimestamp(end.timestamp()), cycle_type(start))
+        with engine.begin() as connection:
+            for table, (_, _, variable) in TABLES.items():
+                hours = {hour_end for hour_end in missing if start < hour_end <= end and table in missing[hour_end]}
+                aggregate = weather_api.RECENT_WEATHER[variable][3]
+                rows = hourly_values(history.get(variable, {}), hours, aggregate)
+                count = upsert_hours(connection, table, rows)
+                if count:
+                    inserted[table] = inserted.get(table, 0) + count
+                    rows_backfilled.inc(count, table=table)
+        time.sleep(settings["pause"])
+    if inserted:
+        # Les jours complétés sont réagrégés pour le graphique annuel
+        refresh_aggregates(engine, since=min(missing))
+    logger.info("Backfill completed: %s", ", ".join(f"{table} +{count}" for table, count in inserted.items())
+                or "no data returned")
+    return inserted
+
+
+if __name__ == "__main__":
+    argparse.ArgumentParser(description="Liste les trous de l'historique météo (hourly_*)").parse_args()
+    settings = backfill_settings(load_config())
+    with get_engine().connect() as connection:
+        for table, gap_start, gap_end in find_gaps(connection, datetime.now() - timedelta(
+                days=settings["lookback_days"]), settings["max_gap"]):
+            print(f"{table}: {gap_start} -> {gap_end} "
+                  f"({len(missing_hours(gap_start, gap_end, settings['sample_window']))} missing hours)")
@@ -1,44 +1,85 @@
-from sqlalchemy.orm import sessionmaker
 import logging
-from config import load_config
-from data_management.database import engine
+from datetime import datetime, timedelta
+from data_management.database import SessionLocal, bucket_time, upsert
 from models import (
     CpuTemperature, TechnicalCabinetConditions, WaterLevel, RainForecast, Precipitation,
-    Hygrometry, SystemState, WateringSession, HourlyRain, HourlyTemperature, HourlyWind,
+    Hygrometry, SystemState, WateringSession, WateringTrajectory, WateringDecision, HourlyRain, HourlyTemperature, HourlyWind,
     HourlySunlight, HourlyHumidity
 )
 from custom_logging import setup_logger
+from monitoring.metrics import db_write_seconds
 
 # Configurer le logger
 app_logger = setup_logger('log_watering_garden.log', 'data_logger')
 
-# Charger la configuration
-config = load_config()
-db_config = config['database']
-DATABASE_URL = f"mariadb+mariadbconnector://{db_config['user']}:{db_config['password']}@{db_config['host']}/{db_config['database']}"
+# Abonnés aux mesures (moteur de règles d'alerte...) : appelés pour chaque valeur enregistrée
+measurement_listeners = []
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def add_measurement_listener(listener):
+    """ Abonne `listener(metric, value)` à toutes les mesures enregistrées """
+    if listener not in measurement_listeners:
+        measurement_listeners.append(listener)
+
+
+def publish_measurement(metric, value):
+    """ Transmet une mesure aux abonnés, indépendamment du succès de l'écriture en base """
+    for listener in measurement_listeners:
+        try:
+            listener(metric, value)
+        except Exception as error:
+            app_logger.error("Error in measurement listener for %s. Exception: %s", metric, str(error))
+
+
+# Arrondi de l'horodatage des tables de mesures (secondes) : il forme leur clé naturelle avec la zone éventuelle.
+# Il reste inférieur à l'intervalle d'échantillonnage le plus court de chaque mesure.
+BUCKET_SECONDS = {
+    CpuTemperature: 60,
+    TechnicalCabinetConditions: 60,
+    WaterLevel: 60,
+    RainForecast: 60,
+    Precipitation: 60,
+    Hygrometry: 300,
+    HourlyRain: 300,
+    HourlyTemperature: 300,
+    HourlyWind: 300,
+    HourlySunlight: 300,
+    HourlyHumidity: 300,
+}
+
+
+def save_measurements(model, rows, moment=None):
+    """
+    Enregistre des mesures en un lot : l'horodatage est arrondi à l'intervalle de la table, et une mesure déjà
+    enregistrée pour la même clé naturelle est remplacée au lieu d'être dupliquée (lectures répétées, reprises)
+    """
+    moment = moment or datetime.now()
+    seconds = BUCKET_SECONDS[model]
+    session = SessionLocal()
+    try:
+        upsert(session, model, [dict(row, time=bucket_time(row.get("time", moment), seconds)) for row in rows])
+        session.commit()
+    finally:
+        session.close()
 
 
 # Fonctions de journalisation
+@db_write_seconds.time(table="cpu_temperature")
 def log_cpu_temperature(temperature):
     """ Enregistre la température du processeur dans la base de données """
     if temperature is None:
         app_logger.warning("Attempted to log None as CPU temperature")
         return
     rounded_temperature = round(temperature, 2)
+    publish_measurement("cpu_temperature", rounded_temperature)
     try:
-        session = SessionLocal()
-        cpu_temp = CpuTemperature(temperature=rounded_temperature)
-        session.add(cpu_temp)
-        session.commit()
+        save_measurements(CpuTemperature, [dict(temperature=rounded_temperature)])
         app_logger.info("CPU temperature data saved to database. Temperature: %s °C", rounded_temperature)
     except Exception as error:
         app_logger.error("Error saving CPU temperature data to database. Exception: %s", str(error))
-    finally:
-        session.close()
 
 
+@db_write_seconds.time(table="technical_cabinet_conditions")
 def log_technical_cabinet_conditions(temperature, humidity):
     """ Enregistre la température et l'humidité de l'armoire technique dans la base de données """
     if temperature is None or humidity is None:
@@ -46,70 +87,70 @@ def log_technical_cabinet_conditions(temperature, humidity):
         return
     rounded_temperature = round(temperature, 2)
     rounded_humidity = round(humidity, 2)
+    publish_measurement("cabinet_temperature", rounded_temperature)
+    publish_measurement("cabinet_humidity", rounded_humidity)
     try:
-        session = SessionLocal()
-        tech_conditions = TechnicalCabinetConditions(temperature=rounded_temperature, humidity=rounded_humidity)
-        session.add(tech_conditions)
-        session.commit()
+        save_measurements(TechnicalCabinetConditions,
+                          [dict(temperature=rounded_temperature, humidity=rounded_humidity)])
         app_logger.info("Technical cabinet conditions data saved to database. Temperature: %s °C, Humidity: %s %%", rounded_temperature, rounded_humidity)
     except Exception as error:
         app_logger.error("Error saving technical cabinet conditions data to database. Exception: %s", str(error))
-    finally:
-        session.close()
 
+@db_write_seconds.time(table="water_level")
 def log_water_level(level):
     """ Enregistre le niveau de l'eau dans la base de données """
     rounded_level = round(level, 1)  # Arrondi à une décimale
+    publish_measurement("water_level", rounded_level)
     try:
-        session = SessionLocal()
-        water_level = WaterLevel(level=rounded_level)
-        session.add(water_level)
-        session.commit()
+        save_measurements(WaterLevel, [dict(level=rounded_level)])
         app_logger.info("Water level data saved to database. Level: %s", rounded_level)
     except Exception as error:
         app_logger.error("Error saving water level data to database. Exception: %s", str(error))
-    finally:
-        session.close()
 
+@db_write_seconds.time(table="rain_forecast")
 def log_rain_forecast(amount):
     """ Enregistre les prévisions de pluie dans la base de données """
+    publish_measurement("rain_forecast", amount)
     try:
-        session = SessionLocal()
-        rain_forecast = RainForecast(amount=amount)
-        session.add(rain_forecast)
-        session.commit()
+        save_measurements(RainForecast, [dict(amount=amount)])
         app_logger.info("Rain forecast data saved to database. Amount: %s mm", amount)
     except Exception as error:
         app_logger.error("Error saving rain forecast data to database. Exception: %s", str(error))
-    finally:
-        session.close()
 
+@db_write_seconds.time(table="precipitation")
 def log_last_12h_rain(amount):
     """ Enregistre le volume de pluie réel tombé dans la base de données """
+    publish_measurement("rain_last_12h", amount)
     try:
-        session = SessionLocal()
-        precipitation = Precipitation(amount=amount)
-        session.add(precipitation)
-        session.commit()
+        save_measurements(Precipitation, [dict(amount=amount)])
         app_logger.info("Actual rain data saved to database. Amount: %s mm", amount)
     except Exception as error:
         app_logger.error("Error saving actual rain data to database. Exception: %s", str(error))
-    finally:
-        session.close()
 
+@db_write_seconds.time(table="hygrometry")
 def log_soil_moisture(level, zone="general"):
     """ Enregistre les données d'humidité du sol dans la base de données """
+    publish_measurement(f"soil_moisture.{zone}", level)
     try:
-        session = SessionLocal()
-        hygrometry = Hygrometry(level=level, zone=zone)
-        session.add(hygrometry)
-        session.commit()
+        save_measurements(Hygrometry, [dict(level=level, zone=zone)])
         app_logger.info("Soil moisture data saved to database. Level: %s, Zone: %s", level, zone)
     except Exception as error:
         app_logger.error("Error saving soil moisture data to database. Exception: %s", str(error))
-    finally:
-        session.close()
 
+@db_write_seconds.time(table="hygrometry")
+def log_soil_moistures(levels):
+    """ Enregistre l'humidité du sol de plusieurs zones ({zone: niveau}) en un seul lot """
+    for zone, level in levels.items():
+        publish_measurement(f"soil_moisture.{zone}", level)
+    if not levels:
+        return
+    try:
+        save_measurements(Hygrometry, [dict(level=level, zone=zone) for zone, level in levels.items()])
+        app_logger.info("Soil moisture data saved to database for %s zones.", len(levels))
+    except Exception as error:
+        app_logger.error("Error saving soil moisture data to database. Exception: %s", str(error))
+
+@db_write_seconds.time(table="system_state")
 def log_system_state(state, zone, source, mode):
     """ Enregistre l'état de l'arrosage dans la base de données """
     try:
@@ -123,104 +164,116 @@ def log_system_state(state, zone, source, mode):
     finally:
         session.close()
 
-def log_watering_session(zone, duration, source, soil_moisture_before, mode):
-    """Enregistre les détails de la session d'arrosage dans la base de données"""
+@db_write_seconds.time(table="watering_sessions")
+def log_watering_session(zone, duration, source, soil_moisture_before, mode, trajectory=None):
+    """
+    Enregistre les détails de la session d'arrosage dans la base de données, avec la trajectoire d'humidité
+    [(secondes écoulées, humidité)] d'un arrosage en boucle fermée ; renvoie l'id de la session
+    """
     try:
         session = SessionLocal()
         watering_session = WateringSession(zone=zone, duration=duration, source=source,
                                            soil_moisture_before=soil_moisture_before, mode=mode)
         session.add(watering_session)
+        if trajectory:
+            session.flush()
+            started = datetime.now() - timedelta(seconds=duration)
+            session.add_all(WateringTrajectory(session_id=watering_session.id, elapsed=elapsed, moisture=moisture,
+                                               time=started + timedelta(seconds=elapsed))
+                            for elapsed, moisture in trajectory)
         session.commit()
         app_logger.info(
             "Watering session logged to database. Zone: %s, Duration: %s, Source: %s, Moisture Before: %s, Mode: %s",
             zone, duration, source, soil_moisture_before, mode)
+        return watering_session.id
     except Exception as error:
         app_logger.error("Error logging watering session to database. Exception: %s", str(error))
     finally:
         session.close()
 
+@db_write_seconds.time(table="watering_decisions")
+def log_watering_decision(decision):
+    """ Enregistre la décision d'arrosage d'une zone et son explication """
+    try:
+        session = SessionLocal()
+        session.add(WateringDecision(zone=decision.zone.name, action=decision.action, factor=decision.factor,
+                                     soil_moisture=decision.moisture, rain_measured=decision.outlook.measured,
+                                     rain_expected=decision.outlook.expected,
+                                     chance_of_rain=decision.outlook.max_chance, reason=decision.reason[:255]))
+        session.commit()
+        app_logger.info("Watering decision for %s: %s (%s)", decision.zone.name, decision.action, decision.reason)
+    except Exception as error:
+        app_logger.error("Error logging watering decision to database. Exception: %s", str(error))
+    finally:
+        session.close()
+
+@db_write_seconds.time(table="hourly_rain")
 def log_hourly_rain(amount):
     """ Enregistre la quantité de pluie tombée chaque heure dans la base de données """
     if amount is None:
         app_logger.warning("Attempted to log None as hourly rain")
         return  # ou définir une valeur par défaut, ex: amount = 0
     rounded_amount = round(amount, 2)  # Arrondi à deux décimales
+    publish_measurement("hourly_rain", rounded_amount)
     try:
-        session = SessionLocal()
-        hourly_rain = HourlyRain(amount=rounded_amount)
-        session.add(hourly_rain)
-        session.commit()
+        save_measurements(HourlyRain, [dict(amount=rounded_amount)])
         app_logger.info("Hourly rain data saved to database. Amount: %s mm", rounded_amount)
     except Exception as error:
         app_logger.error("Error saving hourly rain data to database. Exception: %s", str(error))
-    finally:
-        session.close()
 
+@db_write_seconds.time(table="hourly_temperature")
 def log_hourly_temperature(temperature):
     """ Enregistre la température chaque heure dans la base de données """
     if temperature is None:
         app_logger.warning("Attempted to log None as hourly temperature")
         return  # ou définir une valeur par défaut, ex: temperature = 20.0
     rounded_temperature = round(temperature, 2)
+    publish_measurement("hourly_temperature", rounded_temperature)
     try:
-        session = SessionLocal()
-        hourly_temperature = HourlyTemperature(temperature=rounded_temperature)
-        session.add(hourly_temperature)
-        session.commit()
+        save_measurements(HourlyTemperature, [dict(temperature=rounded_temperature)])
         app_logger.info("Hourly temperature data saved to database. Temperature: %s °C", rounded_temperature)
     except Exception as error:
         app_logger.error("Error saving hourly temperature data to database. Exception: %s", str(error))
-    finally:
-        session.close()
 
+@db_write_seconds.time(table="hourly_wind")
 def log_hourly_wind(wind_speed):
     """ Enregistre la vitesse du vent chaque heure dans la base de données """
     if wind_speed is None:
         app_logger.warning("Attempted to log None as hourly wind speed")
         return  # ou définir une valeur par défaut, ex: wind_speed = 0
     rounded_wind_speed = round(wind_speed, 2)
+    publish_measurement("hourly_wind", rounded_wind_speed)
     try:
-        session = SessionLocal()
-        hourly_wind = HourlyWind(wind_speed=rounded_wind_speed)
-        session.add(hourly_wind)
-        session.commit()
+        save_measurements(HourlyWind, [dict(wind_speed=rounded_wind_speed)])
         app_logger.info("Hourly wind data saved to database. Wind Speed: %s km/h", rounded_wind_speed)
     except Exception as error:
         app_logger.error("Error saving hourly wind data to database. Exception: %s", str(error))
-    finally:
-        session.close()
 
+@db_write_seconds.time(table="hourly_sunlight")
 def log_hourly_sunlight(solar_radiation):
     """ Enregistre l'ensoleillement chaque heure dans la base de données """
     if solar_radiation is None:
         app_logger.warning("Attempted to log None as hourly solar radiation")
         return  # ou définir une valeur par défaut, ex: solar_radiation = 0.0
     rounded_solar_radiation = round(solar_radiation, 2)
+    publish_measurement("hourly_sunlight", rounded_solar_radiation)
     try:
-        session = SessionLocal()
-        hourly_sunlight = HourlySunlight(solar_radiation=rounded_solar_radiation)
-        session.add(hourly_sunlight)
-        session.commit()
+        save_measurements(HourlySunlight, [dict(solar_radiation=rounded_solar_radiation)])
         app_logger.info("Hourly sunlight data saved to database. Solar Radiation: %s W/m²", rounded_solar_radiation)
     except Exception as error:
         app_logger.error("Error saving hourly sunlight data to database. Exception: %s", str(error))
-    finally:
-        session.close()
 
+@db_write_seconds.time(table="hourly_humidity")
 def log_hourly_humidity(humidity):
     """ Enregistre l'humidité extérieure chaque heure dans la base de données """
     if humidity is None:
         app_logger.warning("Attempted to log None as hourly humidity")
         return  # ou définir une valeur par défaut, ex: humidity = 50
     rounded_humidity = round(humidity, 2)
+    publish_measurement("hourly_humidity", rounded_humidity)
     try:
-        session = SessionLocal()
-        hourly_humidity = HourlyHumidity(humidity=rounded_humidity)
-        session.add(hourly_humidity)
-        session.commit()
+        save_measurements(HourlyHumidity, [dict(humidity=rounded_humidity)])
         app_logger.info("Hourly humidity data saved to database. Humidity: %s %%", rounded_humidity)
     except Exception as error:
         app_logger.error("Error saving hourly humidity data to database. Exception: %s", str(error))
-    finally:
-        session.close()
 
@@ -1,29 +1,305 @@
-import json
 import logging
-from sqlalchemy import create_engine
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import DateTime, Float, UniqueConstraint, create_engine, event, inspect, literal_column
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.sql.expression import FunctionElement
 from config import load_config
 
-# Charger la configuration
-config = load_config()
-db_config = config['database']
-DATABASE_URL = f"mariadb+mariadbconnector://{db_config['user']}:{db_config['password']}@{db_config['host']}/{db_config['database']}"
-
 # Configurer SQLAlchemy
 Base = declarative_base()
-engine = create_engine(
-    DATABASE_URL,
-    pool_recycle=1800,  # Réutiliser les connexions toutes les 1800 secondes (30 minutes)
-    pool_pre_ping=True, # Vérifie la connexion avant de l'utiliser
-)
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Réglages appliqués à chaque connexion SQLite (surchargeables par database.pragmas).
+# auto_vacuum doit précéder la création des tables pour être pris en compte.
+SQLITE_PRAGMAS = {
+    "auto_vacuum": "INCREMENTAL",    # la rétention rend les pages libérées sans VACUUM complet
+    "journal_mode": "WAL",           # lectures du front-end concurrentes des écritures du démon
+    "synchronous": "NORMAL",         # suffisant en WAL : une coupure ne perd que les dernières transactions
+    "mmap_size": 67108864,           # 64 Mo lus directement depuis le cache de pages du noyau
+    "cache_size": -16000,            # 16 Mo de cache de pages par connexion
+    "temp_store": "MEMORY",
+    "busy_timeout": 5000,            # attend le verrou d'écriture au lieu d'échouer aussitôt
+}
+
+# Origine des intervalles de time_bucket et bucket_time (heure locale naïve)
+BUCKET_ORIGIN = datetime(2000, 1, 1)
+
+# Tables dont l'index unique de la clé naturelle a été constaté (les upserts s'appuient dessus)
+_natural_keys = set()
+
+# Le moteur (et le pilote MariaDB) n'est créé qu'à la première utilisation
+_engine = None
+_read_engine = None
+_engine_lock = threading.Lock()
+
+# Clés de database.read qui désignent une réplique (les autres réglent le pool et les délais)
+READ_CONNECTION_KEYS = ("host", "user", "password", "database", "path")
+
+
+def get_backend(db_config=None):
+    db_config = db_config if db_config is not None else load_config()['database']
+    return db_config.get('backend', 'mariadb')
+
+
+def get_database_url(db_config=None):
+    db_config = db_config if db_config is not None else load_config()['database']
+    if get_backend(db_config) == 'sqlite':
+        return f"sqlite:///{db_config['path']}"
+    return f"mariadb+mariadbconnector://{db_config['user']}:{db_config['password']}@{db_config['host']}/{db_config['database']}"
+
+
+def create_sqlite_engine(path, pragmas=None):
+    """ Moteur SQLite embarqué (WAL et pragmas de SQLITE_PRAGMAS appliqués à chaque connexion) """
+    settings = dict(SQLITE_PRAGMAS)
+    settings.update(pragmas or {})
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in settings.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
+
+    return engine
+
+
+def build_engine(db_config):
+    if get_backend(db_config) == 'sqlite':
+        return create_sqlite_engine(db_config['path'], db_config.get('pragmas'))
+    return create_engine(
+        get_database_url(db_config),
+        pool_recycle=1800,  # Réutiliser les connexions toutes les 1800 secondes (30 minutes)
+        pool_pre_ping=True, # Vérifie la connexion avant de l'utiliser
+    )
+
+
+def get_engine():
+    """ Renvoie le moteur SQLAlchemy partagé, créé à la première demande """
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = build_engine(load_config()['database'])
+    return _engine
+
+
+def _apply_read_only(engine, statement_timeout):
+    """ Connexions en lecture seule ; toute requête plus longue que `statement_timeout` secondes est interrompue """
+    if is_sqlite(engine):
+        @event.listens_for(engine, "connect")
+        def set_query_only(dbapi_connection, connection_record):
+            dbapi_connection.execute("PRAGMA query_only = 1")
+            deadline = connection_record.info["deadline"] = [None]
+            # Appelé toutes les 10000 instructions de la machine virtuelle SQLite ; 1 interrompt la requête
+            dbapi_connection.set_progress_handler(
+                lambda: int(deadline[0] is not None and time.monotonic() > deadline[0]), 10000)
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def start_deadline(connection, cursor, statement, parameters, context, executemany):
+            connection.connection.info["deadline"][0] = time.monotonic() + statement_timeout
+        return
+
+    @event.listens_for(engine, "connect")
+    def set_session_limits(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("SET SESSION TRANSACTION READ ONLY")
+        cursor.execute(f"SET SESSION max_statement_time = {float(statement_timeout)}")
+        cursor.close()
+
+
+def build_read_engine(db_config):
+    read_config = db_config.get('read', {})
+    replica_config = dict(db_config)
+    replica_config.update({key: value for key, value in read_config.items() if key in READ_CONNECTION_KEYS})
+    if get_backend(replica_config) == 'sqlite':
+        engine = create_sqlite_engine(replica_config['path'], db_config.get('pragmas'))
+    else:
+        engine = create_engine(
+            get_database_url(replica_config),
+            pool_size=read_config.get('pool_size', 3),
+            max_overflow=read_config.get('max_overflow', 2),
+            pool_timeout=read_config.get('pool_timeout', 10),
+            pool_recycle=1800,
+            pool_pre_ping=True,
+        )
+    _apply_read_only(engine, read_config.get('statement_timeout', 10))
+    return engine
+
+
+def get_read_engine():
+    """
+    Moteur des lectures du front-end (graphiques, historiques) : pool distinct de celui des écritures,
+    réplique éventuelle (database.read) et délai maximal par requête (database.read.statement_timeout).
+    """
+    global _read_engine
+    if _read_engine is None:
+        with _engine_lock:
+            if _read_engine is None:
+                _read_engine = build_read_engine(load_config()['database'])
+    return _read_engine
+
+
+def is_sqlite(engine):
+    return engine.dialect.name == "sqlite"
+
+
+def bucket_time(moment, seconds):
+    """ Début de l'intervalle de `seconds` secondes contenant `moment` (même découpage que time_bucket) """
+    elapsed = int((moment - BUCKET_ORIGIN).total_seconds()) // seconds * seconds
+    return BUCKET_ORIGIN + timedelta(seconds=elapsed)
+
+
+def natural_key(table):
+    """ Colonnes de la contrainte d'unicité (clé naturelle) d'une table """
+    for constraint in table.constraints:
+        if isinstance(constraint, UniqueConstraint):
+            return [column.name for column in constraint.columns]
+    raise ValueError(f"Table {table.name} has no natural key")
+
+
+def has_natural_key(connection, table):
+    """ L'index unique de la clé naturelle existe-t-il déjà (table créée par create_all ou déjà migrée) ? """
+    inspector = inspect(connection)
+    if not inspector.has_table(table.name):
+        return True  # create_all la créera avec sa contrainte
+    key = set(natural_key(table))
+    uniques = [set(constraint["column_names"]) for constraint in inspector.get_unique_constraints(table.name)]
+    uniques += [set(index["column_names"]) for index in inspector.get_indexes(table.name) if index.get("unique")]
+    return key in uniques
+
+
+def upsert(connection, model, rows):
+    """
+    Insère des lignes par lot ; une ligne dont la clé naturelle existe déjà met à jour les autres colonnes
+    (ON CONFLICT DO UPDATE sous SQLite, ON DUPLICATE KEY UPDATE sous MariaDB)
+    """
+    if not rows:
+        return 0
+    table = model.__table__
+    key = natural_key(table)
+    columns = [name for name in rows[0] if name not in key]
+    # Accepte une Session (écritures de data_logger) comme une Connection
+    if isinstance(connection, Session):
+        connection = connection.connection()
+    if table.name not in _natural_keys:
+        if not has_natural_key(connection, table):
+            # Table pas encore migrée (voir data_management.dedup) : insertion simple, dédoublonnée par la migration
+            return connection.execute(table.insert(), rows).rowcount
+        _natural_keys.add(table.name)
+    # Imports différés : le front-end, qui n'écrit pas, ne charge pas les dialectes au démarrage
+    dialect = connection.dialect
+    if dialect.name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+        statement = sqlite_insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=key, set_={name: statement.excluded[name] for name in columns})
+    else:
+        from sqlalchemy.dialects.mysql import insert as mysql_insert
+        statement = mysql_insert(table)
+        statement = statement.on_duplicate_key_update({name: statement.inserted[name] for name in columns})
+    return connection.execute(statement, rows).rowcount
+
+
+def __getattr__(name):
+    # Compatibilité : `from data_management.database import engine` crée le moteur à la demande
+    if name == "engine":
+        return get_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+class local_now(FunctionElement):
+    """ Horodatage local courant : CURRENT_TIMESTAMP sous MariaDB, datetime('now', 'localtime') sous SQLite """
+    type = DateTime()
+    inherit_cache = True
+
+
+@compiles(local_now)
+def _local_now(element, compiler, **kw):
+    return "CURRENT_TIMESTAMP"
+
+
+@compiles(local_now, "sqlite")
+def _local_now_sqlite(element, compiler, **kw):
+    # CURRENT_TIMESTAMP est en UTC sous SQLite alors que les requêtes comparent à datetime.now()
+    return "(datetime('now', 'localtime'))"
+
+
+class time_bucket(FunctionElement):
+    """ Début de l'intervalle de `seconds` secondes contenant `column` (agrégats horaires, journaliers...) """
+    type = DateTime()
+    inherit_cache = True
+
+    def __init__(self, column, seconds):
+        super().__init__(column, literal_column(str(int(seconds))))
+
+
+@compiles(time_bucket)
+def _time_bucket(element, compiler, **kw):
+    column, seconds = (compiler.process(clause, **kw) for clause in element.clauses)
+    # Arithmétique sur l'heure locale naïve, les intervalles d'un jour commencent à minuit
+    return (f"TIMESTAMPADD(SECOND, TIMESTAMPDIFF(SECOND, '2000-01-01', {column}) DIV {seconds} * {seconds}, "
+            f"'2000-01-01')")
+
+
+@compiles(time_bucket, "sqlite")
+def _time_bucket_sqlite(element, compiler, **kw):
+    column, seconds = (compiler.process(clause, **kw) for clause in element.clauses)
+    return f"datetime(CAST(strftime('%s', {column}) AS INTEGER) / {seconds} * {seconds}, 'unixepoch')"
+
+
+class seconds_between(FunctionElement):
+    """ Nombre de secondes entre deux horodatages (détection des trous dans les séries) """
+    type = Float()
+    inherit_cache = True
+
+
+@compiles(seconds_between)
+def _seconds_between(element, compiler, **kw):
+    start, end = (compiler.process(clause, **kw) for clause in element.clauses)
+    return f"TIMESTAMPDIFF(SECOND, {start}, {end})"
+
+
+@compiles(seconds_between, "sqlite")
+def _seconds_between_sqlite(element, compiler, **kw):
+    start, end = (compiler.process(clause, **kw) for clause in element.clauses)
+    return f"((julianday({end}) - julianday({start})) * 86400)"
+
+
+class LazySessionmaker(sessionmaker):
+    """ sessionmaker qui se lie au moteur partagé lors de la création de la première session """
+
+    def __init__(self, engine_factory=get_engine, **kw):
+        super().__init__(**kw)
+        self.engine_factory = engine_factory
+
+    def __call__(self, **local_kw):
+        if "bind" not in local_kw and self.kw.get("bind") is None:
+            self.configure(bind=self.engine_factory())
+        return super().__call__(**local_kw)
+
+
+SessionLocal = LazySessionmaker(autocommit=False, autoflush=False)
+ReadSessionLocal = LazySessionmaker(get_read_engine, autocommit=False, autoflush=False)
 
 
 def create_database():
     try:
-        Base.metadata.create_all(bind=engine)
+        Base.metadata.create_all(bind=get_engine())
+        # Tables antérieures aux clés naturelles : dédoublonnage et index uniques (une seule fois) ;
+        # tant qu'une table n'est pas migrée, upsert() y insère sans clé
+        from data_management.dedup import ensure_natural_keys
+        ensure_natural_keys()
         logging.info("La base de données a été créée et mise à jour avec succès.")
     except Exception as error:
-        logging.error(f"Erreur lors de la création de la base de données: {error}")
\ No newline at end of file
+        logging.error(f"Erreur lors de la création de la base de données: {error}")
+
+
+def create_database_in_background():
+    """ Vérifie le schéma sans retarder le démarrage (les premières écritures ont lieu bien plus tard) """
+    thread = threading.Thread(target=create_database, name="schema-check", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,129 @@
+"""
+Migration vers les clés naturelles des tables de mesures.
+
+Avant les upserts de data_logger, une même mesure pouvait être enregistrée plusieurs fois (lectures répétées,
+reprises). Pour chaque table de BUCKET_SECONDS, la migration :
+
+1. supprime les doublons : seule la dernière ligne (id le plus grand) de chaque clé naturelle est gardée,
+   la clé étant l'horodatage arrondi à l'intervalle de la table, plus la zone pour l'hygrométrie ;
+2. arrondit l'horodatage des lignes restantes, par lots ;
+3. crée l'index unique de la clé naturelle, sur lequel s'appuient les upserts.
+
+Le démon la lance au démarrage, depuis la vérification du schéma en arrière-plan, pour les seules tables sans index
+unique ; tant qu'une table n'est pas migrée, upsert() y insère sans clé. Elle peut aussi être lancée à la main,
+démon arrêté :
+
+    python -m data_management.dedup --dry-run    # compte les doublons sans rien modifier
+    python -m data_management.dedup
+"""
+import argparse
+
+from sqlalchemy import UniqueConstraint, bindparam, delete, func, select, text, update
+from sqlalchemy.exc import IntegrityError
+
+from custom_logging import setup_logger
+from data_management.data_logger import BUCKET_SECONDS
+from data_management.database import bucket_time, get_engine, has_natural_key, is_sqlite, natural_key, time_bucket
+from monitoring.metrics import registry
+
+# Essais de création de l'index unique lorsque des écritures concurrentes réintroduisent un doublon
+INDEX_ATTEMPTS = 3
+
+duplicates_deleted = registry.counter(
+    "pigarden_dedup_rows_deleted_total", "Doublons supprimés par la migration des clés naturelles", ("table",))
+
+logger = setup_logger('log_watering_garden.log', 'dedup')
+
+
+def unique_constraint(table):
+    return next(constraint for constraint in table.constraints if isinstance(constraint, UniqueConstraint))
+
+
+def count_duplicates(connection, model):
+    bucket = time_bucket(model.time, BUCKET_SECONDS[model])
+    keys = [model.__table__.c[name] for name in natural_key(model.__table__) if name != "time"]
+    groups = select(func.count().label("copies")).select_from(model).group_by(bucket, *keys).subquery()
+    return connection.execute(select(func.coalesce(func.sum(groups.c.copies - 1), 0))).scalar()
+
+
+def delete_duplicates(connection, model):
+    """ Garde la dernière ligne de chaque clé naturelle ; renvoie le nombre de lignes supprimées """
+    bucket = time_bucket(model.time, BUCKET_SECONDS[model])
+    keys = [model.__table__.c[name] for name in natural_key(model.__table__) if name != "time"]
+    # Table dérivée : MariaDB refuse une sous-requête sur la table dont on supprime les lignes
+    kept = select(func.max(model.id).label("id")).group_by(bucket, *keys).subquery()
+    return connection.execute(delete(model).where(model.id.not_in(select(kept.c.id)))).rowcount
+
+
+def round_times(engine, model, chunk_size=5000):
+    """ Arrondit les horodatages à l'intervalle de la table, par lots d'identifiants ; renvoie le nombre modifié """
+    seconds = BUCKET_SECONDS[model]
+    sqlite = is_sqlite(engine)
+    statement = update(model).where(model.id == bindparam("row_id")).values(time=bindparam("bucket"))
+    last_id, updated = 0, 0
+    while True:
+        with engine.begin() as connection:
+            rows = connection.execute(select(model.id, model.time).where(model.id > last_id, model.time.is_not(None))
+                                      .order_by(model.id).limit(chunk_size)).all()
+            if not rows:
+                return updated
+            # SQLite compare les horodatages comme du texte : toutes les lignes sont réécrites au format de SQLAlchemy
+            changes = [{"row_id": row_id, "bucket": bucket_time(moment, seconds)} for row_id, moment in rows
+                       if sqlite or bucket_time(moment, seconds) != moment]
+            if changes:
+                connection.execute(statement, changes)
+            updated += len(changes)
+            last_id = rows[-1][0]
+
+
+def migrate_table(engine, model, dry_run=False):
+    """ Déduplique une table et crée l'index unique de sa clé naturelle ; renvoie le nombre de doublons """
+    table = model.__table__
+    if dry_run:
+        with engine.connect() as connection:
+            count = count_duplicates(connection, model)
+        logger.info("Dedup (dry run): %s duplicate rows in %s", count, table.name)
+        return count
+    with engine.begin() as connection:
+        deleted = delete_duplicates(connection, model)
+    round_times(engine, model)
+    constraint = unique_constraint(table)
+    columns = ", ".join(natural_key(table))
+    for attempt in range(INDEX_ATTEMPTS):
+        with engine.begin() as connection:
+            # Lignes insérées sans upsert pendant la migration : l'index unique ne pourrait pas être créé
+            deleted += delete_duplicates(connection, model)
+        try:
+            with engine.begin() as connection:
+                connection.execute(text(f"CREATE UNIQUE INDEX {constraint.name} ON {table.name} ({columns})"))
+            break
+        except IntegrityError:
+            # Doublon inséré entre la suppression et la création de l'index (MariaDB) : nouvel essai
+            if attempt == INDEX_ATTEMPTS - 1:
+                raise
+    duplicates_deleted.inc(deleted, table=table.name)
+    logger.info("Dedup: %s duplicate rows deleted from %s, natural key %s created", deleted, table.name,
+                constraint.name)
+    return deleted
+
+
+def ensure_natural_keys(engine=None, dry_run=False):
+    """ Migre les tables de mesures qui n'ont pas encore leur index unique ; renvoie {table: doublons} """
+    engine = engine or get_engine()
+    results = {}
+    for model in BUCKET_SECONDS:
+        with engine.connect() as connection:
+            if has_natural_key(connection, model.__table__):
+                continue
+        try:
+            results[model.__tablename__] = migrate_table(engine, model, dry_run)
+        except Exception as error:
+            logger.error("Dedup failed for %s. Exception: %s", model.__tablename__, str(error))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Déduplique les tables de mesures et crée leurs clés naturelles")
+    parser.add_argument("--dry-run", action="store_true", help="Compte les doublons sans rien modifier")
+    args = parser.parse_args()
+    ensure_natural_keys(dry_run=args.dry_run)
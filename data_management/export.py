@@ -0,0 +1,354 @@
+"""
+Export et import de l'historique du jardin, table par table.
+
+    python -m data_management.export export --output /mnt/usb/pigarden --format parquet
+    python -m data_management.export export --output /mnt/usb/incr --since-manifest /mnt/usb/pigarden
+    python -m data_management.export import --input /mnt/usb/pigarden
+    python -m data_management.export migrate --to-sqlite /var/lib/pigarden/garden.db
+
+Formats : parquet et arrow (Arrow IPC, nécessitent pyarrow) ou csv (csv.gz, bibliothèque standard).
+La lecture se fait par curseur côté serveur et par lots : la mémoire utilisée ne dépend pas
+de la taille des tables.
+"""
+import argparse
+import csv
+import gzip
+import json
+import os
+from datetime import datetime
+
+from sqlalchemy import DateTime, Float, Integer, select, func
+
+import models  # noqa: F401  (enregistre les tables dans Base.metadata)
+from custom_logging import setup_logger
+from data_management.data_logger import BUCKET_SECONDS
+from data_management.database import Base, bucket_time, create_sqlite_engine, get_engine, upsert
+
+FORMATS = ("parquet", "arrow", "csv")
+EXTENSIONS = {"parquet": "parquet", "arrow": "arrow", "csv": "csv.gz"}
+MANIFEST = "manifest.json"
+
+# Tables de mesures à clé naturelle (horodatage arrondi, voir data_management.dedup) -> modèle
+KEYED_MODELS = {model.__tablename__: model for model in BUCKET_SECONDS}
+
+logger = setup_logger('log_watering_garden.log', 'export')
+
+
+def time_column(table):
+    """ Colonne horodatée d'une table ('time', ou 'timestamp' pour la table logs) """
+    return table.c.time if "time" in table.c else table.c.timestamp
+
+
+def get_tables(names=None):
+    tables = Base.metadata.sorted_tables
+    if names:
+        unknown = set(names) - {table.name for table in tables}
+        if unknown:
+            raise ValueError(f"Unknown tables: {', '.join(sorted(unknown))}")
+        tables = [table for table in tables if table.name in names]
+    return tables
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+        return pyarrow
+    except ImportError as error:
+        raise RuntimeError("pyarrow is required for parquet and arrow formats (pip install pyarrow)") from error
+
+
+def arrow_schema(table):
+    pa = _require_pyarrow()
+    fields = []
+    for column in table.columns:
+        if isinstance(column.type, Integer):
+            arrow_type = pa.int64()
+        elif isinstance(column.type, Float):
+            arrow_type = pa.float64()
+        elif isinstance(column.type, DateTime):  # TIMESTAMP est une sous-classe de DateTime
+            arrow_type = pa.timestamp("us")
+        else:
+            arrow_type = pa.string()
+        fields.append(pa.field(column.name, arrow_type, nullable=column.nullable or column.primary_key))
+    return pa.schema(fields)
+
+
+class _CsvWriter:
+    def __init__(self, path, table):
+        self.file = gzip.open(path, "wt", encoding="utf-8", newline="")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow([column.name for column in table.columns])
+
+    def write(self, rows):
+        self.writer.writerows(
+            ["" if value is None else value.isoformat(sep=" ") if isinstance(value, datetime) else value
+             for value in row] for row in rows)
+
+    def close(self):
+        self.file.close()
+
+
+class _ArrowWriter:
+    def __init__(self, path, table, output_format):
+        pa = _require_pyarrow()
+        self.pa = pa
+        self.schema = arrow_schema(table)
+        if output_format == "parquet":
+            import pyarrow.parquet as pq
+            self.writer = pq.ParquetWriter(path, self.schema, compression="zstd")
+        else:
+            import pyarrow.ipc as ipc
+            self.writer = ipc.new_file(path, self.schema, options=ipc.IpcWriteOptions(compression="zstd"))
+
+    def write(self, rows):
+        columns = list(zip(*rows))
+        self.writer.write_table(self.pa.Table.from_arrays(
+            [self.pa.array(values, type=field.type) for values, field in zip(columns, self.schema)],
+            schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+def _open_writer(path, table, output_format):
+    if output_format == "csv":
+        return _CsvWriter(path, table)
+    return _ArrowWriter(path, table, output_format)
+
+
+def read_manifest(directory):
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as manifest_file:
+        return json.load(manifest_file)
+
+
+def stream_rows(connection, table, since=None, after_id=None, until_id=None, chunk_size=10000):
+    """
+    Parcourt une table par lots de `chunk_size` lignes, dans l'ordre des id : lignes d'id compris
+    entre `after_id` (exclu) et `until_id` (inclus), horodatées après `since` si précisé
+    """
+    query = select(table).order_by(table.c.id)
+    if since is not None:
+        query = query.where(time_column(table) > since)
+    if after_id is not None:
+        query = query.where(table.c.id > after_id)
+    if until_id is not None:
+        query = query.where(table.c.id <= until_id)
+    # stream_results : curseur côté serveur, les lignes ne sont jamais toutes en mémoire
+    result = connection.execution_options(stream_results=True, max_row_buffer=chunk_size).execute(query)
+    yield from result.partitions(chunk_size)
+
+
+def export_table(connection, table, output_dir, output_format, since=None, after_id=None, chunk_size=10000):
+    """
+    Exporte une table (lignes d'id supérieur à `after_id` et postérieures à `since` si précisés) ;
+    renvoie (lignes, filigrane). Le filigrane est le dernier id lu avant l'export : les lignes écrites
+    pendant l'export, ou insérées plus tard avec un horodatage ancien (rattrapage), iront dans l'export suivant.
+    """
+    watermark = connection.execute(select(func.max(table.c.id))).scalar()
+    path = os.path.join(output_dir, f"{table.name}.{EXTENSIONS[output_format]}")
+    writer = _open_writer(path, table, output_format)
+    count = 0
+    try:
+        if watermark is not None:
+            for rows in stream_rows(connection, table, since, after_id, watermark, chunk_size):
+                writer.write(rows)
+                count += len(rows)
+    finally:
+        writer.close()
+    logger.info("Exported %s rows from %s to %s", count, table.name, path)
+    return count, watermark
+
+
+def previous_watermark(entry):
+    """
+    Point de reprise d'un export incrémental à partir de l'entrée du manifeste précédent : (id, None),
+    ou (None, horodatage) pour un manifeste antérieur au filigrane par id
+    """
+    if not entry or entry.get("watermark") is None:
+        return None, None
+    if entry.get("watermark_column") == "id":
+        return entry["watermark"], None
+    return None, datetime.fromisoformat(entry["watermark"])
+
+
+def export_history(output_dir, output_format="parquet", tables=None, since=None, since_manifest=None,
+                   chunk_size=10000):
+    """
+    Exporte les tables dans `output_dir` et écrit un manifeste contenant le filigrane de chaque table
+    (dernier id exporté, `watermark_column` vaut "id"). `since_manifest` reprend les filigranes
+    d'un export précédent (export incrémental).
+    """
+    if output_format not in FORMATS:
+        raise ValueError(f"Unknown format: {output_format}")
+    os.makedirs(output_dir, exist_ok=True)
+    previous = read_manifest(since_manifest).get("tables", {}) if since_manifest else {}
+    manifest = {"format": output_format, "exported_at": datetime.now().isoformat(sep=" "), "tables": {}}
+    with get_engine().connect() as connection:
+        for table in get_tables(tables):
+            after_id, previous_time = previous_watermark(previous.get(table.name))
+            table_since = previous_time or since
+            count, watermark = export_table(connection, table, output_dir, output_format, table_since, after_id,
+                                            chunk_size)
+            if watermark is None or (after_id is not None and watermark < after_id):
+                watermark = after_id
+            manifest["tables"][table.name] = {
+                "rows": count,
+                "since": table_since.isoformat(sep=" ") if table_since else None,
+                "after_id": after_id,
+                "watermark_column": "id",
+                "watermark": watermark,
+            }
+    with open(os.path.join(output_dir, MANIFEST), "w", encoding="utf-8") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    return manifest
+
+
+def _convert_csv_value(column, value):
+    if value == "":
+        return None
+    if isinstance(column.type, Integer):
+        return int(value)
+    if isinstance(column.type, Float):
+        return float(value)
+    if isinstance(column.type, DateTime):
+        return datetime.fromisoformat(value)
+    return value
+
+
+def _read_batches(path, table, input_format, chunk_size):
+    if input_format == "csv":
+        with gzip.open(path, "rt", encoding="utf-8", newline="") as csv_file:
+            reader = csv.reader(csv_file)
+            header = next(reader)
+            columns = [table.c[name] for name in header]
+            batch = []
+            for row in reader:
+                batch.append({column.name: _convert_csv_value(column, value) for column, value in zip(columns, row)})
+                if len(batch) >= chunk_size:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+        return
+    _require_pyarrow()
+    if input_format == "parquet":
+        import pyarrow.parquet as pq
+        for record_batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+            yield record_batch.to_pylist()
+    else:
+        import pyarrow.ipc as ipc
+        with ipc.open_file(path) as reader:
+            for index in range(reader.num_record_batches):
+                yield reader.get_batch(index).to_pylist()
+
+
+def import_table(engine, table, path, input_format, chunk_size=10000, append=False):
+    """ Charge un fichier exporté dans une table (vide, sauf si `append`) ; renvoie le nombre de lignes """
+    with engine.connect() as connection:
+        if not append and connection.execute(select(func.count()).select_from(table)).scalar():
+            raise RuntimeError(f"Table {table.name} is not empty (use --append to load anyway)")
+    count = 0
+    with engine.begin() as connection:
+        if engine.dialect.name in ("mysql", "mariadb"):
+            # Chargement en masse : InnoDB ne vérifie plus l'unicité des index secondaires ligne à ligne
+            connection.exec_driver_sql("SET SESSION unique_checks = 0")
+        for batch in _read_batches(path, table, input_format, chunk_size):
+            connection.execute(table.insert(), batch)
+            count += len(batch)
+        if engine.dialect.name in ("mysql", "mariadb"):
+            connection.exec_driver_sql("SET SESSION unique_checks = 1")
+    logger.info("Imported %s rows into %s from %s", count, table.name, path)
+    return count
+
+
+def import_history(input_dir, tables=None, chunk_size=10000, append=False):
+    """ Importe un export complet (typiquement vers une base neuve sur un nouveau matériel) """
+    manifest = read_manifest(input_dir)
+    input_format = manifest.get("format", "parquet")
+    engine = get_engine()
+    Base.metadata.create_all(bind=engine)
+    counts = {}
+    for table in get_tables(tables):
+        path = os.path.join(input_dir, f"{table.name}.{EXTENSIONS[input_format]}")
+        if not os.path.exists(path):
+            continue
+        counts[table.name] = import_table(engine, table, path, input_format, chunk_size, append)
+    return counts
+
+
+def copy_rows(connection, table, rows):
+    """
+    Insère des lignes copiées d'une autre base ; dans les tables à clé naturelle, l'horodatage est arrondi
+    et la dernière ligne d'une même clé l'emporte, comme lors du dédoublonnage (source pas encore migrée)
+    """
+    model = KEYED_MODELS.get(table.name)
+    if model is None:
+        connection.execute(table.insert(), rows)
+        return
+    seconds = BUCKET_SECONDS[model]
+    upsert(connection, model, [dict(row, time=bucket_time(row["time"], seconds)) if row["time"] else row
+                               for row in rows])
+
+
+def migrate_history(target_engine, tables=None, chunk_size=10000):
+    """
+    Copie la base configurée vers `target_engine` (vide) sans fichier intermédiaire,
+    par exemple de MariaDB vers SQLite avant de basculer database.backend.
+    Les doublons des tables de mesures sont fusionnés au passage (voir copy_rows).
+    """
+    Base.metadata.create_all(bind=target_engine)
+    counts = {}
+    with get_engine().connect() as source:
+        for table in get_tables(tables):
+            with target_engine.connect() as target:
+                if target.execute(select(func.count()).select_from(table)).scalar():
+                    raise RuntimeError(f"Table {table.name} is not empty in the target database")
+            count = 0
+            with target_engine.begin() as target:
+                for rows in stream_rows(source, table, chunk_size=chunk_size):
+                    copy_rows(target, table, [row._asdict() for row in rows])
+                    count += len(rows)
+            logger.info("Migrated %s rows of %s", count, table.name)
+            counts[table.name] = count
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="Exporte l'historique")
+    export_parser.add_argument("--output", required=True)
+    export_parser.add_argument("--format", choices=FORMATS, default="parquet")
+    export_parser.add_argument("--since", type=datetime.fromisoformat, help="Filigrane : 'YYYY-MM-DD HH:MM:SS'")
+    export_parser.add_argument("--since-manifest", help="Répertoire d'un export précédent (export incrémental)")
+
+    import_parser = subparsers.add_parser("import", help="Importe un export dans la base configurée")
+    import_parser.add_argument("--input", required=True)
+    import_parser.add_argument("--append", action="store_true", help="Autorise l'import dans des tables non vides")
+
+    migrate_parser = subparsers.add_parser("migrate", help="Copie la base configurée vers une base SQLite neuve")
+    migrate_parser.add_argument("--to-sqlite", required=True, help="Chemin du fichier SQLite à créer")
+
+    for sub in (export_parser, import_parser, migrate_parser):
+        sub.add_argument("--tables", nargs="*", help="Tables à traiter (toutes par défaut)")
+        sub.add_argument("--chunk-size", type=int, default=10000)
+
+    args = parser.parse_args()
+    if args.command == "export":
+        manifest = export_history(args.output, args.format, args.tables, args.since, args.since_manifest,
+                                  args.chunk_size)
+        print(json.dumps(manifest, indent=2))
+    elif args.command == "import":
+        print(json.dumps(import_history(args.input, args.tables, args.chunk_size, args.append), indent=2))
+    else:
+        counts = migrate_history(create_sqlite_engine(args.to_sqlite), args.tables, args.chunk_size)
+        print(json.dumps(counts, indent=2))
+        print(f'Set "database": {{"backend": "sqlite", "path": "{args.to_sqlite}"}} in config.json to switch.')
+
+
+if __name__ == "__main__":
+    main()
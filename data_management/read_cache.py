@@ -0,0 +1,71 @@
+import functools
+import threading
+import time
+from collections import OrderedDict
+
+from monitoring.metrics import registry
+
+cache_requests = registry.counter(
+    "pigarden_read_cache_requests_total", "Lectures servies par le cache (hit) ou par la base (miss)",
+    ("function", "outcome"))
+
+
+class ReadCache:
+    """ Cache LRU à durée de vie limitée pour les résultats des requêtes de lecture """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """ Renvoie (trouvé, valeur) ; une entrée expirée est retirée """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return False, None
+            expires, value = entry
+            if time.monotonic() >= expires:
+                del self.entries[key]
+                return False, None
+            self.entries.move_to_end(key)
+            return True, value
+
+    def set(self, key, value, ttl):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+read_cache = ReadCache()
+
+
+def cached_read(bucket=60, ttl=None, cache=read_cache):
+    """
+    Met en cache le résultat d'une fonction de lecture, par arguments et par tranche de `bucket` secondes :
+    les requêtes identiques d'une même tranche ne touchent la base qu'une fois. Les lectures renvoient None en cas
+    d'erreur : ce résultat n'est pas gardé, la requête suivante interroge de nouveau la base.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            now = time.time()
+            key = (func.__qualname__, args, tuple(sorted(kwargs.items())), int(now // bucket))
+            found, value = cache.get(key)
+            if found:
+                cache_requests.inc(function=func.__name__, outcome="hit")
+                return value
+            cache_requests.inc(function=func.__name__, outcome="miss")
+            value = func(*args, **kwargs)
+            if value is not None:
+                # L'entrée n'a pas de raison de survivre à sa tranche de temps
+                cache.set(key, value, ttl if ttl is not None else bucket - now % bucket)
+            return value
+        return wrapper
+    return decorator
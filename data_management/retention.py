@@ -0,0 +1,163 @@
+import argparse
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+import models  # noqa: F401  (enregistre les tables dans Base.metadata)
+from config import load_config
+from custom_logging import setup_logger
+from data_management.database import Base, get_engine, is_sqlite
+from monitoring.metrics import registry
+
+# Durée de conservation par défaut (en jours, None = pour toujours).
+# Les tables brutes à forte fréquence sont purgées ; les agrégats horaires et l'historique
+# des arrosages sont conservés. Le niveau d'eau et l'hygrométrie gardent plus d'un an
+# pour les graphiques annuels.
+DEFAULT_POLICIES = {
+    "cpu_temperature": 90,
+    "technical_cabinet_conditions": 90,
+    "system_state": 90,
+    "logs": 90,
+    "rain_forecast": 90,
+    "precipitation": 90,
+    "water_level": 400,
+    "hygrometry": 400,
+    "hourly_rain": None,
+    "hourly_temperature": None,
+    "hourly_wind": None,
+    "hourly_sunlight": None,
+    "hourly_humidity": None,
+    "watering_sessions": None,
+    "watering_trajectories": None,
+    "watering_decisions": 400,
+    "daily_aggregates": None,
+}
+
+# Colonne horodatée de chaque table (la table 'logs' utilise 'timestamp')
+TIME_COLUMNS = {"logs": "timestamp"}
+
+rows_deleted = registry.counter(
+    "pigarden_retention_rows_deleted_total", "Lignes supprimées par la rétention", ("table",))
+bytes_reclaimed = registry.counter(
+    "pigarden_retention_bytes_reclaimed_total", "Octets récupérés après purge et optimisation", ("table",))
+
+logger = setup_logger('log_watering_garden.log', 'retention')
+
+
+def get_policies(config):
+    """ Fusionne les politiques de config.json (section retention.policies) avec les valeurs par défaut """
+    policies = dict(DEFAULT_POLICIES)
+    policies.update(config.get("retention", {}).get("policies", {}))
+    return policies
+
+
+def table_size(connection, table):
+    """ Taille sur disque (données + index + espace libre) d'une table, en octets """
+    if is_sqlite(connection):
+        # SQLite ne donne pas la taille d'une table sans l'extension dbstat : taille du fichier de base
+        page_count = connection.execute(text("PRAGMA page_count")).scalar()
+        page_size = connection.execute(text("PRAGMA page_size")).scalar()
+        return page_count * page_size
+    row = connection.execute(text(
+        "SELECT data_length + index_length + data_free FROM information_schema.tables "
+        "WHERE table_schema = DATABASE() AND table_name = :table"), {"table": table}).first()
+    return int(row[0] or 0) if row else 0
+
+
+def delete_chunk(connection, table, time_column, cutoff, chunk_size):
+    """ Supprime au plus `chunk_size` lignes plus anciennes que `cutoff` ; renvoie le nombre supprimé """
+    if is_sqlite(connection):
+        # SQLite n'accepte DELETE ... LIMIT que compilé avec SQLITE_ENABLE_UPDATE_DELETE_LIMIT
+        result = connection.execute(text(
+            f"DELETE FROM {table} WHERE id IN "
+            f"(SELECT id FROM {table} WHERE {time_column} < :cutoff ORDER BY id LIMIT :chunk_size)"),
+            {"cutoff": cutoff, "chunk_size": chunk_size})
+        return result.rowcount
+    result = connection.execute(text(
+        f"DELETE FROM {table} WHERE {time_column} < :cutoff ORDER BY id LIMIT :chunk_size"),
+        {"cutoff": cutoff, "chunk_size": chunk_size})
+    return result.rowcount
+
+
+def reclaim_space(connection, table):
+    if is_sqlite(connection):
+        # auto_vacuum=INCREMENTAL : rend les pages libres au système sans réécrire toute la base.
+        # Le pragma libère une page par pas d'exécution : executescript l'exécute jusqu'au bout.
+        connection.commit()
+        connection.connection.driver_connection.executescript("PRAGMA incremental_vacuum")
+        connection.execute(text("PRAGMA wal_checkpoint(TRUNCATE)")).fetchall()
+        return
+    # OPTIMIZE TABLE reconstruit la table InnoDB et libère l'espace des lignes supprimées
+    connection.execute(text(f"OPTIMIZE TABLE {table}")).fetchall()
+
+
+def purge_table(engine, table, days, chunk_size=5000, pause=0.5, deadline=None, dry_run=False):
+    """ Purge une table par lots bornés ; renvoie (lignes supprimées, octets récupérés) """
+    time_column = TIME_COLUMNS.get(table, "time")
+    cutoff = datetime.now() - timedelta(days=days)
+    if dry_run:
+        with engine.connect() as connection:
+            count = connection.execute(text(f"SELECT COUNT(*) FROM {table} WHERE {time_column} < :cutoff"),
+                                       {"cutoff": cutoff}).scalar()
+        logger.info("Retention (dry run): %s rows older than %s days would be deleted from %s", count, days, table)
+        return count, 0
+
+    with engine.connect() as connection:
+        size_before = table_size(connection, table)
+    deleted = 0
+    while deadline is None or time.monotonic() < deadline:
+        # Une transaction courte par lot : les écritures du démon ne sont jamais bloquées longtemps
+        with engine.begin() as connection:
+            count = delete_chunk(connection, table, time_column, cutoff, chunk_size)
+        deleted += count
+        if count < chunk_size:
+            break
+        time.sleep(pause)
+
+    reclaimed = 0
+    if deleted:
+        with engine.connect() as connection:
+            reclaim_space(connection, table)
+            reclaimed = max(size_before - table_size(connection, table), 0)
+        rows_deleted.inc(deleted, table=table)
+        bytes_reclaimed.inc(reclaimed, table=table)
+    logger.info("Retention: %s rows deleted from %s (older than %s days), %s bytes reclaimed",
+                deleted, table, days, reclaimed)
+    return deleted, reclaimed
+
+
+def run_retention(config=None, dry_run=False):
+    """ Applique toutes les politiques de rétention dans la limite de `retention.max_runtime` secondes """
+    config = config or load_config()
+    retention_config = config.get("retention", {})
+    chunk_size = retention_config.get("chunk_size", 5000)
+    deadline = time.monotonic() + retention_config.get("max_runtime", 1800)
+    engine = get_engine()
+    total_deleted = total_reclaimed = 0
+    for table, days in get_policies(config).items():
+        if days is None:
+            continue
+        if table not in Base.metadata.tables:
+            # Le nom est interpolé dans le SQL : seules les tables de models.py sont acceptées
+            logger.warning("Retention: unknown table %s ignored", table)
+            continue
+        if time.monotonic() >= deadline:
+            logger.warning("Retention stopped: maximum runtime reached before %s", table)
+            break
+        try:
+            deleted, reclaimed = purge_table(engine, table, days, chunk_size, deadline=deadline, dry_run=dry_run)
+        except Exception as error:
+            logger.error("Retention failed for %s. Exception: %s", table, str(error))
+            continue
+        total_deleted += deleted
+        total_reclaimed += reclaimed
+    logger.info("Retention completed: %s rows deleted, %.1f MB reclaimed", total_deleted, total_reclaimed / 1048576)
+    return total_deleted, total_reclaimed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Purge les mesures brutes selon les politiques de rétention")
+    parser.add_argument("--dry-run", action="store_true", help="Compte les lignes sans les supprimer")
+    args = parser.parse_args()
+    run_retention(dry_run=args.dry_run)
@@ -1,21 +1,36 @@
+import functools
 import logging
 import signal
 import time
 import schedule
 import RPi.GPIO as GPIO
 import threading
-from config import load_config
+from config import get_config_service
 from custom_logging import setup_logger
-from hardware import RelayController, DistanceSensor, ButtonController
+from hardware import RelayController, DistanceSensor, ButtonController, button_gesture_settings
 from weather.weather_api import WeatherAPI
-from data_management.database import create_database
+from data_management.database import create_database_in_background
+from data_management.retention import run_retention
+from data_management.aggregates import refresh_aggregates
+from data_management.backfill import backfill_settings, run_backfill
 from data_management.data_logger import (
-    log_water_level, log_system_state, log_soil_moisture, log_watering_session, log_hourly_rain,
+    log_water_level, log_system_state, log_watering_session, log_watering_decision, log_hourly_rain,
     log_hourly_temperature, log_hourly_wind, log_hourly_sunlight, log_rain_forecast, log_hourly_humidity,
-    log_last_12h_rain, log_cpu_temperature, log_technical_cabinet_conditions
+    log_last_12h_rain, log_cpu_temperature, log_technical_cabinet_conditions, add_measurement_listener
 )
 from hardware.sensors import get_cpu_temperature, get_technical_cabinet_condition_data
-from notifications.email_notifications import send_email
+from notifications.alerting import AlertService
+from monitoring.rules import RuleEngine
+from control import CommandServer, DEFAULT_SOCKET_PATH
+from monitoring.metrics import registry, job_seconds, watering_seconds, watering_in_progress
+from monitoring.profiler import start_background_profile
+from monitoring.sampling import AdaptiveSampler, RateBudget, SamplingPolicy, sampling_settings
+from watering import (
+    build_zones, stop_button_pin, ClosedLoopController, closed_loop_settings, RainDecisionEngine, RainOutlook,
+    rain_decision_settings, Cistern, CisternWatch, cistern_settings, learn_flow_rates, JobJournal, DEFAULT_JOURNAL_PATH,
+    JobQueue, WateringJob, job_queue_settings, MANUAL_PRIORITY, AUTOMATIC_PRIORITY
+)
+from watering.decisions import recent_rain_from_history
 
 GPIO.setwarnings(False)
 GPIO.setmode(GPIO.BCM)
@@ -23,29 +38,40 @@ GPIO.setmode(GPIO.BCM)
 
 class GardenWateringApp:
     """ Classe qui gère l'arrosage du jardin """
-    watering_in_progress = False
-    manual_watering_in_progress = False
+    # Intervalle (secondes) entre deux lignes de progression d'un arrosage dans le journal
+    journal_progress_interval = 15
 
     def __init__(self):
         """ Initialisation des variables """
-        self.config = load_config()
+        self.config_service = get_config_service()
+        self.config = self.config_service.get()
+        self.reschedule_needed = False
+        self.command_server = None
         self.app_logger = setup_logger('log_watering_garden.log', 'garden_app')
-        create_database()
-        self.watering_in_progress = False
-        self.manual_watering_in_progress = False
-        self.last_manual_watering_time = None
-        self.manual_watering_cooldown = 300  # Temps d'attente entre deux arrosages manuels en secondes
-
-        button_actions = {
-            self.config['button_pins'][0]: self.start_tomato_watering,
-            self.config['button_pins'][1]: self.start_garden_watering,
-            self.config['button_pins'][2]: self.start_annex_faucet,
-            self.config['button_pins'][3]: self.stop_watering,  # Mise à jour ici
-        }
+        # Schéma et migration des clés naturelles en arrière-plan : les écritures s'y adaptent (voir upsert)
+        create_database_in_background()
+
+        self.zones = build_zones(self.config)
+        # Bouton de zone : appui = arrosage manuel, double appui = arrosage double, appui long = annulation
+        button_actions = {pin: functools.partial(self.start_zone_watering, zone.name)
+                          for pin, zone in self.zones.button_pins().items()}
+        multi_press_actions = {pin: {2: functools.partial(self.start_zone_watering, zone.name,
+                                                          duration=2 * zone.manual_duration)}
+                               for pin, zone in self.zones.button_pins().items()}
+        long_press_actions = {pin: functools.partial(self.cancel_zone, zone.name)
+                              for pin, zone in self.zones.button_pins().items()}
+        if stop_button_pin(self.config) is not None:
+            button_actions[stop_button_pin(self.config)] = self.stop_watering
+        gestures = button_gesture_settings(self.config)
         self.button_controller = ButtonController(
-            self.config['button_pins'],
+            list(button_actions),
             button_actions,
-            self.config['button_debounce_time']
+            self.config['button_debounce_time'],
+            long_press_actions=long_press_actions,
+            multi_press_actions=multi_press_actions,
+            immediate_pins=[pin for pin in (stop_button_pin(self.config),) if pin is not None],
+            long_press_time=gestures["long_press_time"],
+            multi_press_window=gestures["multi_press_window"],
         )
 
         self.email_config = {
@@ -55,16 +81,27 @@ class GardenWateringApp:
             "smtp_port": self.config["smtp_port"],
             "recipient_address": self.config["recipient_address"]
         }
+        self.alert_service = AlertService.from_config(self.config, self.email_config)
+        self.rule_engine = RuleEngine.from_config(self.config, self.alert_service, self.app_logger)
+        add_measurement_listener(self.rule_engine.observe)
+        self.config_service.subscribe(self.on_config_change)
 
         self.distance_sensor = DistanceSensor(
             trigger_pin=self.config['distance_sensor']['trigger_pin'],
             echo_pin=self.config['distance_sensor']['echo_pin'],
             max_distance=self.config['distance_sensor']['max_distance'],
-            email_config=self.email_config
+            alert_service=self.alert_service,
+            sensor_height=cistern_settings(self.config)["sensor_height"]
         )
+        self.cistern = Cistern.from_config(self.config)
+        self.flow_rates = {}  # débit de pompage appris par zone (litres/minute)
 
         self.dht_pin = self.config['dht11_pin']
-        self.relay_controller = RelayController(self.config["relay_pins"])
+        # Électrovannes des zones et relais des sources d'eau
+        self.relay_pins = sorted(set(self.config["relay_pins"]) | set(self.zones.relay_pins()))
+        self.relay_controller = RelayController(self.relay_pins)
+        self.journal = JobJournal(self.config.get("journal_path", DEFAULT_JOURNAL_PATH))
+        self.recover_interrupted_jobs()
         self.weather_api = WeatherAPI(
             self.config["weatherapi_api_key"],
             self.config["latitude"],
@@ -72,7 +109,7 @@ class GardenWateringApp:
             self.config["ecowitt_application_key"],
             self.config["ecowitt_api_key"],
             self.config["meteo_station_mac_adresse"],
-            email_config=self.email_config
+            alert_service=self.alert_service
         )
 
         self.current_water_source = "Unknown"
@@ -81,8 +118,85 @@ class GardenWateringApp:
         self.current_source = None
 
         signal.signal(signal.SIGINT, self.interrupt_handler)
+        signal.signal(signal.SIGUSR1, self.profile_handler)
+
+        # Tous les arrosages (programmés, boutons, front-end) passent par une file exécutée par un seul thread
+        self.jobs = JobQueue(job_queue_settings(self.config), self.app_logger).start()
+
+        # Niveau, humidité et météo sont mesurés plus souvent pendant un arrosage, une averse ou une alerte
+        sampling = sampling_settings(self.config)
+        self.weather_api.ecowitt_budget = RateBudget(sampling["ecowitt_calls_per_hour"])
+        self.rain_rate = 0.0  # mm/h mesurés lors du dernier échantillon météo
+        self.sampler = AdaptiveSampler(
+            SamplingPolicy(sampling),
+            self.weather_api.ecowitt_budget,
+            {"cistern": self.sample_cistern, "soil": self.sample_soil, "weather": self.sample_weather},
+            self.sampling_activity,
+            self.app_logger
+        )
 
-        self.lock = threading.Lock()
+    @property
+    def watering_in_progress(self):
+        return self.jobs.is_busy("Automatic")
+
+    @property
+    def manual_watering_in_progress(self):
+        return self.jobs.is_busy("Manual")
+
+    # Clés qui ne peuvent pas être modifiées à chaud (broches GPIO initialisées au démarrage)
+    HARDWARE_KEYS = ("button_pins", "stop_button_pin", "relay_pins", "distance_sensor", "dht11_pin")
+
+    def on_config_change(self, new_config, old_config):
+        """ Applique une nouvelle configuration publiée par le service de configuration """
+        self.config = new_config
+        zones = build_zones(new_config)
+        # Seuils, durées et priorités s'appliquent aussitôt ; les broches exigent un redémarrage
+        if (sorted(zones.relay_pins()) != sorted(self.zones.relay_pins())
+                or sorted(zones.button_pins()) != sorted(self.zones.button_pins())):
+            self.app_logger.warning("Zone relay or button pins changed: restart required to apply them.")
+        self.zones = zones
+        self.cistern = Cistern.from_config(new_config)
+        self.jobs.settings = job_queue_settings(new_config)
+        sampling = sampling_settings(new_config)
+        self.sampler.policy = SamplingPolicy(sampling)
+        self.sampler.budget.calls = sampling["ecowitt_calls_per_hour"]
+        gestures = button_gesture_settings(new_config)
+        self.button_controller.long_press_time = gestures["long_press_time"]
+        self.button_controller.multi_press_window = gestures["multi_press_window"]
+        if new_config.get("alert_rules") != old_config.get("alert_rules"):
+            self.rule_engine.reload(new_config)
+        if new_config.get("watering_times") != old_config.get("watering_times"):
+            self.reschedule_needed = True
+        for key in self.HARDWARE_KEYS:
+            if new_config.get(key) != old_config.get(key):
+                self.app_logger.warning(f"Configuration key '{key}' changed: restart required to apply it.")
+        self.app_logger.info("New configuration applied.")
+
+    def recover_interrupted_jobs(self):
+        """
+        Au démarrage : tous les relais sont coupés et les arrosages interrompus par un plantage ou une coupure
+        sont enregistrés avec leur durée partielle, puis le journal est compacté
+        """
+        self.deactivate_all_relays()
+        for job_id, job in self.journal.unfinished().items():
+            elapsed = job.get("elapsed", 0)
+            self.app_logger.warning(f"Watering of {job['zone']} ({job['mode']}) was interrupted after "
+                                    f"{elapsed} seconds: recording it as a partial session.")
+            session_id = log_watering_session(job["zone"], elapsed, job.get("source") or "Unknown",
+                                              job.get("moisture"), f"{job['mode']} (interrupted)")
+            # Sans base de données, l'arrosage reste dans le journal et sera clos au prochain démarrage
+            if session_id is not None:
+                self.journal.end(job_id, elapsed, "recovered")
+        self.journal.compact()
+
+    def wait_watering(self, job, duration):
+        """ Attend la fin d'un arrosage à durée fixe en journalisant sa progression ; renvoie la durée écoulée """
+        start = time.monotonic()
+        while True:
+            remaining = duration - (time.monotonic() - start)
+            if remaining <= 0 or job.cancel_event.wait(min(remaining, self.journal_progress_interval)):
+                return min(duration, time.monotonic() - start)
+            self.journal.progress(job.id, time.monotonic() - start, source=self.current_water_source)
 
     def update_system_state(self, state, zone, source, mode):
         """ Met à jour et enregistre l'état du système """
@@ -122,64 +236,147 @@ class GardenWateringApp:
 
     def deactivate_all_relays(self):
         """ Désactive tous les relais activés pendant l'arrosage """
-        for pin in self.config["relay_pins"]:
+        for pin in self.relay_pins:
             self._deactivate_relay(pin)
 
+    @job_seconds.time(job="send_data_to_db_hourly")
     def send_data_to_db_hourly(self):
-        """ Enregistre les données de niveau des citernes, d'humidité, etc. toutes les heures dans la base de données """
+        """ Enregistre les données de l'armoire technique toutes les heures dans la base de données """
         try:
-            level = self.distance_sensor.get_distance()
-            tomato_moisture, garden_moisture = self.weather_api.get_soil_moisture_data()
-            last_hour_rain = self.weather_api.get_last_1_hour_rain_data()
-            last_hour_temperature = self.weather_api.get_last_1_hour_temperature_data()
-            last_hour_wind_speed = self.weather_api.get_last_1_hour_wind_data()
-            last_hour_sun_radiation = self.weather_api.get_last_1_hour_sun_data()
-            last_hour_humidity = self.weather_api.get_last_1_hour_humidity_data()
-
-            log_water_level(level)
-            log_soil_moisture(tomato_moisture, "Tomato")
-            log_soil_moisture(garden_moisture, "Garden")
-            log_hourly_rain(last_hour_rain)
-            log_hourly_temperature(last_hour_temperature)
-            log_hourly_wind(last_hour_wind_speed)
-            log_hourly_sunlight(last_hour_sun_radiation)
-            log_hourly_humidity(last_hour_humidity)
-
-            cpu_temp = get_cpu_temperature()
-            log_cpu_temperature(cpu_temp)
-
-            # Check CPU temperature and send alert if it exceeds 70°C
-            if cpu_temp and cpu_temp > 70:
-                subject = "Alerte: Température CPU élevée"
-                body = f"La température du CPU a dépassé 70°C. Température actuelle: {cpu_temp}°C"
-                send_email(self.email_config, subject, body)
-                self.app_logger.warning("CPU temperature exceeded 70°C. Alert email sent.")
+            # Niveau, humidité et météo suivent l'échantillonnage adaptatif, sauf s'il est désactivé
+            if not sampling_settings(self.config)["enabled"]:
+                self.sample_cistern(3600)
+                self.sample_soil(3600)
+                self.sample_weather(3600)
+
+            # Les seuils d'alerte (CPU, armoire technique...) sont évalués par le moteur de règles
+            log_cpu_temperature(get_cpu_temperature())
 
             ambient_temp, ambient_humidity = get_technical_cabinet_condition_data(self.dht_pin)
             log_technical_cabinet_conditions(ambient_temp, ambient_humidity)
         except Exception as e:
             self.app_logger.error(f"Error in send_data_to_db_hourly: {e}")
+        # Agrégats du graphique annuel : seul le jour en cours est recalculé
+        refresh_aggregates(zones=self.zones)
+        self.export_metrics()
+
+    def sample_telemetry(self):
+        """ Tick de l'échantillonnage adaptatif """
+        if sampling_settings(self.config)["enabled"]:
+            self.sampler.tick()
+
+    def sample_cistern(self, elapsed):
+        log_water_level(self.distance_sensor.get_distance())
+
+    def sample_soil(self, elapsed):
+        # Une seule requête Ecowitt pour toutes les zones ; chaque lecture réussie est enregistrée par l'API
+        self.weather_api.get_soil_moisture_data(self.zones.soil_channels())
+
+    def sample_weather(self, elapsed):
+        """ Météo de la période écoulée depuis l'échantillon précédent (une requête Ecowitt) """
+        weather = self.weather_api.get_recent_weather_data(elapsed)
+        log_hourly_rain(weather["rain"])
+        log_hourly_temperature(weather["temperature"])
+        log_hourly_wind(weather["wind"])
+        log_hourly_sunlight(weather["sunlight"])
+        log_hourly_humidity(weather["humidity"])
+        if weather["rain"] is not None:
+            self.rain_rate = weather["rain"] * 3600 / elapsed
+        # Rafraîchit les prévisions (weatherapi.com, en cache 30 minutes) lues par la politique d'échantillonnage
+        self.weather_api.get_hourly_rain_forecast(1)
+
+    def sampling_activity(self):
+        """ État du système pour la politique d'échantillonnage """
+        heavy_rain = sampling_settings(self.config)["heavy_rain"]
+        min_chance = rain_decision_settings(self.config)["min_chance"]
+        # Prévisions en cache uniquement (chargées par l'échantillon météo) : aucune requête à chaque tick
+        forecast = self.weather_api.get_cached_rain_forecast(1)
+        return {
+            "watering": self.jobs.is_busy(),
+            "rain": self.rain_rate >= heavy_rain
+                    or any(rain >= heavy_rain and chance >= min_chance for _, rain, chance in forecast),
+            "alert": bool(self.rule_engine.active_rules()),
+        }
 
-    def calculate_watering_duration(self, moisture_level):
+    def export_metrics(self):
+        """ Exporte les métriques du démon dans un fichier texte si configuré (collecteur textfile) """
+        metrics_textfile = self.config.get("metrics_textfile")
+        if not metrics_textfile:
+            return
+        try:
+            registry.write_textfile(metrics_textfile)
+        except OSError as e:
+            self.app_logger.error(f"Failed to write metrics textfile {metrics_textfile}: {e}")
+
+    def calculate_watering_duration(self, moisture_level, threshold=None):
+        if threshold is None:
+            threshold = self.config.get("moisture_threshold", 62)
         if moisture_level < 30:
             return 600
         elif moisture_level < 50:
             return 420
-        elif moisture_level < 62:
+        elif moisture_level < threshold:
             return 240
         else:
             return 0
 
-    def select_water_source(self):
-        """ Sélectionne la source d'eau en fonction du niveau des citernes """
+    def zone_flow_rate(self, zone):
+        """ Débit de la zone : celui de la configuration, sinon celui appris de l'historique """
+        if zone is None:
+            return None
+        return zone.flow_rate or self.flow_rates.get(zone.name)
+
+    def learn_flow_rates(self):
+        """ Réapprend chaque jour le débit de pompage de chaque zone à partir des niveaux mesurés """
+        try:
+            self.flow_rates = learn_flow_rates(self.cistern, cistern_settings(self.config)["learning_days"])
+            self.app_logger.info("Learned pump flow rates (L/min): " + (", ".join(
+                f"{zone} {rate:.1f}" for zone, rate in self.flow_rates.items()) or "none yet"))
+        except Exception as e:
+            self.app_logger.error(f"Failed to learn pump flow rates: {e}")
+
+    def select_water_source(self, zone=None, planned_seconds=None):
+        """
+        Sélectionne la source d'eau selon le volume de la citerne au-dessus de la réserve : l'eau de ville est
+        choisie d'emblée si la pompe ne pourrait tourner que quelques instants avant d'atteindre la réserve
+        """
         level = self.distance_sensor.get_distance()
         log_water_level(level)
-        if level >= self.config['minimum_water_level']:
+        pump_seconds = self.cistern.seconds_until_reserve(level, self.zone_flow_rate(zone))
+        min_pump_seconds = cistern_settings(self.config)["min_pump_seconds"]
+        if pump_seconds > 0 and (pump_seconds >= min_pump_seconds or
+                                 (planned_seconds is not None and pump_seconds >= planned_seconds)):
             self.relay_controller.activate_relay(self.config['pump_relay_pin'])
             source = "pump"
         else:
             self.relay_controller.activate_relay(self.config['city_water_relay_pin'])
             source = "city_water"
+        self.current_water_source = source
+        return source
+
+    def watch_cistern(self, zone, source):
+        """ Pendant un arrosage à la pompe, surveille la citerne pour basculer avant la réserve """
+        if source != "pump":
+            return None
+        return CisternWatch(self.cistern, self.distance_sensor.get_distance, self.switch_to_city_water,
+                            self.zone_flow_rate(zone), cistern_settings(self.config)["check_interval"]).start()
+
+    def switch_to_city_water(self):
+        """ Bascule de la pompe vers l'eau de ville en cours d'arrosage """
+        self.relay_controller.activate_relay(self.config['city_water_relay_pin'])
+        self.relay_controller.deactivate_relay(self.config['pump_relay_pin'])
+        self.current_water_source = "city_water"
+        self.app_logger.info("Cistern reached its reserve: switched to city water.")
+
+    def release_water_source(self, source, watch):
+        """ Coupe la source en fin d'arrosage ; renvoie la source à enregistrer pour la session """
+        if watch is not None and watch.stop():
+            self.deactivate_water_source("city_water")
+            return "pump+city_water"
+        self.deactivate_water_source(source)
+        if source == "pump":
+            # Niveau après pompage : sert à apprendre le débit de chaque zone
+            log_water_level(self.distance_sensor.get_distance())
         return source
 
     def deactivate_water_source(self, source):
@@ -189,143 +386,351 @@ class GardenWateringApp:
         elif source == "city_water":
             self.relay_controller.deactivate_relay(self.config['city_water_relay_pin'])
 
-    def water_tomatoes(self):
-        """ Arrose les tomates si nécessaire """
-        tomato_moisture = self.weather_api.get_soil_moisture_data()[0]
-        if tomato_moisture >= 62:
-            self.app_logger.info("No watering needed for tomatoes, soil moisture is sufficient.")
+    def uses_closed_loop(self, zone):
+        """ Une zone équipée d'un capteur est arrosée en boucle fermée si elle ou la configuration le demande """
+        if zone.soil_channel is None:
+            return False
+        return closed_loop_settings(self.config)["enabled"] if zone.closed_loop is None else zone.closed_loop
+
+    def water_zone(self, zone, moisture, factor=1.0, job=None):
+        """ Arrose une zone ; `factor` raccourcit l'arrosage lorsque de la pluie est tombée ou attendue """
+        job = job or WateringJob(zone.name, "Automatic", AUTOMATIC_PRIORITY, None)
+        closed_loop = self.uses_closed_loop(zone)
+        if closed_loop:
+            # Une reprise après préemption ne dispose que du reste de la durée maximale
+            planned = max(0, round(closed_loop_settings(self.config)["max_duration"] * factor)
+                          - job.kwargs.get("watered", 0))
+        else:
+            planned = round(self.calculate_watering_duration(moisture, zone.moisture_threshold) * factor)
+        if closed_loop and planned <= 0:
+            self.app_logger.info(f"Closed-loop watering of {zone.name} already used its maximum duration.")
             return
-
-        duration = self.calculate_watering_duration(tomato_moisture)
-        source = self.select_water_source()
-        self.relay_controller.activate_relay(self.config['tomato_relay_pin'])
-        self.update_system_state("Watering", "Tomatoes", source, "Automatic")
-        self.app_logger.info(f"Starting to water tomatoes for {duration} seconds using {source}.")
-        time.sleep(duration)
-        self.relay_controller.deactivate_relay(self.config['tomato_relay_pin'])
-        self.app_logger.info("Finished watering tomatoes.")
-        self.deactivate_water_source(source)
-        log_watering_session("tomatoes", duration, source, tomato_moisture, "Automatic")
-
-    def water_garden(self):
-        """ Arrose le jardin si nécessaire """
-        garden_moisture = self.weather_api.get_soil_moisture_data()[1]
-        if garden_moisture >= 62:
-            self.app_logger.info("No watering needed for garden, soil moisture is sufficient.")
+        source = self.select_water_source(zone, planned)
+        start = time.perf_counter()
+        watch, journaled, duration, trajectory = None, False, None, None
+        try:
+            watch = self.watch_cistern(zone, source)
+            # Écrit avant l'ouverture de la vanne : un arrosage interrompu est toujours retrouvé au redémarrage
+            self.journal.start(zone.name, "Automatic", job_id=job.id, relay_pin=zone.relay_pin, source=source,
+                               moisture=moisture, planned=planned)
+            journaled = True
+            self.relay_controller.activate_relay(zone.relay_pin)
+            self.update_system_state("Watering", zone.name, source, "Automatic")
+            watering_in_progress.set(1)
+            if closed_loop:
+                settings = closed_loop_settings(self.config)
+                target = zone.target_moisture or zone.moisture_threshold + settings["target_margin"]
+                self.app_logger.info(f"Starting closed-loop watering of {zone.name} using {source}: "
+                                     f"{moisture}% towards {target}%, at most {planned} seconds.")
+                controller = ClosedLoopController.from_config(
+                    self.config, functools.partial(self.weather_api.read_soil_moisture, zone.soil_channel),
+                    job.cancel_event)
+                controller.max_duration = planned
+                controller.on_reading = lambda elapsed, reading: self.journal.progress(
+                    job.id, elapsed, moisture=reading, source=self.current_water_source)
+                result = controller.run(moisture, target)
+                duration, trajectory = result.duration, result.trajectory
+                self.app_logger.info(f"Closed-loop watering of {zone.name} ended after {duration} seconds "
+                                     f"({result.reason}, soil moisture {result.final_moisture}%).")
+                if job.preempted:
+                    # Reprise après l'arrosage manuel prioritaire : durée déjà arrosée et dernière humidité lue
+                    job.kwargs["watered"] = job.kwargs.get("watered", 0) + duration
+                    if result.final_moisture is not None:
+                        job.kwargs["moisture"] = result.final_moisture
+            else:
+                self.app_logger.info(f"Starting to water {zone.name} for {planned} seconds using {source}.")
+                duration = round(self.wait_watering(job, planned))
+                if job.preempted and planned:
+                    # Reprise après l'arrosage manuel prioritaire : seule la durée restante sera arrosée
+                    job.kwargs["factor"] = factor * (planned - duration) / planned
+        except Exception as e:
+            self.app_logger.error(f"Error during watering in {zone.name}: {e}")
+        finally:
+            # Vanne et source coupées quoi qu'il arrive (journal, contrôleur ou capteur en erreur)
+            self._deactivate_relay(zone.relay_pin)
+            watering_seconds.observe(time.perf_counter() - start, zone=zone.name, mode="Automatic")
+            watering_in_progress.set(0)
+            source = self.release_water_source(source, watch)
+            self.update_system_state("Stopped", zone.name, self.current_water_source, "Automatic")
+            if duration is None:
+                duration = round(time.perf_counter() - start) if journaled else 0
+            volume = zone.estimated_volume(duration)
+            self.app_logger.info(f"Finished watering {zone.name}" + (f" (about {volume:.0f} L)." if volume else "."))
+            log_watering_session(zone.name, duration, source, moisture, "Automatic", trajectory)
+            if journaled:
+                self.journal.end(job.id, time.perf_counter() - start, "preempted" if job.preempted else "done")
+
+    def run_automatic_job(self, job):
+        """ Exécute un arrosage automatique sorti de la file """
+        zone = self.zones.get(job.zone)
+        if zone is None:
+            self.app_logger.warning(f"Zone {job.zone} no longer exists, automatic watering dropped.")
             return
+        self.water_zone(zone, job.kwargs["moisture"], job.kwargs.get("factor", 1.0), job)
+
+    @job_seconds.time(job="scheduled_watering")
+    def scheduled_watering(self, zone_names=None, allow_defer=True):
+        """
+        Décide, à des heures définies, de l'arrosage de chaque zone en fonction de l'humidité du sol et de la pluie,
+        et place les arrosages retenus dans la file ; `zone_names` limite le passage aux zones reportées
+        """
+        # Chaque source peut manquer (réseau, API) : la décision retombe sur l'historique ou sur les prévisions seules
+        try:
+            log_rain_forecast(self.weather_api.get_next_12_hour_rain_data())
+        except Exception as e:
+            self.app_logger.warning(f"Rain forecast unavailable: {e}")
 
-        duration = self.calculate_watering_duration(garden_moisture)
-        source = self.select_water_source()
-        self.relay_controller.activate_relay(self.config['garden_relay_pin'])
-        self.update_system_state("Watering", "Garden", source, "Automatic")
-        self.app_logger.info(f"Starting to water garden for {duration} seconds using {source}.")
-        time.sleep(duration)
-        self.relay_controller.deactivate_relay(self.config['garden_relay_pin'])
-        self.app_logger.info("Finished watering garden.")
-        self.deactivate_water_source(source)
-        log_watering_session("garden", duration, source, garden_moisture, "Automatic")
-
-    def scheduled_watering(self):
-        """ Commence l'arrosage à des heures définies en fonction de l'humidité du sol """
-        if self.watering_in_progress or self.manual_watering_in_progress:
-            self.app_logger.info("Watering already in progress. Skipping scheduled watering.")
+        try:
+            last_12h_rain = self.weather_api.get_last_12_hour_rain_data()
+            log_last_12h_rain(last_12h_rain)
+        except Exception as e:
+            self.app_logger.warning(f"Weather station unavailable, using the rain history: {e}")
+            last_12h_rain = None
+        if last_12h_rain is None:
+            try:
+                last_12h_rain = recent_rain_from_history(12)
+            except Exception as e:
+                # Sans station ni historique, la décision ne repose que sur les prévisions
+                self.app_logger.warning(f"Rain history unavailable, deciding without measured rain: {e}")
+                last_12h_rain = 0.0
+
+        # Prévisions déjà en cache : la requête précédente les a chargées
+        outlook = RainOutlook(last_12h_rain, self.weather_api.get_hourly_rain_forecast(12))
+        engine = RainDecisionEngine.from_config(self.config)
+
+        # Un seul passage : humidité de toutes les zones en une requête, arrosages mis en file par priorité
+        zones = [zone for zone in self.zones.automatic_zones() if zone_names is None or zone.name in zone_names]
+        try:
+            moisture = self.weather_api.get_soil_moisture_data(
+                {zone.name: zone.soil_channel for zone in zones if zone.soil_channel})
+        except Exception as e:
+            self.app_logger.error(f"Soil moisture unavailable, automatic watering skipped: {e}")
             return
-
-        self.watering_in_progress = True
-
-        rain_forecast = self.weather_api.get_next_12_hour_rain_data()
-        log_rain_forecast(rain_forecast)
-
-        last_12h_rain = self.weather_api.get_last_12_hour_rain_data()
-        log_last_12h_rain(last_12h_rain)
-
-        self.water_tomatoes()
-        self.water_garden()
-
-        self.watering_in_progress = False
-        self.update_system_state("Stopped", "All", self.current_water_source, "Automatic")
-        self.app_logger.info("Scheduled watering completed.")
-
-    def start_tomato_watering(self):
-        """ Démarre l'arrosage manuel pour les tomates """
-        self.start_watering(self.config["tomato_relay_pin"], self.config["tomato_watering_duration"], "Tomato")
-
-    def start_garden_watering(self):
-        """ Démarre l'arrosage manuel pour le jardin """
-        self.start_watering(self.config["garden_relay_pin"], self.config["garden_watering_duration"], "Garden")
-
-    def start_annex_faucet(self):
-        """ Démarre l'arrosage manuel pour le robinet annexe """
-        self.start_watering(self.config["annex_relay_pin"], self.config["annex_watering_duration"], "Annex")
-
-    def start_watering(self, relay_pin, duration, zone_name):
-        """ Démarre l'arrosage pour une zone spécifique """
-        current_time = time.time()
-        with self.lock:
-            if self.can_start_manual_watering():
-                if self.last_manual_watering_time and (
-                        current_time - self.last_manual_watering_time) < self.manual_watering_cooldown:
-                    self.app_logger.info(
-                        f"Cannot start manual watering for {zone_name} zone. Please wait for the cooldown period.")
-                    return
-
-                self.manual_watering_in_progress = True
-                try:
-                    level = self.distance_sensor.get_distance()
-                    self.current_water_source = self.select_water_source()
-                    self.update_system_state("Watering", zone_name, self.current_water_source, "Manual")
-                    self._activate_relay(relay_pin)
-                    self.app_logger.info(f"Starting manual watering for {zone_name} zone for {duration} seconds.")
-                    time.sleep(duration)
-                except Exception as e:
-                    self.app_logger.error(f"Error during watering in {zone_name}: {e}")
-                finally:
-                    self._deactivate_relay(relay_pin)
-                    self.manual_watering_in_progress = False
-                    self.deactivate_water_source(self.current_water_source)
-                    self.update_system_state("Stopped", zone_name, self.current_water_source, "Manual")
-                    log_watering_session(zone_name, duration, self.current_water_source, None, "Manual")
-                    self.last_manual_watering_time = time.time()
-            else:
-                self.app_logger.info("Watering already in progress. Skipping manual watering.")
-
-    def can_start_manual_watering(self):
-        """ Vérifie si un nouvel arrosage manuel peut être démarré """
-        with self.lock:
-            return not self.watering_in_progress and not self.manual_watering_in_progress
+        deferred = []
+        for zone in zones:
+            if zone.name not in moisture:
+                self.app_logger.info(f"No soil moisture sensor for {zone.name}, skipping automatic watering.")
+                continue
+            decision = engine.decide(zone, moisture[zone.name], outlook, allow_defer)
+            log_watering_decision(decision)
+            if decision.action == "defer":
+                deferred.append(zone.name)
+            elif decision.action in ("water", "reduce"):
+                status, _ = self.jobs.submit(WateringJob(
+                    zone.name, "Automatic", AUTOMATIC_PRIORITY + zone.priority, self.run_automatic_job,
+                    requested_by="schedule", moisture=decision.moisture, factor=decision.factor))
+                self.app_logger.info(f"Automatic watering of {zone.name}: {status}.")
+
+        self.app_logger.info("Scheduled watering decisions completed.")
+        if deferred:
+            self.defer_watering(deferred, rain_decision_settings(self.config)["defer_hours"])
+
+    def defer_watering(self, zone_names, hours):
+        """ Réévalue une seule fois, dans `hours` heures, les zones dont l'arrosage a été reporté """
+        def deferred_watering():
+            self.scheduled_watering(zone_names=zone_names, allow_defer=False)
+            return schedule.CancelJob
+
+        schedule.every(hours).hours.do(self.guarded(deferred_watering)).tag("deferred-watering")
+        self.app_logger.info(f"Watering of {', '.join(zone_names)} deferred by {hours} hours.")
+
+    def start_zone_watering(self, zone, requested_by="button", duration=None):
+        """
+        Demande l'arrosage manuel d'une zone du registre (bouton, front-end) ; renvoie l'issue de la demande :
+        queued, duplicate (déjà en attente ou en cours), cooldown, full ou unknown_zone
+        """
+        zone_name, zone = zone, self.zones.get(zone)
+        if zone is None:
+            self.app_logger.warning(f"Manual watering requested for unknown zone {zone_name}.")
+            return {"status": "unknown_zone"}
+        status, job = self.jobs.submit(WateringJob(
+            zone.name, "Manual", MANUAL_PRIORITY + zone.priority, self.run_manual_job, requested_by=requested_by,
+            duration=duration or zone.manual_duration))
+        self.app_logger.info(f"Manual watering of {zone.name} requested by {requested_by}: {status}.")
+        result = {"status": status, "job": job.to_dict() if job else None}
+        if status == "cooldown":
+            result["retry_after"] = self.jobs.cooldown_remaining(zone.name)
+        return result
+
+    def run_manual_job(self, job):
+        """ Exécute un arrosage manuel sorti de la file """
+        zone = self.zones.get(job.zone)
+        if zone is None:
+            self.app_logger.warning(f"Zone {job.zone} no longer exists, manual watering dropped.")
+            return
+        duration = job.kwargs["duration"]
+        watering_in_progress.set(1)
+        start = time.perf_counter()
+        source, watch, journaled, elapsed = None, None, False, None
+        try:
+            source = self.select_water_source(zone, duration)
+            watch = self.watch_cistern(zone, source)
+            self.journal.start(zone.name, "Manual", job_id=job.id, relay_pin=zone.relay_pin, source=source,
+                               planned=duration)
+            journaled = True
+            self.update_system_state("Watering", zone.name, self.current_water_source, "Manual")
+            self._activate_relay(zone.relay_pin)
+            self.app_logger.info(f"Starting manual watering for {zone.name} zone for {duration} seconds.")
+            # Durée réellement arrosée : l'arrosage peut être annulé (front-end, appui long, bouton d'arrêt)
+            elapsed = round(self.wait_watering(job, duration))
+        except Exception as e:
+            self.app_logger.error(f"Error during watering in {zone.name}: {e}")
+        finally:
+            self._deactivate_relay(zone.relay_pin)
+            watering_seconds.observe(time.perf_counter() - start, zone=zone.name, mode="Manual")
+            watering_in_progress.set(0)
+            source = self.release_water_source(source, watch)
+            self.update_system_state("Stopped", zone.name, self.current_water_source, "Manual")
+            if elapsed is None:
+                elapsed = round(time.perf_counter() - start) if journaled else 0
+            log_watering_session(zone.name, elapsed, source or "Unknown", None, "Manual")
+            if journaled:
+                self.journal.end(job.id, time.perf_counter() - start)
+
+    def cancel_job(self, job_id):
+        """ Annule un arrosage en attente ou interrompt celui en cours """
+        return {"cancelled": self.jobs.cancel(job_id)}
+
+    def cancel_zone(self, zone_name):
+        """ Annule les arrosages d'une zone, en attente ou en cours (appui long sur son bouton) """
+        cancelled = self.jobs.cancel_zone(zone_name)
+        self.app_logger.info(f"{cancelled} watering(s) of {zone_name} cancelled.")
+        return {"cancelled": cancelled}
 
     def stop_watering(self):
-        """ Stoppe tous les arrosages et désactive tous les relais """
-        with self.lock:
-            if self.watering_in_progress or self.manual_watering_in_progress:
-                self.app_logger.info("Stopping all watering actions.")
-                self.watering_in_progress = False
-                self.manual_watering_in_progress = False
-                self.deactivate_all_relays()
-                self.update_system_state("Stopped", "All", self.current_water_source, "Manual")
-                self.app_logger.info("All watering stopped.")
-            else:
-                self.app_logger.info("No watering action in progress to stop.")
+        """ Stoppe tous les arrosages, vide la file et désactive tous les relais """
+        if self.jobs.clear():
+            self.app_logger.info("Stopping all watering actions.")
+            self.deactivate_all_relays()
+            self.update_system_state("Stopped", "All", self.current_water_source, "Manual")
+            self.app_logger.info("All watering stopped.")
+        else:
+            self.app_logger.info("No watering action in progress to stop.")
 
     def interrupt_handler(self, signum, frame):
         """ Gère les interruptions """
         self.app_logger.info("Watering stopped by interrupt signal.")
         self.stop_watering()
 
+    def profile_handler(self, signum, frame):
+        """ Lance un profil d'échantillonnage de tous les threads du démon (kill -USR1 <pid>) """
+        duration = self.config.get("profile_duration", 30)
+        output_format = self.config.get("profile_format", "collapsed")
+        self.app_logger.info(f"Starting a {duration}s sampling profile of the daemon.")
+        start_background_profile(duration, output_format, "daemon", self.app_logger)
+
     def run(self):
         """ Fonction principale pour déclencher l'arrosage à heures fixes et enregistrer le niveau d'eau """
-        schedule.every().hour.at(":00").do(self.send_data_to_db_hourly)
-        schedule.every().day.at("08:00").do(self.scheduled_watering)
-        schedule.every().day.at("20:00").do(self.scheduled_watering)
-        schedule.every().day.at("00:00").do(self.weather_api.reset_reported_errors)  # Réinitialise les erreurs à minuit
+        schedule.every().hour.at(":00").do(self.guarded(self.send_data_to_db_hourly))
+        self.schedule_watering()
+        # Réinitialise les erreurs à minuit
+        schedule.every().day.at("00:00").do(self.guarded(self.weather_api.reset_reported_errors))
+        schedule.every().day.at("00:05").do(self.guarded(self.learn_flow_rates))
+        schedule.every().day.at("00:10").do(self.guarded(self.journal.compact))
+        self.learn_flow_rates()
+        schedule.every().minute.do(self.guarded(self.rule_engine.check_absence))
+        schedule.every(sampling_settings(self.config)["tick"]).seconds.do(self.guarded(self.sample_telemetry))
+        schedule.every().day.at(backfill_settings(self.config)["time"]).do(self.guarded(self.start_backfill))
+        self.start_backfill()  # Rattrape aussitôt un éventuel arrêt du démon
+        schedule.every().day.at(self.config.get("retention", {}).get("time", "03:30")).do(
+            self.guarded(self.start_retention))
+        self.config_service.start_watching()
+        self.start_command_server()
 
         while True:
-            schedule.run_pending()
+            if self.reschedule_needed:
+                self.reschedule_needed = False
+                self.schedule_watering()
+            try:
+                schedule.run_pending()
+            except Exception as e:
+                self.app_logger.error(f"Scheduler error: {e}")
             time.sleep(1)
 
+    def guarded(self, job):
+        """
+        Enveloppe un job du planificateur : une exception est journalisée au lieu d'arrêter la boucle
+        (schedule ne replanifie pas un job qui a levé une exception, il serait relancé à chaque seconde)
+        """
+        @functools.wraps(job)
+        def run_job(*args, **kwargs):
+            try:
+                return job(*args, **kwargs)
+            except Exception as e:
+                self.app_logger.error(f"Scheduled job {job.__name__} failed: {e}")
+        return run_job
+
+    def start_retention(self):
+        """ Lance la purge des mesures anciennes en dehors de la boucle du planificateur """
+        if self.watering_in_progress or self.manual_watering_in_progress:
+            self.app_logger.info("Watering in progress. Skipping data retention today.")
+            return
+        threading.Thread(target=run_retention, args=(self.config,), name="retention", daemon=True).start()
+
+    def start_backfill(self):
+        """ Rattrape les trous de l'historique météo en dehors de la boucle du planificateur """
+        if not backfill_settings(self.config)["enabled"]:
+            return
+        threading.Thread(target=self.backfill_history, name="backfill", daemon=True).start()
+
+    def backfill_history(self):
+        try:
+            run_backfill(self.weather_api, self.config, budget=self.weather_api.ecowitt_budget)
+        except Exception as e:
+            self.app_logger.error(f"Error while backfilling the weather history: {e}")
+
+    def start_command_server(self):
+        """ Expose les commandes d'arrosage au front-end Flask via une socket Unix """
+        # Les demandes d'arrosage sont placées dans la file : la réponse est immédiate
+        commands = {
+            "start_zone_watering": self.start_zone_watering,
+            "stop_watering": self.stop_watering,
+            "status": self.get_status,
+            "queue": self.jobs.snapshot,
+            "cancel_job": self.cancel_job,
+            "sampling": self.sampler.snapshot,
+        }
+        socket_path = self.config.get("control_socket", DEFAULT_SOCKET_PATH)
+        try:
+            self.command_server = CommandServer(socket_path, commands).start()
+            self.app_logger.info(f"Control channel listening on {socket_path}")
+        except OSError as e:
+            self.app_logger.error(f"Failed to start control channel on {socket_path}: {e}")
+
+    def get_status(self):
+        """ Arrosage en cours, pour le tableau de bord """
+        return {
+            "watering": self.watering_in_progress,
+            "manual": self.manual_watering_in_progress,
+            "state": self.current_state,
+            "zone": self.current_zone,
+            "source": self.current_source,
+            "queued": len(self.jobs.snapshot()["queued"]),
+        }
+
+    def schedule_watering(self):
+        """ (Re)planifie les arrosages automatiques aux heures définies dans la configuration """
+        watering_times = self.config.get("watering_times", ("08:00", "20:00"))
+        # Les nouveaux jobs sont construits avant de retirer les anciens : une heure invalide ne vide pas le planning
+        try:
+            jobs = [schedule.every().day.at(watering_time) for watering_time in watering_times]
+        except schedule.ScheduleValueError as e:
+            self.app_logger.error(f"Invalid watering times {', '.join(watering_times)}, keeping the schedule: {e}")
+            return
+        schedule.clear("watering")
+        for job in jobs:
+            job.do(self.guarded(self.scheduled_watering)).tag("watering")
+        self.app_logger.info(f"Automatic watering scheduled at {', '.join(watering_times)}.")
+
     def destroy(self):
         self.app_logger.info("Destroying application...")
         self.stop_watering()  # Assurez-vous que tous les arrosages sont arrêtés
+        self.jobs.stop()
+        self.button_controller.stop()
+        self.alert_service.stop()
+        self.journal.close()
+        if self.command_server is not None:
+            self.command_server.stop()
         GPIO.cleanup()
 
 
@@ -1,4 +1,4 @@
 # hardware/__init__.py
 from .relays import RelayController
 from .sensors import DistanceSensor
-from .buttons import ButtonController
+from .buttons import ButtonController, button_gesture_settings
@@ -1,15 +1,51 @@
 # buttons.py
 import RPi.GPIO as GPIO
 import logging
+import queue
+import threading
 import time
 
+# Durées des gestes, en secondes
+LONG_PRESS_TIME = 1.5
+MULTI_PRESS_WINDOW = 0.4
+
+
+def button_gesture_settings(config):
+    """ Durées des gestes (section `button_gestures` de config.json) """
+    settings = {"long_press_time": LONG_PRESS_TIME, "multi_press_window": MULTI_PRESS_WINDOW}
+    settings.update(config.get("button_gestures", {}))
+    return settings
+
 
 class ButtonController:
-    def __init__(self, button_pins, button_actions, debounce_time):
+    def __init__(self, button_pins, button_actions, debounce_time, long_press_actions=None,
+                 multi_press_actions=None, immediate_pins=(), long_press_time=LONG_PRESS_TIME,
+                 multi_press_window=MULTI_PRESS_WINDOW):
         self.button_pins = button_pins
         self.button_actions = button_actions
         self.debounce_time = debounce_time
-        self.last_press_time = {pin: 0 for pin in button_pins}
+        # Gestes optionnels : {pin: action} pour l'appui long, {pin: {nombre d'appuis: action}} pour les appuis multiples
+        self.long_press_actions = long_press_actions or {}
+        self.multi_press_actions = multi_press_actions or {}
+        # Boutons traités dès l'appui, sans attendre un éventuel geste (arrêt)
+        self.immediate_pins = set(immediate_pins)
+        self.long_press_time = long_press_time
+        self.multi_press_window = multi_press_window
+        # Anti-rebond logiciel : le premier front est pris aussitôt, les suivants sont ignorés pendant
+        # `debounce_time` ms, puis le niveau de la broche est relu pour ne manquer aucun relâchement
+        self.lockout_until = {}
+        self.pressed_at = {}
+        self.long_press_fired = set()
+        self.press_count = {}
+        self.press_deadline = {}
+        # Le thread GPIO ne fait que déposer les fronts ; le dispatcher décode les gestes,
+        # et les actions lentes s'exécutent sur leur propre thread pour ne jamais retarder l'arrêt
+        self.events = queue.SimpleQueue()
+        self.actions = queue.SimpleQueue()
+        self.dispatcher = threading.Thread(target=self._dispatch, name="button-dispatcher", daemon=True)
+        self.action_worker = threading.Thread(target=self._run_actions, name="button-actions", daemon=True)
+        self.dispatcher.start()
+        self.action_worker.start()
         try:
             self.setup_button_pins()
         except RuntimeError as e:
@@ -21,28 +57,146 @@ class ButtonController:
             GPIO.setmode(GPIO.BCM)
             for pin in self.button_pins:
                 GPIO.setup(pin, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-                GPIO.add_event_detect(pin, GPIO.FALLING, callback=self.button_callback, bouncetime=self.debounce_time)
+                # Les deux fronts : l'appui (descendant) et le relâchement (montant) mesurent la durée de l'appui.
+                # Pas de bouncetime : RPi.GPIO perdrait le relâchement d'un appui plus court que le délai
+                GPIO.add_event_detect(pin, GPIO.BOTH, callback=self.button_callback)
         except RuntimeError as e:
             logging.error("RuntimeError during GPIO setup: %s", e)
             raise
 
     def button_callback(self, pin):
-        """ Fonction de rappel pour gérer la pression des boutons """
-        current_time = time.time()
-        if current_time - self.last_press_time[pin] < self.debounce_time / 1000.0:
-            return  # Ignore the button press as it's within the debounce time
-        self.last_press_time[pin] = current_time
-
-        if pin in self.button_actions:
-            action = self.button_actions[pin]
+        """ Fonction de rappel du thread GPIO : dépose le front dans la file et rend la main aussitôt """
+        self.events.put((pin, GPIO.input(pin) == GPIO.LOW, time.monotonic()))
+
+    def is_pressed(self, pin):
+        """ Niveau actuel de la broche (bas = appuyé) ; l'état connu si elle ne peut pas être lue """
+        try:
+            return GPIO.input(pin) == GPIO.LOW
+        except RuntimeError:
+            return pin in self.pressed_at
+
+    def stop(self):
+        """ Arrête le dispatcher et le thread des actions """
+        self.events.put(None)
+        self.actions.put(None)
+
+    def _has_gestures(self, pin):
+        return pin in self.long_press_actions or pin in self.multi_press_actions
+
+    def _dispatch(self):
+        while True:
+            try:
+                event = self.events.get(timeout=self._next_timeout())
+            except queue.Empty:
+                event = ()
+            if event is None:
+                return
+            now = time.monotonic()
+            if event:
+                self._handle_edge(*event)
+            self._expire_gestures(now)
+
+    def _next_timeout(self):
+        """ Délai jusqu'à la prochaine échéance (appui long atteint ou fin de la fenêtre d'appuis multiples) """
+        deadlines = list(self.press_deadline.values()) + list(self.lockout_until.values())
+        deadlines += [pressed + self.long_press_time for pin, pressed in self.pressed_at.items()
+                      if pin in self.long_press_actions and pin not in self.long_press_fired]
+        if not deadlines:
+            return None
+        return max(0.0, min(deadlines) - time.monotonic())
+
+    def _handle_edge(self, pin, pressed, at, debounce=True):
+        if at < self.lockout_until.get(pin, 0) or pressed == (pin in self.pressed_at):
+            return  # Rebond (le niveau sera relu à la fin du délai), ou front sans changement d'état
+        if debounce:
+            self.lockout_until[pin] = at + self.debounce_time / 1000.0
+        if pressed:
+            self._press(pin, at)
+        else:
+            self._release(pin, at)
+
+    def _press(self, pin, at):
+        self.pressed_at[pin] = at
+        if pin in self.immediate_pins:
+            self._call(self.button_actions.get(pin), run_inline=True)
+        elif not self._has_gestures(pin):
+            self._call(self.button_actions.get(pin))
+
+    def _release(self, pin, at):
+        pressed_at = self.pressed_at.pop(pin, None)
+        if pressed_at is None or pin in self.immediate_pins or not self._has_gestures(pin):
+            return
+        if pin in self.long_press_fired:
+            self.long_press_fired.discard(pin)
+            return
+        self.press_count[pin] = self.press_count.get(pin, 0) + 1
+        if self.press_count[pin] >= max(self.multi_press_actions.get(pin, {1: None}), default=1):
+            # Nombre d'appuis maximal atteint : inutile d'attendre la fin de la fenêtre
+            self._end_presses(pin)
+        else:
+            self.press_deadline[pin] = at + self.multi_press_window
+
+    def _expire_gestures(self, now):
+        for pin, until in list(self.lockout_until.items()):
+            if now >= until:
+                # Fin du délai anti-rebond : un changement d'état survenu pendant le délai, déjà stabilisé,
+                # est pris en compte sans nouveau délai
+                del self.lockout_until[pin]
+                self._handle_edge(pin, self.is_pressed(pin), now, debounce=False)
+        for pin, pressed_at in list(self.pressed_at.items()):
+            if (pin in self.long_press_actions and pin not in self.long_press_fired
+                    and now - pressed_at >= self.long_press_time):
+                if not self.is_pressed(pin):
+                    # Relâchement manqué : c'était un appui court
+                    self.lockout_until.pop(pin, None)
+                    self._release(pin, now)
+                    continue
+                self.long_press_fired.add(pin)
+                self.press_count.pop(pin, None)
+                self.press_deadline.pop(pin, None)
+                self._call(self.long_press_actions[pin])
+        for pin, deadline in list(self.press_deadline.items()):
+            if now >= deadline and pin not in self.pressed_at:
+                self._end_presses(pin)
+
+    def _end_presses(self, pin):
+        count = self.press_count.pop(pin, 0)
+        self.press_deadline.pop(pin, None)
+        action = self.multi_press_actions.get(pin, {}).get(count)
+        if action is None:
+            action = self.button_actions.get(pin)
+        self._call(action)
+
+    def _call(self, action, run_inline=False):
+        if action is None:
+            return
+        if run_inline:
+            self._run(action)
+        else:
+            self.actions.put(action)
+
+    def _run_actions(self):
+        while True:
+            action = self.actions.get()
+            if action is None:
+                return
+            self._run(action)
+
+    @staticmethod
+    def _run(action):
+        try:
             action()
+        except Exception as e:
+            logging.error("Button action failed: %s", e)
 
 
 
 """
-Dans la classe ButtonController, nous configurons les pins des boutons 
-avec des résistances de tirage et attachons une détection d'événement 
-pour appeler une fonction button_callback lorsque un bouton est pressé. 
-La fonction button_callback recherche ensuite la fonction correspondante à appeler 
-à partir d'un dictionnaire qui mappe les pins aux fonctions.
-"""
\ No newline at end of file
+Dans la classe ButtonController, nous configurons les pins des boutons
+avec des résistances de tirage et attachons une détection d'événement
+sur les deux fronts. La fonction button_callback, appelée par le thread de RPi.GPIO,
+ne fait que déposer le front dans une file : un thread dispatcher en déduit les gestes
+(appui simple, appui long, appuis multiples) et confie les actions correspondantes,
+recherchées dans des dictionnaires qui mappent les pins aux fonctions, à un thread d'exécution.
+Les boutons "immédiats" (arrêt) sont traités par le dispatcher dès l'appui.
+"""
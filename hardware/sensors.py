@@ -2,16 +2,16 @@ import RPi.GPIO as GPIO
 import time
 import logging
 import os
-import Adafruit_DHT
-from notifications.email_notifications import send_email
+from monitoring.metrics import sensor_read_seconds, sensor_read_errors
 
 class DistanceSensor:
-    def __init__(self, trigger_pin, echo_pin, max_distance, email_config):
+    def __init__(self, trigger_pin, echo_pin, max_distance, alert_service, sensor_height=95):
         self.trigger_pin = trigger_pin
         self.echo_pin = echo_pin
         self.max_distance = max_distance
         self.time_out = max_distance * 60  # Calcul du temps maximum d'attente pour time_out
-        self.email_config = email_config
+        self.alert_service = alert_service
+        self.sensor_height = sensor_height  # distance entre le capteur et le fond de la cuve (cm)
         self.setup_distance_sensor()
 
     def setup_distance_sensor(self):
@@ -37,6 +37,7 @@ class DistanceSensor:
         pulse_time = (time.time() - start_time) * 1000000
         return pulse_time
 
+    @sensor_read_seconds.time(sensor="distance")
     def get_distance(self):
         """Obtient les résultats de mesure du module ultrasonique, avec l'unité : cm"""
         distances = []
@@ -47,29 +48,32 @@ class DistanceSensor:
 
             ping_time = self.pulse_in(GPIO.HIGH, self.time_out)
 
-            if ping_time == 0 or ping_time * 340.0 / 2.0 / 10000.0 > 98:
+            if ping_time == 0 or ping_time * 340.0 / 2.0 / 10000.0 > self.sensor_height + 3:
                 logging.warning("Failed to read distance from sensor or distance above threshold.")
+                sensor_read_errors.inc(sensor="distance")
                 distances.append(float('inf'))
             else:
                 distance = ping_time * 340.0 / 2.0 / 10000.0
                 distances.append(distance)
 
         if all(dist == float('inf') for dist in distances):
-            logging.warning("All distance readings are invalid, using default value and sending email.")
-            send_email(self.email_config, "Erreur du Capteur de Distance",
-                       "Toutes les lectures de distance sont invalides, valeur par défaut utilisée.")
+            logging.warning("All distance readings are invalid, using default value and sending alert.")
+            self.alert_service.send("distance_sensor_invalid", "Erreur du Capteur de Distance",
+                                    "Toutes les lectures de distance sont invalides, valeur par défaut utilisée.")
             return 10
 
         valid_distances = [dist for dist in distances if dist != float('inf')]
         if valid_distances:
             average_distance = sum(valid_distances) / len(valid_distances)
-            level = 95 - average_distance
+            level = self.sensor_height - average_distance
         else:
             logging.error("Sensor appears to be disconnected or malfunctioning.")
-            send_email(self.email_config, "Problème de Capteur",
-                       "Le capteur semble être déconnecté ou défectueux.")
+            self.alert_service.send("distance_sensor_disconnected", "Problème de Capteur",
+                                    "Le capteur semble être déconnecté ou défectueux.")
             return 10
 
+        self.alert_service.resolve("distance_sensor_invalid")
+        self.alert_service.resolve("distance_sensor_disconnected")
         logging.debug("Distance from sensor: %.2f cm", average_distance)
         return level
 
@@ -83,8 +87,10 @@ def get_cpu_temperature():
         logging.error(f"Erreur lors de la lecture de la température du processeur: {e}")
         return None
 
+@sensor_read_seconds.time(sensor="dht11")
 def get_technical_cabinet_condition_data(dht_pin):
     """Obtient la température et l'humidité de l'armoire technique à partir du capteur DHT11."""
+    import Adafruit_DHT  # Import différé : seule la tâche horaire lit ce capteur
     DHT_SENSOR = Adafruit_DHT.DHT11
 
     humidity, temperature = Adafruit_DHT.read(DHT_SENSOR, dht_pin)
@@ -92,4 +98,5 @@ def get_technical_cabinet_condition_data(dht_pin):
         return temperature, humidity
     else:
         logging.error("Failed to retrieve data from humidity sensor")
+        sensor_read_errors.inc(sensor="dht11")
         return None, None
@@ -1,54 +1,61 @@
-from sqlalchemy import Column, Integer, String, DateTime, Float, TIMESTAMP, text
-from data_management.database import Base  # Importer Base depuis database.py
+from sqlalchemy import Column, Integer, String, DateTime, Float, TIMESTAMP, UniqueConstraint, ForeignKey
+from data_management.database import Base, local_now  # Importer Base depuis database.py
 
 class Log(Base):
     __tablename__ = 'logs'
     id = Column(Integer, primary_key=True, index=True)
-    timestamp = Column(DateTime, nullable=False, server_default=text('CURRENT_TIMESTAMP'))
+    timestamp = Column(DateTime, nullable=False, server_default=local_now())
     data = Column(String(255), nullable=False)  # Définir une longueur pour VARCHAR
 
 class CpuTemperature(Base):
     __tablename__ = 'cpu_temperature'
+    # Clé naturelle : horodatage arrondi par data_logger (une mesure par intervalle)
+    __table_args__ = (UniqueConstraint('time', name='uq_cpu_temperature_time'),)
     id = Column(Integer, primary_key=True, index=True)
-    time = Column(TIMESTAMP, server_default=text('CURRENT_TIMESTAMP'))
+    time = Column(TIMESTAMP, server_default=local_now())
     temperature = Column(Float, nullable=False)
 
 class TechnicalCabinetConditions(Base):
     __tablename__ = 'technical_cabinet_conditions'
+    __table_args__ = (UniqueConstraint('time', name='uq_technical_cabinet_conditions_time'),)
     id = Column(Integer, primary_key=True, index=True)
-    time = Column(TIMESTAMP, server_default=text('CURRENT_TIMESTAMP'))
+    time = Column(TIMESTAMP, server_default=local_now())
     temperature = Column(Float, nullable=False)
     humidity = Column(Float, nullable=False)
 
 class WaterLevel(Base):
     __tablename__ = 'water_level'
+    __table_args__ = (UniqueConstraint('time', name='uq_water_level_time'),)
     id = Column(Integer, primary_key=True, index=True)
-    time = Column(TIMESTAMP, server_default=text('CURRENT_TIMESTAMP'))
+    time = Column(TIMESTAMP, server_default=local_now())
     level = Column(Float, nullable=False)
 
 class RainForecast(Base):
     __tablename__ = 'rain_forecast'
+    __table_args__ = (UniqueConstraint('time', name='uq_rain_forecast_time'),)
     id = Column(Integer, primary_key=True, index=True)
-    time = Column(TIMESTAMP, server_default=text('CURRENT_TIMESTAMP'))
+    time = Column(TIMESTAMP, server_default=local_now())
     amount = Column(Float, nullable=False)
 
 class Precipitation(Base):
     __tablename__ = 'precipitation'
+    __table_args__ = (UniqueConstraint('time', name='uq_precipitation_time'),)
     id = Column(Integer, primary_key=True, index=True)
-    time = Column(TIMESTAMP, server_default=text('CURRENT_TIMESTAMP'))
+    time = Column(TIMESTAMP, server_default=local_now())
     amount = Column(Float, nullable=False)
 
 class Hygrometry(Base):
     __tablename__ = 'hygrometry'
+    __table_args__ = (UniqueConstraint('zone', 'time', name='uq_hygrometry_zone_time'),)
     id = Column(Integer, primary_key=True, index=True)
-    time = Column(TIMESTAMP, server_default=text('CURRENT_TIMESTAMP'))
+    time = Column(TIMESTAMP, server_default=local_now())
     level = Column(Float, nullable=False)
     zone = Column(String(100), nullable=False)  # Définir une longueur pour VARCHAR
 
 class SystemState(Base):
     __tablename__ = 'system_state'
     id = Column(Integer, primary_key=True, index=True)
-    time = Column(TIMESTAMP, server_default=text('CURRENT_TIMESTAMP'))
+    time = Column(TIMESTAMP, server_default=local_now())
     state = Column(String(50), nullable=False)  # Définir une longueur pour VARCHAR
     zone = Column(String(100), nullable=False)  # Définir une longueur pour VARCHAR
     source = Column(String(50), nullable=False)  # Définir une longueur pour VARCHAR
@@ -57,39 +64,73 @@ class SystemState(Base):
 class WateringSession(Base):
     __tablename__ = 'watering_sessions'
     id = Column(Integer, primary_key=True, index=True)
-    time = Column(TIMESTAMP, server_default=text('CURRENT_TIMESTAMP'))
+    time = Column(TIMESTAMP, server_default=local_now())
     zone = Column(String(100), nullable=False)  # Définir une longueur pour VARCHAR
     duration = Column(Integer, nullable=False)
     source = Column(String(50), nullable=False)  # Définir une longueur pour VARCHAR
     soil_moisture_before = Column(Float)
     mode = Column(String(50), nullable=False, default='Automatic')  # Définir une longueur pour VARCHAR
 
+class WateringTrajectory(Base):
+    __tablename__ = 'watering_trajectories'
+    id = Column(Integer, primary_key=True, index=True)
+    session_id = Column(Integer, ForeignKey('watering_sessions.id', ondelete='CASCADE'), nullable=False, index=True)
+    time = Column(TIMESTAMP, server_default=local_now())
+    elapsed = Column(Integer, nullable=False)  # secondes depuis l'ouverture de la vanne
+    moisture = Column(Float, nullable=False)
+
+class WateringDecision(Base):
+    __tablename__ = 'watering_decisions'
+    id = Column(Integer, primary_key=True, index=True)
+    time = Column(TIMESTAMP, server_default=local_now())
+    zone = Column(String(100), nullable=False)
+    action = Column(String(20), nullable=False)  # water, skip, defer ou reduce
+    factor = Column(Float, nullable=False, default=1.0)
+    soil_moisture = Column(Float)
+    rain_measured = Column(Float)
+    rain_expected = Column(Float)
+    chance_of_rain = Column(Float)
+    reason = Column(String(255), nullable=False)
+
 class HourlyRain(Base):
     __tablename__ = 'hourly_rain'
+    __table_args__ = (UniqueConstraint('time', name='uq_hourly_rain_time'),)
     id = Column(Integer, primary_key=True, index=True)
-    time = Column(TIMESTAMP, server_default=text('CURRENT_TIMESTAMP'))
+    time = Column(TIMESTAMP, server_default=local_now())
     amount = Column(Float, nullable=False)
 
 class HourlyTemperature(Base):
     __tablename__ = 'hourly_temperature'
+    __table_args__ = (UniqueConstraint('time', name='uq_hourly_temperature_time'),)
     id = Column(Integer, primary_key=True, index=True)
-    time = Column(TIMESTAMP, server_default=text('CURRENT_TIMESTAMP'))
+    time = Column(TIMESTAMP, server_default=local_now())
     temperature = Column(Float, nullable=False)
 
 class HourlyWind(Base):
     __tablename__ = 'hourly_wind'
+    __table_args__ = (UniqueConstraint('time', name='uq_hourly_wind_time'),)
     id = Column(Integer, primary_key=True, index=True)
-    time = Column(TIMESTAMP, server_default=text('CURRENT_TIMESTAMP'))
+    time = Column(TIMESTAMP, server_default=local_now())
     wind_speed = Column(Float, nullable=False)
 
 class HourlySunlight(Base):
     __tablename__ = 'hourly_sunlight'
+    __table_args__ = (UniqueConstraint('time', name='uq_hourly_sunlight_time'),)
     id = Column(Integer, primary_key=True, index=True)
-    time = Column(TIMESTAMP, server_default=text('CURRENT_TIMESTAMP'))
+    time = Column(TIMESTAMP, server_default=local_now())
     solar_radiation = Column(Float, nullable=False)
 
 class HourlyHumidity(Base):
     __tablename__ = 'hourly_humidity'
+    __table_args__ = (UniqueConstraint('time', name='uq_hourly_humidity_time'),)
+    id = Column(Integer, primary_key=True, index=True)
+    time = Column(TIMESTAMP, server_default=local_now())
+    humidity = Column(Float, nullable=False)
+
+class DailyAggregate(Base):
+    __tablename__ = 'daily_aggregates'
+    __table_args__ = (UniqueConstraint('series', 'time', name='uq_daily_aggregates_series_time'),)
     id = Column(Integer, primary_key=True, index=True)
-    time = Column(TIMESTAMP, server_default=text('CURRENT_TIMESTAMP'))
-    humidity = Column(Float, nullable=False)
\ No newline at end of file
+    series = Column(String(50), nullable=False)  # Nom de la série (voir data_management/aggregates.py)
+    time = Column(DateTime, nullable=False)  # Début de la journée
+    value = Column(Float, nullable=False)
@@ -0,0 +1,2 @@
+# monitoring/__init__.py
+from .metrics import registry, CONTENT_TYPE_LATEST
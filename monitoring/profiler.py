@@ -0,0 +1,141 @@
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+PROFILE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "profiles")
+
+# Un seul profil d'échantillonnage à la fois : le coût n'est payé que pendant la capture
+_profile_lock = threading.Lock()
+
+
+class ProfilerBusyError(RuntimeError):
+    """ Levée lorsqu'un profil d'échantillonnage est déjà en cours """
+
+
+class SamplingProfiler:
+    """ Profileur par échantillonnage des piles de tous les threads du processus """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = Counter()
+        self.sample_count = 0
+
+    def _frame_label(self, frame):
+        code = frame.f_code
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+    def _sample(self, own_thread_id, thread_names):
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_thread_id:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self._frame_label(frame))
+                frame = frame.f_back
+            stack.append(thread_names.get(thread_id, f"thread-{thread_id}"))
+            self.samples[tuple(reversed(stack))] += 1
+        self.sample_count += 1
+
+    def run(self, duration):
+        """ Échantillonne les piles pendant `duration` secondes (bloquant) """
+        if not _profile_lock.acquire(blocking=False):
+            raise ProfilerBusyError("A profile is already running")
+        try:
+            own_thread_id = threading.get_ident()
+            deadline = time.monotonic() + duration
+            while time.monotonic() < deadline:
+                thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+                self._sample(own_thread_id, thread_names)
+                time.sleep(self.interval)
+        finally:
+            _profile_lock.release()
+        return self
+
+    def collapsed(self):
+        """ Format « collapsed stacks » (flamegraph.pl, speedscope, inferno) """
+        return "\n".join(f"{';'.join(stack)} {count}" for stack, count in self.samples.most_common()) + "\n"
+
+    def speedscope(self, name="pigarden"):
+        """ Format JSON « sampled » de speedscope """
+        frames = []
+        frame_index = {}
+        samples = []
+        weights = []
+        for stack, count in self.samples.items():
+            indexes = []
+            for label in stack:
+                if label not in frame_index:
+                    frame_index[label] = len(frames)
+                    frames.append({"name": label})
+                indexes.append(frame_index[label])
+            samples.append(indexes)
+            weights.append(count * self.interval)
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": name,
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": sum(weights),
+                "samples": samples,
+                "weights": weights,
+            }],
+            "exporter": "pigarden",
+        }
+
+    def render(self, output_format):
+        if output_format == "speedscope":
+            return json.dumps(self.speedscope()), "application/json"
+        return self.collapsed(), "text/plain"
+
+
+def profile_to_file(duration, output_format="collapsed", prefix="daemon", interval=0.005):
+    """ Capture un profil d'échantillonnage et l'écrit dans PROFILE_DIR ; renvoie le chemin du fichier """
+    profiler = SamplingProfiler(interval).run(duration)
+    content, _ = profiler.render(output_format)
+    extension = "speedscope.json" if output_format == "speedscope" else "collapsed"
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f"profile-{prefix}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{extension}")
+    with open(path, "w", encoding="utf-8") as profile_file:
+        profile_file.write(content)
+    return path
+
+
+def start_background_profile(duration, output_format="collapsed", prefix="daemon", logger=None):
+    """ Lance profile_to_file dans un thread pour ne pas bloquer l'appelant (ex. gestionnaire de signal) """
+    def worker():
+        try:
+            path = profile_to_file(duration, output_format, prefix)
+            if logger:
+                logger.info(f"Sampling profile written to {path}")
+        except ProfilerBusyError:
+            if logger:
+                logger.warning("A sampling profile is already running, request ignored.")
+    threading.Thread(target=worker, name="sampling-profiler", daemon=True).start()
+
+
+class RequestProfile:
+    """ Capture cProfile d'une seule requête, écrite dans PROFILE_DIR au format pstats """
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint or "unknown"
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        """ Arrête la capture et renvoie le chemin du fichier .prof """
+        self.profile.disable()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f"request-{self.endpoint}-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}.prof")
+        self.profile.dump_stats(path)
+        return path
+
@@ -0,0 +1,210 @@
+import abc
+import logging
+import threading
+import time
+from collections import deque
+
+# Règles appliquées lorsque config.json ne contient pas de section 'alert_rules'
+DEFAULT_RULES = [
+    {
+        "name": "cpu_temperature_high",
+        "type": "threshold",
+        "metric": "cpu_temperature",
+        "above": 70,
+        "subject": "Alerte: Température CPU élevée",
+        "message": "La température du CPU a dépassé 70°C. Température actuelle: {value}°C",
+    },
+]
+
+
+class Rule(abc.ABC):
+    """ Règle évaluée de façon incrémentale à chaque nouvelle mesure d'une métrique """
+
+    def __init__(self, name, metric, subject=None, message=None):
+        self.name = name
+        self.metric = metric
+        self.subject = subject or f"Alerte PiGarden : {name}"
+        self.message = message or f"La règle {name} est déclenchée pour {metric} (valeur: {{value}})."
+        self.firing = False
+
+    @abc.abstractmethod
+    def update(self, value, timestamp):
+        """ Renvoie True si la règle doit être déclenchée, False si elle doit être levée, None sinon """
+
+    def describe(self, value):
+        return self.message.format(value=value, metric=self.metric, name=self.name)
+
+
+class ThresholdRule(Rule):
+    """ Déclenchée lorsque la valeur passe au-dessus de `above` ou en dessous de `below` """
+
+    def __init__(self, name, metric, above=None, below=None, **kwargs):
+        super().__init__(name, metric, **kwargs)
+        self.above = above
+        self.below = below
+
+    def update(self, value, timestamp):
+        return (self.above is not None and value > self.above) or (self.below is not None and value < self.below)
+
+
+class HysteresisRule(Rule):
+    """
+    Déclenchée au-delà du seuil `trigger`, levée seulement une fois revenue au-delà de `clear`
+    (ex. humidité de l'armoire : trigger=80, clear=70) ; évite les alertes en rafale autour d'un seuil.
+    """
+
+    def __init__(self, name, metric, trigger, clear, **kwargs):
+        super().__init__(name, metric, **kwargs)
+        self.trigger = trigger
+        self.clear = clear
+        self.rising = trigger >= clear
+
+    def update(self, value, timestamp):
+        if self.rising:
+            if value >= self.trigger:
+                return True
+            if value <= self.clear:
+                return False
+        else:
+            if value <= self.trigger:
+                return True
+            if value >= self.clear:
+                return False
+        return None
+
+
+class RateRule(Rule):
+    """
+    Déclenchée lorsque la variation par heure sur la fenêtre `window` (secondes) dépasse
+    `max_rise` ou `max_drop` (ex. baisse rapide du niveau de la citerne, vanne restée ouverte).
+    Seuls le nombre borné d'échantillons de la fenêtre sont conservés (`max_samples`).
+    """
+
+    def __init__(self, name, metric, window=3600, max_rise=None, max_drop=None, max_samples=120, **kwargs):
+        super().__init__(name, metric, **kwargs)
+        self.window = window
+        self.max_rise = max_rise
+        self.max_drop = max_drop
+        self.samples = deque(maxlen=max_samples)
+
+    def update(self, value, timestamp):
+        self.samples.append((timestamp, value))
+        while len(self.samples) > 1 and timestamp - self.samples[0][0] > self.window:
+            self.samples.popleft()
+        oldest_time, oldest_value = self.samples[0]
+        elapsed = timestamp - oldest_time
+        if elapsed <= 0:
+            return None
+        rate = (value - oldest_value) * 3600 / elapsed
+        return (self.max_rise is not None and rate > self.max_rise) or \
+               (self.max_drop is not None and -rate > self.max_drop)
+
+
+class AbsenceRule(Rule):
+    """ Déclenchée lorsqu'aucune mesure n'a été reçue depuis `max_age` secondes (données figées) """
+
+    def __init__(self, name, metric, max_age=7200, **kwargs):
+        super().__init__(name, metric, **kwargs)
+        self.max_age = max_age
+        self.last_seen = time.time()
+
+    def update(self, value, timestamp):
+        self.last_seen = timestamp
+        return False
+
+    def check(self, now):
+        return now - self.last_seen > self.max_age
+
+    def describe(self, value):
+        if value is None:
+            return self.message.format(value=f"aucune mesure depuis {int(self.max_age / 60)} min",
+                                       metric=self.metric, name=self.name)
+        return super().describe(value)
+
+
+RULE_TYPES = {
+    "threshold": ThresholdRule,
+    "hysteresis": HysteresisRule,
+    "rate": RateRule,
+    "absence": AbsenceRule,
+}
+
+
+def rule_from_config(rule_config):
+    """ Construit une règle à partir de sa description dans config.json """
+    options = dict(rule_config)
+    rule_type = options.pop("type")
+    if rule_type not in RULE_TYPES:
+        raise ValueError(f"Unknown alert rule type: {rule_type}")
+    return RULE_TYPES[rule_type](**options)
+
+
+def rules_from_config(config, logger=None):
+    """ Construit les règles de la section 'alert_rules' en ignorant (et journalisant) les règles invalides """
+    rules = []
+    for rule_config in config.get("alert_rules", DEFAULT_RULES):
+        try:
+            rules.append(rule_from_config(rule_config))
+        except (KeyError, TypeError, ValueError) as e:
+            (logger or logging).error(f"Invalid alert rule {rule_config}: {e}")
+    return rules
+
+
+class RuleEngine:
+    """ Évalue les règles d'alerte à chaque mesure enregistrée, sans interroger la base de données """
+
+    def __init__(self, rules, alert_service, logger=None):
+        self.alert_service = alert_service
+        self.logger = logger or logging.getLogger(__name__)
+        self.lock = threading.Lock()
+        self.rules_by_metric = {}
+        self.load(rules)
+
+    @classmethod
+    def from_config(cls, config, alert_service, logger=None):
+        return cls(rules_from_config(config, logger), alert_service, logger)
+
+    def reload(self, config):
+        """ Remplace les règles par celles de la nouvelle configuration (l'état des règles est réinitialisé) """
+        self.load(rules_from_config(config, self.logger))
+
+    def load(self, rules):
+        rules_by_metric = {}
+        for rule in rules:
+            rules_by_metric.setdefault(rule.metric, []).append(rule)
+        with self.lock:
+            self.rules_by_metric = rules_by_metric
+
+    def _transition(self, rule, should_fire, value):
+        if should_fire is None or should_fire == rule.firing:
+            return
+        rule.firing = should_fire
+        key = f"rule:{rule.name}"
+        if should_fire:
+            self.logger.warning(f"Alert rule {rule.name} triggered for {rule.metric} (value: {value}).")
+            self.alert_service.send(key, rule.subject, rule.describe(value))
+        else:
+            self.logger.info(f"Alert rule {rule.name} cleared for {rule.metric} (value: {value}).")
+            self.alert_service.resolve(key)
+
+    def observe(self, metric, value, timestamp=None):
+        """ Reçoit une nouvelle mesure et met à jour les règles de cette métrique """
+        if value is None:
+            return
+        timestamp = time.time() if timestamp is None else timestamp
+        with self.lock:
+            for rule in self.rules_by_metric.get(metric, ()):
+                self._transition(rule, rule.update(value, timestamp), value)
+
+    def check_absence(self):
+        """ Vérifie périodiquement les règles d'absence de données """
+        now = time.time()
+        with self.lock:
+            for rules in self.rules_by_metric.values():
+                for rule in rules:
+                    if isinstance(rule, AbsenceRule) and not rule.firing and rule.check(now):
+                        self._transition(rule, True, None)
+
+    def active_rules(self):
+        with self.lock:
+            return [rule.name for rules in self.rules_by_metric.values() for rule in rules if rule.firing]
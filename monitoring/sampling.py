@@ -0,0 +1,167 @@
+"""
+Échantillonnage adaptatif de la télémétrie.
+
+Les mesures sont regroupées : "cistern" (niveau, capteur local), "soil" (humidité de toutes les zones, une requête
+Ecowitt) et "weather" (pluie, température, vent, ensoleillement et humidité sur la période écoulée, une requête
+Ecowitt). Chaque groupe a un intervalle par mode d'activité ; quand plusieurs modes sont actifs (arrosage, forte
+pluie, alerte), le plus court l'emporte, et l'intervalle "idle" ou "night" s'applique sinon.
+Les requêtes Ecowitt, y compris celles de l'arrosage, sont décomptées dans un budget horaire : un échantillon
+qui le dépasserait est reporté au tick suivant.
+Réglages dans la section `sampling` de config.json.
+"""
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from monitoring.metrics import registry
+
+DEFAULT_SETTINGS = {
+    "enabled": True,
+    "tick": 15,  # secondes entre deux évaluations de la politique
+    "ecowitt_calls_per_hour": 120,
+    "heavy_rain": 4.0,  # mm/h mesurés ou prévus à partir desquels le mode "rain" s'applique
+    "night": ["22:00", "06:00"],
+    "intervals": {
+        "idle": {"cistern": 3600, "soil": 3600, "weather": 3600},
+        "night": {"cistern": 7200, "soil": 7200, "weather": 7200},
+        "watering": {"cistern": 60, "soil": 300},
+        "rain": {"cistern": 600, "soil": 900, "weather": 600},
+        "alert": {"cistern": 300, "soil": 900, "weather": 900},
+    },
+}
+
+# Requêtes Ecowitt consommées par un échantillon de chaque groupe
+COSTS = {"cistern": 0, "soil": 1, "weather": 1}
+
+sampling_interval_seconds = registry.gauge(
+    "pigarden_sampling_interval_seconds", "Intervalle d'échantillonnage courant", ("group",))
+ecowitt_calls_last_hour = registry.gauge(
+    "pigarden_ecowitt_calls_last_hour", "Requêtes Ecowitt sur la dernière heure glissante")
+
+
+def sampling_settings(config):
+    """ Réglages de l'échantillonnage ; les intervalles sont complétés mode par mode """
+    settings = dict(DEFAULT_SETTINGS)
+    overrides = dict(config.get("sampling", {}))
+    intervals = {mode: dict(groups) for mode, groups in DEFAULT_SETTINGS["intervals"].items()}
+    for mode, groups in overrides.pop("intervals", {}).items():
+        intervals.setdefault(mode, {}).update(groups)
+    settings.update(overrides)
+    settings["intervals"] = intervals
+    return settings
+
+
+class RateBudget:
+    """ Nombre d'appels autorisés sur une fenêtre glissante (par défaut une heure) """
+
+    def __init__(self, calls, period=3600, clock=time.monotonic):
+        self.calls = calls
+        self.period = period
+        self.clock = clock
+        self.spent = deque()
+        self.lock = threading.Lock()
+
+    def _expire(self, now):
+        while self.spent and now - self.spent[0] >= self.period:
+            self.spent.popleft()
+
+    def spend(self, count=1):
+        """ Décompte des appels effectués (jamais refusés : un arrosage doit pouvoir lire ses capteurs) """
+        with self.lock:
+            now = self.clock()
+            self._expire(now)
+            self.spent.extend([now] * count)
+            ecowitt_calls_last_hour.set(len(self.spent))
+
+    def used(self):
+        with self.lock:
+            self._expire(self.clock())
+            return len(self.spent)
+
+    def available(self):
+        return max(0, self.calls - self.used())
+
+
+class SamplingPolicy:
+    """ Intervalle de chaque groupe de mesures selon l'activité du système """
+
+    def __init__(self, settings):
+        self.settings = settings
+
+    def is_night(self, now):
+        start, end = self.settings["night"]
+        clock = now.strftime("%H:%M")
+        return start <= clock < end if start <= end else clock >= start or clock < end
+
+    def modes(self, activity, now):
+        """ Modes actifs : "watering", "rain", "alert", puis "night" ou "idle" """
+        modes = [mode for mode in ("watering", "rain", "alert") if activity.get(mode)]
+        modes.append("night" if self.is_night(now) else "idle")
+        return modes
+
+    def interval(self, group, modes):
+        intervals = self.settings["intervals"]
+        return min(intervals[mode][group] for mode in modes if group in intervals.get(mode, {}))
+
+
+class AdaptiveSampler:
+    """
+    Évalue la politique à chaque tick et lance les groupes dont l'intervalle est écoulé ;
+    `samplers[group](elapsed)` mesure et enregistre le groupe, `activity()` décrit l'état du système
+    """
+
+    def __init__(self, policy, budget, samplers, activity, logger=None, clock=time.monotonic):
+        self.policy = policy
+        self.budget = budget
+        self.samplers = samplers
+        self.activity = activity
+        self.logger = logger
+        self.clock = clock
+        self.last_sample = {}
+        self.deferred = set()
+        self.current_modes = []
+
+    def due(self, group, interval, now):
+        last = self.last_sample.get(group)
+        return last is None or now - last >= interval
+
+    def tick(self, now=None):
+        """ Lance les échantillons dus ; renvoie les groupes mesurés """
+        now = self.clock() if now is None else now
+        modes = self.policy.modes(self.activity(), datetime.now())
+        if modes != self.current_modes and self.logger is not None:
+            self.logger.info(f"Sampling modes: {', '.join(modes)}.")
+        self.current_modes = modes
+        sampled = []
+        for group, sampler in self.samplers.items():
+            interval = self.policy.interval(group, modes)
+            sampling_interval_seconds.set(interval, group=group)
+            if not self.due(group, interval, now):
+                continue
+            if COSTS.get(group, 0) > self.budget.available():
+                if group not in self.deferred and self.logger is not None:
+                    self.logger.warning(f"Ecowitt budget exhausted, {group} sampling deferred.")
+                self.deferred.add(group)
+                continue
+            self.deferred.discard(group)
+            # Premier échantillon : la période couverte est l'intervalle courant
+            elapsed = now - self.last_sample[group] if group in self.last_sample else interval
+            self.last_sample[group] = now
+            try:
+                sampler(elapsed)
+            except Exception as e:
+                if self.logger is not None:
+                    self.logger.error(f"Error while sampling {group}: {e}")
+            sampled.append(group)
+        return sampled
+
+    def snapshot(self):
+        """ Modes et intervalles courants, budget Ecowitt consommé """
+        return {
+            "modes": self.current_modes,
+            "intervals": {group: self.policy.interval(group, self.current_modes or ["idle"])
+                          for group in self.samplers},
+            "ecowitt_calls_last_hour": self.budget.used(),
+            "ecowitt_budget": self.budget.calls,
+        }
@@ -0,0 +1,272 @@
+import json
+import logging
+import queue
+import smtplib
+import threading
+import time
+from datetime import datetime
+from email.message import EmailMessage
+
+from monitoring.metrics import registry
+
+alerts_total = registry.counter(
+    "pigarden_alerts_total", "Alertes soumises au service d'alerte", ("key", "outcome"))
+alert_sink_errors = registry.counter(
+    "pigarden_alert_sink_errors_total", "Échecs d'envoi des alertes par destination", ("sink",))
+
+
+class Alert:
+    """ Alerte en attente d'envoi """
+
+    def __init__(self, key, subject, body):
+        self.key = key
+        self.subject = subject
+        self.body = body
+        self.time = datetime.now()
+        self.suppressed = 0
+
+
+class EmailSink:
+    """ Envoie les alertes par e-mail en réutilisant une seule connexion SMTP """
+    name = "email"
+
+    def __init__(self, email_config, idle_timeout=300):
+        self.email_config = email_config
+        self.idle_timeout = idle_timeout
+        self.server = None
+        self.last_used = 0
+
+    def _connect(self):
+        server = smtplib.SMTP(self.email_config["smtp_server"], self.email_config["smtp_port"], timeout=30)
+        server.starttls()
+        server.login(self.email_config["email_address"], self.email_config["email_password"])
+        return server
+
+    def _get_server(self):
+        if self.server is not None and time.monotonic() - self.last_used > self.idle_timeout:
+            self.close()
+        if self.server is None:
+            self.server = self._connect()
+        return self.server
+
+    def send(self, subject, body):
+        msg = EmailMessage()
+        msg.set_content(body)
+        msg["Subject"] = subject
+        msg["From"] = self.email_config["email_address"]
+        msg["To"] = self.email_config["recipient_address"]
+        try:
+            self._get_server().send_message(msg)
+        except (smtplib.SMTPServerDisconnected, OSError):
+            # La connexion persistante a pu être fermée par le serveur : une seule nouvelle tentative
+            self.close()
+            self._get_server().send_message(msg)
+        self.last_used = time.monotonic()
+
+    def close(self):
+        if self.server is not None:
+            try:
+                self.server.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self.server = None
+
+
+class WebhookSink:
+    """ Poste les alertes en JSON sur une URL (ntfy, Home Assistant, Slack...) """
+    name = "webhook"
+
+    def __init__(self, url, timeout=10):
+        self.url = url
+        self.timeout = timeout
+
+    def send(self, subject, body):
+        import requests
+        response = requests.post(self.url, json={"subject": subject, "body": body}, timeout=self.timeout)
+        response.raise_for_status()
+
+    def close(self):
+        pass
+
+
+class FileSink:
+    """ Ajoute les alertes dans un fichier local (une ligne JSON par alerte) """
+    name = "file"
+
+    def __init__(self, path):
+        self.path = path
+
+    def send(self, subject, body):
+        with open(self.path, "a", encoding="utf-8") as alert_file:
+            alert_file.write(json.dumps({"time": datetime.now().isoformat(), "subject": subject, "body": body},
+                                        ensure_ascii=False) + "\n")
+
+    def close(self):
+        pass
+
+
+class AlertService:
+    """
+    Service d'alerte asynchrone : l'appelant ne fait que déposer l'alerte dans une file.
+    Un thread d'envoi applique la déduplication par clé, la limitation de débit,
+    regroupe les alertes proches dans un seul message et les transmet à chaque destination.
+    """
+
+    def __init__(self, sinks, dedup_window=3600, rate_limit_count=5, rate_limit_period=3600,
+                 digest_interval=30, queue_size=100):
+        self.sinks = sinks
+        self.dedup_window = dedup_window
+        self.rate_limit_count = rate_limit_count
+        self.rate_limit_period = rate_limit_period
+        self.digest_interval = digest_interval
+        self.outbox = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        self.last_sent = {}
+        self.sent_times = {}
+        self.suppressed = {}
+        self.stopping = threading.Event()
+        self.worker = threading.Thread(target=self._run, name="alert-outbox", daemon=True)
+        self.worker.start()
+
+    @classmethod
+    def from_config(cls, config, email_config):
+        """ Construit le service à partir de la section 'alerting' de config.json """
+        alerting_config = config.get("alerting", {})
+        sinks = []
+        for sink_config in alerting_config.get("sinks", [{"type": "email"}]):
+            sink_type = sink_config.get("type")
+            if sink_type == "email":
+                sinks.append(EmailSink(email_config, sink_config.get("idle_timeout", 300)))
+            elif sink_type == "webhook":
+                sinks.append(WebhookSink(sink_config["url"], sink_config.get("timeout", 10)))
+            elif sink_type == "file":
+                sinks.append(FileSink(sink_config["path"]))
+            else:
+                logging.error(f"Unknown alert sink type: {sink_type}")
+        return cls(
+            sinks,
+            dedup_window=alerting_config.get("dedup_window", 3600),
+            rate_limit_count=alerting_config.get("rate_limit_count", 5),
+            rate_limit_period=alerting_config.get("rate_limit_period", 3600),
+            digest_interval=alerting_config.get("digest_interval", 30),
+        )
+
+    def _accept(self, key, now, dedup_window):
+        """ Applique déduplication et limitation de débit pour une clé (appelé sous verrou) """
+        last = self.last_sent.get(key)
+        if last is not None and now - last < dedup_window:
+            return "deduplicated"
+        sent_times = [t for t in self.sent_times.get(key, []) if now - t < self.rate_limit_period]
+        if len(sent_times) >= self.rate_limit_count:
+            self.sent_times[key] = sent_times
+            return "rate_limited"
+        sent_times.append(now)
+        self.sent_times[key] = sent_times
+        self.last_sent[key] = now
+        return "queued"
+
+    def send(self, key, subject, body, dedup_window=None):
+        """
+        Dépose une alerte dans la file d'envoi ; renvoie True si elle sera envoyée.
+        `dedup_window` remplace pour cette clé la fenêtre de déduplication par défaut.
+        """
+        now = time.monotonic()
+        with self.lock:
+            outcome = self._accept(key, now, self.dedup_window if dedup_window is None else dedup_window)
+            if outcome != "queued":
+                self.suppressed[key] = self.suppressed.get(key, 0) + 1
+                alerts_total.inc(key=key, outcome=outcome)
+                return False
+            alert = Alert(key, subject, body)
+            alert.suppressed = self.suppressed.pop(key, 0)
+        try:
+            self.outbox.put_nowait(alert)
+        except queue.Full:
+            alerts_total.inc(key=key, outcome="dropped")
+            logging.error(f"Alert outbox full, alert {key} dropped: {subject}")
+            return False
+        alerts_total.inc(key=key, outcome=outcome)
+        return True
+
+    def resolve(self, key):
+        """ Indique que la condition d'alerte a disparu : la prochaine occurrence sera de nouveau envoyée """
+        with self.lock:
+            self.last_sent.pop(key, None)
+            self.suppressed.pop(key, None)
+
+    def reset(self):
+        """ Oublie l'historique de déduplication de toutes les clés """
+        with self.lock:
+            self.last_sent.clear()
+            self.sent_times.clear()
+            self.suppressed.clear()
+
+    def _collect_batch(self, first):
+        batch = [first]
+        deadline = time.monotonic() + self.digest_interval
+        while True:
+            # À l'arrêt, les alertes en attente partent tout de suite dans le dernier message
+            stopping = self.stopping.is_set()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 and not stopping:
+                break
+            try:
+                alert = self.outbox.get(block=not stopping, timeout=remaining)
+            except queue.Empty:
+                break
+            if alert is not None:
+                batch.append(alert)
+        return batch
+
+    def _format(self, batch):
+        def describe(alert):
+            text = f"[{alert.time.strftime('%Y-%m-%d %H:%M:%S')}] {alert.subject}\n{alert.body}"
+            if alert.suppressed:
+                text += f"\n({alert.suppressed} occurrence(s) similaire(s) non envoyée(s))"
+            return text
+
+        if len(batch) == 1:
+            alert = batch[0]
+            body = alert.body
+            if alert.suppressed:
+                body += f"\n\n({alert.suppressed} occurrence(s) similaire(s) non envoyée(s))"
+            return alert.subject, body
+        subject = f"PiGarden : {len(batch)} alertes"
+        return subject, "\n\n".join(describe(alert) for alert in batch)
+
+    def _deliver(self, subject, body):
+        for sink in self.sinks:
+            try:
+                sink.send(subject, body)
+            except Exception as e:
+                alert_sink_errors.inc(sink=sink.name)
+                logging.error(f"Failed to deliver alert through {sink.name}: {e}")
+
+    def _run(self):
+        while True:
+            if self.stopping.is_set():
+                try:
+                    first = self.outbox.get_nowait()
+                except queue.Empty:
+                    break
+            else:
+                first = self.outbox.get()
+            if first is None:
+                continue
+            subject, body = self._format(self._collect_batch(first))
+            self._deliver(subject, body)
+        for sink in self.sinks:
+            sink.close()
+
+    def stop(self, timeout=10):
+        """ Envoie les alertes en attente puis arrête le thread d'envoi, en `timeout` secondes au plus """
+        deadline = time.monotonic() + timeout
+        self.stopping.set()
+        try:
+            # Réveille le thread s'il attend une alerte ; file pleine : il la vide sans attendre
+            self.outbox.put(None, timeout=timeout)
+        except queue.Full:
+            pass
+        self.worker.join(max(0, deadline - time.monotonic()))
+        if self.worker.is_alive():
+            logging.warning(f"Alert outbox still busy after {timeout}s, pending alerts may be lost")
@@ -0,0 +1,29 @@
+"""
+Les tests tournent sans Raspberry Pi : RPi.GPIO et Adafruit_DHT sont remplacés par des modules factices
+avant l'import du démon, et la base est un fichier SQLite temporaire.
+"""
+import sys
+import types
+from unittest import mock
+
+import pytest
+
+if "RPi.GPIO" not in sys.modules:
+    gpio = mock.MagicMock(name="RPi.GPIO")
+    rpi = types.ModuleType("RPi")
+    rpi.GPIO = gpio
+    sys.modules["RPi"] = rpi
+    sys.modules["RPi.GPIO"] = gpio
+sys.modules.setdefault("Adafruit_DHT", mock.MagicMock(name="Adafruit_DHT"))
+
+
+@pytest.fixture
+def sqlite_engine(tmp_path, monkeypatch):
+    """ Base SQLite vide ; le cache des clés naturelles d'upsert() est propre à chaque test """
+    from data_management import database
+    import models  # noqa: F401  (enregistre les tables dans Base.metadata)
+
+    monkeypatch.setattr(database, "_natural_keys", set())
+    engine = database.create_sqlite_engine(str(tmp_path / "garden.db"))
+    yield engine
+    engine.dispose()
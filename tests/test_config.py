@@ -0,0 +1,96 @@
+import copy
+import json
+import re
+
+import pytest
+
+from config import ConfigError, ConfigService
+from config.config_loader import freeze, validate_config
+
+VALID_CONFIG = {
+    "button_pins": [5, 6, 13, 19],
+    "button_debounce_time": 300,
+    "relay_pins": [17, 27, 22, 23, 24],
+    "pump_relay_pin": 17,
+    "city_water_relay_pin": 27,
+    "minimum_water_level": 30,
+    "distance_sensor": {"trigger_pin": 20, "echo_pin": 21, "max_distance": 4},
+    "dht11_pin": 4,
+    "email_address": "pi@example.org",
+    "email_password": "secret",
+    "smtp_server": "smtp.example.org",
+    "smtp_port": 587,
+    "recipient_address": "garden@example.org",
+    "weatherapi_api_key": "key",
+    "latitude": 48.85,
+    "longitude": 2.35,
+    "ecowitt_application_key": "app",
+    "ecowitt_api_key": "api",
+    "meteo_station_mac_adresse": "00:00:00:00:00:00",
+    "database": {"backend": "sqlite", "path": "/tmp/garden.db"},
+    "zones": [{"name": "Garden", "relay_pin": 22, "soil_channel": "soil_ch1", "priority": 1},
+              {"name": "Tomato", "relay_pin": 23, "closed_loop": True}],
+    "watering_times": ["08:00", "20:00"],
+    "job_queue": {"manual_policy": "queue"},
+}
+
+
+def config_with(**changes):
+    config = copy.deepcopy(VALID_CONFIG)
+    config.update(changes)
+    return config
+
+
+def test_valid_config_without_legacy_zone_keys():
+    assert validate_config(config_with()) is not None
+
+
+@pytest.mark.parametrize("changes, message", [
+    ({"watering_times": ["8:00"]}, "'watering_times[0]' must be a time formatted as HH:MM"),
+    ({"watering_times": ["24:00"]}, "'watering_times[0]' must be a time formatted as HH:MM"),
+    ({"job_queue": {"manual_policy": "interrupt"}}, "'job_queue.manual_policy' must be one of queue, preempt"),
+    ({"zones": [{"name": "Garden", "relay_pin": 22}, {"name": "garden", "relay_pin": 23}]},
+     "duplicate zone name 'garden'"),
+    ({"zones": [{"name": "Garden", "relay_pin": 22, "valve": 3}]}, "unknown key 'zones[0].valve'"),
+    ({"zones": [{"name": "Garden", "relay_pin": True}]}, "'zones[0].relay_pin' has type bool"),
+    ({"smtp_port": "587"}, "'smtp_port' has type str"),
+    ({"database": {"backend": "postgres"}}, "'database.backend' must be one of mariadb, sqlite"),
+])
+def test_invalid_config_is_rejected(changes, message):
+    with pytest.raises(ConfigError, match=re.escape(message)):
+        validate_config(config_with(**changes))
+
+
+def test_legacy_zone_keys_are_required_without_zones():
+    config = config_with()
+    del config["zones"]
+    with pytest.raises(ConfigError, match="missing key 'tomato_relay_pin'"):
+        validate_config(config)
+
+
+def test_frozen_config_is_immutable():
+    config = freeze(config_with())
+    with pytest.raises(TypeError):
+        config["pump_relay_pin"] = 1
+    assert config["watering_times"] == ("08:00", "20:00")
+    with pytest.raises(TypeError):
+        config["zones"][0]["priority"] = 2
+
+
+def test_reload_publishes_valid_changes_and_keeps_the_current_config_otherwise(tmp_path):
+    path = tmp_path / "config.json"
+    path.write_text(json.dumps(config_with()), encoding="utf-8")
+    service = ConfigService(str(path))
+    published = []
+    service.subscribe(lambda new, old: published.append((old["watering_times"], new["watering_times"])))
+
+    path.write_text(json.dumps(config_with(watering_times=["07:30"])), encoding="utf-8")
+    assert service.reload()
+    assert published == [(("08:00", "20:00"), ("07:30",))]
+
+    path.write_text(json.dumps(config_with(watering_times=["7h30"])), encoding="utf-8")
+    assert not service.reload()
+    path.write_text("{", encoding="utf-8")
+    assert not service.reload()
+    assert service.get()["watering_times"] == ("07:30",)
+    assert len(published) == 1
@@ -0,0 +1,123 @@
+import threading
+import time
+
+import pytest
+
+from watering import JobQueue, WateringJob, job_queue_settings, MANUAL_PRIORITY, AUTOMATIC_PRIORITY
+
+
+def wait_until(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not reached in time")
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def make_queue():
+    queues = []
+
+    def make(**settings):
+        queue = JobQueue(job_queue_settings({"job_queue": settings}))
+        queues.append(queue)
+        return queue
+
+    yield make
+    for queue in queues:
+        queue.stop()
+
+
+def recorder(runs):
+    def run(job):
+        runs.append(job.zone)
+    return run
+
+
+def test_manual_jobs_run_first_then_zone_priority(make_queue):
+    queue = make_queue()
+    runs = []
+    queue.submit(WateringJob("Garden", "Automatic", AUTOMATIC_PRIORITY + 2, recorder(runs)))
+    queue.submit(WateringJob("Tomato", "Automatic", AUTOMATIC_PRIORITY + 1, recorder(runs)))
+    queue.submit(WateringJob("Annex", "Manual", MANUAL_PRIORITY, recorder(runs)))
+    queue.start()
+    wait_until(lambda: len(runs) == 3)
+    assert runs == ["Annex", "Tomato", "Garden"]
+
+
+def test_repeated_request_is_merged(make_queue):
+    queue = make_queue()
+    status, job = queue.submit(WateringJob("Garden", "Manual", MANUAL_PRIORITY, None))
+    assert status == "queued"
+    assert queue.submit(WateringJob("Garden", "Manual", MANUAL_PRIORITY, None)) == ("duplicate", job)
+    # Un arrosage automatique de la même zone reste une demande distincte
+    assert queue.submit(WateringJob("Garden", "Automatic", AUTOMATIC_PRIORITY, None))[0] == "queued"
+
+
+def test_manual_cooldown_per_zone(make_queue):
+    queue = make_queue(manual_cooldown=300).start()
+    runs = []
+    queue.submit(WateringJob("Garden", "Manual", MANUAL_PRIORITY, recorder(runs)))
+    wait_until(lambda: runs and not queue.is_busy())
+    assert queue.submit(WateringJob("Garden", "Manual", MANUAL_PRIORITY, recorder(runs))) == ("cooldown", None)
+    assert queue.cooldown_remaining("Garden") > 0
+    assert queue.submit(WateringJob("Tomato", "Manual", MANUAL_PRIORITY, recorder(runs)))[0] == "queued"
+
+
+def test_full_queue_rejects_jobs(make_queue):
+    queue = make_queue(max_queued=1)
+    assert queue.submit(WateringJob("Garden", "Automatic", AUTOMATIC_PRIORITY, None))[0] == "queued"
+    assert queue.submit(WateringJob("Tomato", "Automatic", AUTOMATIC_PRIORITY, None)) == ("full", None)
+
+
+def test_cancelled_job_never_runs(make_queue):
+    queue = make_queue()
+    runs = []
+    _, job = queue.submit(WateringJob("Garden", "Automatic", AUTOMATIC_PRIORITY, recorder(runs)))
+    queue.submit(WateringJob("Tomato", "Automatic", AUTOMATIC_PRIORITY, recorder(runs)))
+    assert queue.cancel_zone("Garden") == 1
+    queue.start()
+    wait_until(lambda: runs)
+    assert runs == ["Tomato"]
+    assert job.status == "cancelled"
+
+
+def automatic_run(events, started):
+    """ Arrosage automatique interrompu par cancel_event lors de son premier passage seulement """
+    def run(job):
+        events.append(("automatic", job.kwargs.get("remaining", 60)))
+        started.set()
+        if job.cancel_event.wait(5):
+            job.kwargs["remaining"] = 30
+    return run
+
+
+def test_manual_request_preempts_and_automatic_job_resumes(make_queue):
+    queue = make_queue(manual_policy="preempt").start()
+    events, started = [], threading.Event()
+    _, automatic = queue.submit(WateringJob("Garden", "Automatic", AUTOMATIC_PRIORITY,
+                                            automatic_run(events, started)))
+    assert started.wait(5)
+    queue.submit(WateringJob("Tomato", "Manual", MANUAL_PRIORITY, lambda job: events.append(("manual", None))))
+    wait_until(lambda: len(events) == 3)
+    # Le job interrompu reprend après l'arrosage manuel, avec les paramètres mis à jour par son passage
+    assert events == [("automatic", 60), ("manual", None), ("automatic", 30)]
+    wait_until(lambda: automatic.status != "running")
+    assert automatic.status == "done"
+
+
+def test_queue_policy_waits_for_running_job(make_queue):
+    queue = make_queue(manual_policy="queue").start()
+    events, release = [], threading.Event()
+
+    def automatic(job):
+        events.append("automatic")
+        release.wait(5)
+        events.append("cancelled" if job.cancel_event.is_set() else "automatic done")
+
+    queue.submit(WateringJob("Garden", "Automatic", AUTOMATIC_PRIORITY, automatic))
+    wait_until(lambda: queue.is_busy("Automatic"))
+    queue.submit(WateringJob("Tomato", "Manual", MANUAL_PRIORITY, lambda job: events.append("manual")))
+    release.set()
+    wait_until(lambda: len(events) == 3)
+    assert events == ["automatic", "automatic done", "manual"]
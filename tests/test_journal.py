@@ -0,0 +1,62 @@
+import json
+
+import pytest
+
+from watering import JobJournal
+
+
+@pytest.fixture
+def journal_path(tmp_path):
+    return str(tmp_path / "journal" / "watering_jobs.jsonl")
+
+
+@pytest.fixture
+def journal(journal_path):
+    journal = JobJournal(journal_path, flush_interval=60)
+    yield journal
+    journal.close()
+
+
+def test_unfinished_keeps_jobs_without_end_line(journal):
+    interrupted = journal.start("Garden", "Automatic", relay_pin=22, source="pump", planned=600)
+    journal.progress(interrupted, 120, source="city_water")
+    finished = journal.start("Tomato", "Manual", relay_pin=23)
+    journal.end(finished, 300)
+
+    unfinished = journal.unfinished()
+    assert list(unfinished) == [interrupted]
+    # La dernière progression complète la ligne de démarrage
+    assert unfinished[interrupted]["elapsed"] == 120
+    assert unfinished[interrupted]["source"] == "city_water"
+    assert unfinished[interrupted]["relay_pin"] == 22
+
+
+def test_truncated_line_is_ignored_and_not_glued_to_the_next(journal_path):
+    journal = JobJournal(journal_path)
+    job_id = journal.start("Garden", "Automatic")
+    journal.close()
+    with open(journal_path, "a", encoding="utf-8") as journal_file:
+        journal_file.write('{"event":"end","job":"' + job_id)  # coupure pendant l'écriture
+
+    journal = JobJournal(journal_path)
+    try:
+        assert list(journal.unfinished()) == [job_id]
+        other = journal.start("Tomato", "Manual")
+        assert set(journal.unfinished()) == {job_id, other}
+    finally:
+        journal.close()
+
+
+def test_compact_keeps_only_unfinished_jobs(journal, journal_path):
+    for _ in range(3):
+        journal.end(journal.start("Tomato", "Manual"), 60)
+    running = journal.start("Garden", "Automatic")
+    journal.progress(running, 30)
+
+    journal.compact()
+    with open(journal_path, encoding="utf-8") as journal_file:
+        records = [json.loads(line) for line in journal_file]
+    assert [(record["event"], record["job"]) for record in records] == [("start", running), ("progress", running)]
+    # Le journal reste utilisable après le remplacement du fichier
+    journal.end(running, 45)
+    assert journal.unfinished() == {}
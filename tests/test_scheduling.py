@@ -0,0 +1,82 @@
+from unittest import mock
+
+import pytest
+import schedule
+
+import garden_app_instance
+from garden_app_instance import GardenWateringApp
+from watering import build_zones
+
+CONFIG = {
+    "zones": [{"name": "Garden", "relay_pin": 22, "soil_channel": "soil_ch1", "moisture_threshold": 62},
+              {"name": "Annex", "relay_pin": 24}],
+    "watering_times": ["08:00", "20:00"],
+}
+
+
+@pytest.fixture
+def app(monkeypatch):
+    """ Démon sans matériel ni réseau : seuls les attributs utilisés par la planification sont fournis """
+    app = GardenWateringApp.__new__(GardenWateringApp)
+    app.config = CONFIG
+    app.zones = build_zones(CONFIG)
+    app.app_logger = mock.Mock()
+    app.weather_api = mock.Mock()
+    app.weather_api.get_hourly_rain_forecast.return_value = []
+    app.jobs = mock.Mock()
+    app.jobs.submit.return_value = ("queued", None)
+    for name in ("log_rain_forecast", "log_last_12h_rain", "log_watering_decision"):
+        monkeypatch.setattr(garden_app_instance, name, mock.Mock())
+    schedule.clear()
+    yield app
+    schedule.clear()
+
+
+def test_watering_times_are_rescheduled(app):
+    app.schedule_watering()
+    assert sorted(str(job.at_time) for job in schedule.get_jobs("watering")) == ["08:00:00", "20:00:00"]
+
+    app.config = dict(CONFIG, watering_times=["06:30"])
+    app.schedule_watering()
+    assert [str(job.at_time) for job in schedule.get_jobs("watering")] == ["06:30:00"]
+
+
+def test_invalid_watering_time_keeps_the_schedule(app):
+    app.schedule_watering()
+    app.config = dict(CONFIG, watering_times=["25:00"])
+    app.schedule_watering()
+    assert len(schedule.get_jobs("watering")) == 2
+    app.app_logger.error.assert_called_once()
+
+
+def test_failing_job_is_logged_and_stays_scheduled(app):
+    failing = mock.Mock(side_effect=RuntimeError("network down"), __name__="failing")
+    schedule.every().minute.do(app.guarded(failing))
+    schedule.run_all()
+    schedule.run_all()
+    assert failing.call_count == 2
+    assert len(schedule.get_jobs()) == 1
+    assert "network down" in app.app_logger.error.call_args[0][0]
+
+
+def test_station_failure_falls_back_to_the_rain_history(app, monkeypatch):
+    app.weather_api.get_last_12_hour_rain_data.side_effect = OSError("station offline")
+    app.weather_api.get_soil_moisture_data.return_value = {"Garden": 30}
+    history = mock.Mock(return_value=0.0)
+    monkeypatch.setattr(garden_app_instance, "recent_rain_from_history", history)
+
+    app.scheduled_watering()
+
+    history.assert_called_once_with(12)
+    job = app.jobs.submit.call_args[0][0]
+    assert (job.zone, job.mode, job.kwargs["moisture"]) == ("Garden", "Automatic", 30)
+
+
+def test_soil_moisture_failure_skips_automatic_watering(app, monkeypatch):
+    app.weather_api.get_last_12_hour_rain_data.return_value = 0.0
+    app.weather_api.get_soil_moisture_data.side_effect = OSError("gateway offline")
+
+    app.scheduled_watering()
+
+    app.jobs.submit.assert_not_called()
+    app.app_logger.error.assert_called_once()
@@ -0,0 +1,59 @@
+from datetime import datetime
+
+from sqlalchemy import select, text
+
+from data_management.database import Base, has_natural_key, upsert
+from data_management.dedup import count_duplicates, ensure_natural_keys
+from models import Hygrometry, WaterLevel
+
+MOMENT = datetime(2026, 6, 1, 8, 0)
+
+
+def rows_of(engine, model, *columns):
+    with engine.connect() as connection:
+        return connection.execute(select(*columns).order_by(model.id)).all()
+
+
+def test_upsert_replaces_the_row_with_the_same_key(sqlite_engine):
+    Base.metadata.create_all(sqlite_engine)
+    with sqlite_engine.begin() as connection:
+        upsert(connection, WaterLevel, [{"time": MOMENT, "level": 120.0}])
+        upsert(connection, WaterLevel, [{"time": MOMENT, "level": 118.5}])
+    assert rows_of(sqlite_engine, WaterLevel, WaterLevel.level) == [(118.5,)]
+
+
+def test_upsert_key_includes_the_zone(sqlite_engine):
+    Base.metadata.create_all(sqlite_engine)
+    with sqlite_engine.begin() as connection:
+        upsert(connection, Hygrometry, [{"time": MOMENT, "zone": "Garden", "level": 40.0},
+                                        {"time": MOMENT, "zone": "Tomato", "level": 55.0}])
+        upsert(connection, Hygrometry, [{"time": MOMENT, "zone": "Garden", "level": 42.0}])
+    assert rows_of(sqlite_engine, Hygrometry, Hygrometry.zone, Hygrometry.level) == [("Garden", 42.0), ("Tomato", 55.0)]
+
+
+def test_legacy_table_is_inserted_into_then_deduplicated(sqlite_engine):
+    # Table créée avant les clés naturelles : pas d'index unique sur l'horodatage
+    with sqlite_engine.begin() as connection:
+        connection.execute(text("CREATE TABLE water_level "
+                                "(id INTEGER PRIMARY KEY, time TIMESTAMP, level FLOAT NOT NULL)"))
+    Base.metadata.create_all(sqlite_engine)
+    with sqlite_engine.begin() as connection:
+        assert not has_natural_key(connection, WaterLevel.__table__)
+        upsert(connection, WaterLevel, [{"time": datetime(2026, 6, 1, 8, 0, 10), "level": 120.0},
+                                        {"time": datetime(2026, 6, 1, 8, 0, 40), "level": 119.0},
+                                        {"time": datetime(2026, 6, 1, 8, 1, 5), "level": 118.0}])
+        assert count_duplicates(connection, WaterLevel) == 1
+
+    assert ensure_natural_keys(sqlite_engine) == {"water_level": 1}
+    # La dernière ligne de chaque minute est gardée, son horodatage arrondi
+    assert rows_of(sqlite_engine, WaterLevel, WaterLevel.id, WaterLevel.time, WaterLevel.level) == [
+        (2, datetime(2026, 6, 1, 8, 0), 119.0), (3, datetime(2026, 6, 1, 8, 1), 118.0)]
+    with sqlite_engine.begin() as connection:
+        assert has_natural_key(connection, WaterLevel.__table__)
+        upsert(connection, WaterLevel, [{"time": datetime(2026, 6, 1, 8, 1), "level": 117.0}])
+    assert rows_of(sqlite_engine, WaterLevel, WaterLevel.level) == [(119.0,), (117.0,)]
+
+
+def test_migration_skips_tables_that_already_have_their_key(sqlite_engine):
+    Base.metadata.create_all(sqlite_engine)
+    assert ensure_natural_keys(sqlite_engine) == {}
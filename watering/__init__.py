@@ -0,0 +1,7 @@
+# watering/__init__.py
+from .zones import Zone, ZoneRegistry, build_zones, stop_button_pin
+from .closed_loop import ClosedLoopController, WateringResult, closed_loop_settings
+from .decisions import Decision, RainDecisionEngine, RainOutlook, rain_decision_settings
+from .cistern import Cistern, CisternWatch, cistern_settings, learn_flow_rates
+from .journal import JobJournal, DEFAULT_JOURNAL_PATH
+from .jobs import JobQueue, WateringJob, job_queue_settings, MANUAL_PRIORITY, AUTOMATIC_PRIORITY
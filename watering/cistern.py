@@ -0,0 +1,198 @@
+"""
+Modèle de la citerne et choix prédictif de la source d'eau.
+
+Le niveau mesuré (cm d'eau au-dessus du fond) est converti en litres selon la forme de la cuve,
+déclarée dans la section `cistern` de config.json :
+
+    "cistern": {"sensor_height": 95, "shape": "vertical_cylinder", "diameter": 120, "count": 2,
+                "reserve_level": 20, "check_interval": 30, "min_pump_seconds": 60}
+
+Formes : "vertical_cylinder" (diameter), "horizontal_cylinder" (diameter, length), "rectangular" (width, length),
+ou "curve" ([[niveau en cm, litres], ...] relevés à l'empotage). Les dimensions sont en cm.
+Le débit de la pompe vers chaque zone est appris des baisses de niveau mesurées pendant les arrosages passés.
+"""
+import bisect
+import math
+import statistics
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+from data_management.database import SessionLocal
+from models import WaterLevel, WateringSession
+
+DEFAULT_SETTINGS = {
+    "sensor_height": 95,  # distance entre le capteur et le fond de la cuve
+    "shape": "vertical_cylinder",
+    "diameter": 100,
+    "count": 1,  # cuves identiques reliées entre elles
+    "check_interval": 30,  # secondes entre deux lectures du niveau pendant un arrosage à la pompe
+    "min_pump_seconds": 60,  # en deçà, démarrer la pompe ne vaut pas la peine
+    "learning_days": 60,
+}
+
+# Nombre de tranches pour tabuler le volume d'une cuve cylindrique couchée
+CURVE_STEPS = 50
+
+
+def cistern_settings(config):
+    """ Réglages de la citerne ; la réserve vaut par défaut l'ancien minimum_water_level """
+    settings = dict(DEFAULT_SETTINGS)
+    settings.update(config.get("cistern", {}))
+    settings.setdefault("reserve_level", config.get("minimum_water_level", 0))
+    return settings
+
+
+def shape_curve(settings):
+    """ Courbe [(niveau en cm, litres)] d'une cuve selon sa forme """
+    height = settings["sensor_height"]
+    shape = settings["shape"]
+    if shape == "curve":
+        return [(float(level), float(volume)) for level, volume in settings["curve"]]
+    if shape == "vertical_cylinder":
+        area = math.pi * (settings["diameter"] / 2) ** 2
+        return [(0.0, 0.0), (float(height), area * height / 1000)]
+    if shape == "rectangular":
+        area = settings["width"] * settings["length"]
+        return [(0.0, 0.0), (float(height), area * height / 1000)]
+    if shape == "horizontal_cylinder":
+        radius = settings["diameter"] / 2
+        curve = []
+        for step in range(CURVE_STEPS + 1):
+            level = settings["diameter"] * step / CURVE_STEPS
+            # Aire du segment circulaire immergé
+            segment = radius ** 2 * math.acos((radius - level) / radius) - (radius - level) * math.sqrt(
+                max(0.0, 2 * radius * level - level ** 2))
+            curve.append((level, segment * settings["length"] / 1000))
+        return curve
+    raise ValueError(f"Unknown cistern shape: {shape}")
+
+
+class Cistern:
+    """ Conversion niveau <-> volume et prévision de la baisse du niveau pendant un arrosage à la pompe """
+
+    def __init__(self, curve, reserve_level=0.0, count=1):
+        self.levels = [level for level, _ in sorted(curve)]
+        self.volumes = [volume * count for _, volume in sorted(curve)]
+        self.reserve_level = reserve_level
+
+    @classmethod
+    def from_config(cls, config):
+        settings = cistern_settings(config)
+        return cls(shape_curve(settings), settings["reserve_level"], settings["count"])
+
+    @staticmethod
+    def _interpolate(value, xs, ys):
+        if value <= xs[0]:
+            return ys[0]
+        if value >= xs[-1]:
+            return ys[-1]
+        index = bisect.bisect_right(xs, value)
+        x0, x1, y0, y1 = xs[index - 1], xs[index], ys[index - 1], ys[index]
+        return y0 + (y1 - y0) * (value - x0) / (x1 - x0) if x1 != x0 else y1
+
+    def volume(self, level):
+        """ Litres contenus pour un niveau en cm """
+        return self._interpolate(level, self.levels, self.volumes)
+
+    def level(self, volume):
+        """ Niveau en cm pour un volume en litres """
+        return self._interpolate(volume, self.volumes, self.levels)
+
+    @property
+    def reserve(self):
+        return self.volume(self.reserve_level)
+
+    def available(self, level):
+        """ Litres que la pompe peut encore prélever avant la réserve """
+        return max(0.0, self.volume(level) - self.reserve)
+
+    def seconds_until_reserve(self, level, flow_rate):
+        """ Temps de pompage (secondes) avant d'atteindre la réserve ; infini si le débit est inconnu """
+        available = self.available(level)
+        if available <= 0:
+            return 0.0
+        if not flow_rate:
+            return math.inf
+        return available / flow_rate * 60
+
+
+class CisternWatch:
+    """
+    Surveille la citerne pendant un arrosage à la pompe : le niveau est relu toutes les `interval` secondes
+    et, dès que la réserve sera atteinte avant la lecture suivante, `switch_to_city` bascule sur l'eau de ville.
+    """
+
+    def __init__(self, cistern, read_level, switch_to_city, flow_rate=None, interval=30):
+        self.cistern = cistern
+        self.read_level = read_level
+        self.switch_to_city = switch_to_city
+        self.flow_rate = flow_rate
+        self.interval = interval
+        self.switched = False
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="cistern-watch", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._done.set()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+        return self.switched
+
+    def _run(self):
+        while not self._done.wait(self.interval):
+            try:
+                level = self.read_level()
+            except Exception:
+                # Une lecture manquée ne coupe pas l'arrosage : la suivante décidera
+                continue
+            if level is None:
+                continue
+            remaining = self.cistern.seconds_until_reserve(level, self.flow_rate)
+            if remaining < self.interval:
+                # La réserve sera atteinte avant la prochaine lecture : on bascule juste avant
+                if remaining > 0 and self._done.wait(remaining):
+                    return
+                self.switched = True
+                self.switch_to_city()
+                return
+
+
+def learn_flow_rates(cistern, days=60, session=None):
+    """
+    Débit de pompage (litres/minute) de chaque zone, appris des arrosages à la pompe des `days` derniers jours :
+    médiane des volumes prélevés (niveau avant et après la session) divisés par la durée de la session.
+    """
+    own_session = session is None
+    session = session or SessionLocal()
+    try:
+        since = datetime.now() - timedelta(days=days)
+        levels = session.execute(select(WaterLevel.time, WaterLevel.level).where(WaterLevel.time >= since)
+                                 .order_by(WaterLevel.time)).all()
+        sessions = session.execute(
+            select(WateringSession.time, WateringSession.zone, WateringSession.duration)
+            .where(WateringSession.time >= since, WateringSession.source == "pump",
+                   WateringSession.duration > 0)).all()
+    finally:
+        if own_session:
+            session.close()
+
+    times = [time for time, _ in levels]
+    rates = {}
+    for end, zone, duration in sessions:
+        # La session est enregistrée à la fin de l'arrosage ; le niveau est mesuré au départ et à l'arrêt
+        start = end - timedelta(seconds=duration)
+        before = bisect.bisect_right(times, start + timedelta(seconds=60)) - 1
+        after = bisect.bisect_left(times, end - timedelta(seconds=60))
+        if before < 0 or after >= len(times) or times[before] < start - timedelta(minutes=5) \
+                or times[after] > end + timedelta(minutes=5):
+            continue
+        drawn = cistern.volume(levels[before][1]) - cistern.volume(levels[after][1])
+        if drawn > 0:
+            rates.setdefault(zone, []).append(drawn / duration * 60)
+    return {zone: statistics.median(values) for zone, values in rates.items()}
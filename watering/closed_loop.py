@@ -0,0 +1,114 @@
+"""
+Arrosage en boucle fermée.
+
+La vanne reste ouverte tant que l'humidité de la zone, relue à intervalle régulier, n'a pas atteint sa cible.
+L'arrosage s'arrête aussi dès qu'un plateau est atteint ou prévu (le sol n'absorbera plus beaucoup plus),
+et dans tous les cas après `max_duration` secondes. Réglages dans la section `closed_loop` de config.json :
+
+    "closed_loop": {"enabled": true, "poll_interval": 60, "min_duration": 120, "max_duration": 900,
+                    "target_margin": 8, "plateau_delta": 0.5}
+"""
+import threading
+import time
+
+DEFAULT_SETTINGS = {
+    "enabled": False,
+    "poll_interval": 60,  # les capteurs Ecowitt publient environ une mesure par minute
+    "min_duration": 120,  # l'eau met du temps à atteindre la sonde : pas de plateau avant ce délai
+    "max_duration": 900,
+    "target_margin": 8,  # cible par défaut : seuil de la zone + marge
+    "plateau_delta": 0.5,  # gain d'humidité (points de %) en dessous duquel on considère le sol saturé
+}
+
+
+def closed_loop_settings(config):
+    """ Réglages de la boucle fermée, complétés par les valeurs par défaut """
+    settings = dict(DEFAULT_SETTINGS)
+    settings.update(config.get("closed_loop", {}))
+    return settings
+
+
+def predicted_plateau(readings):
+    """
+    Asymptote prévue à partir des trois dernières lectures (accélération d'Aitken) : l'humidité d'un sol
+    arrosé à débit constant tend exponentiellement vers un plateau. None si la courbe n'en montre pas encore.
+    """
+    if len(readings) < 3:
+        return None
+    first, second, third = readings[-3:]
+    rise, next_rise = second - first, third - second
+    if rise <= 0 or next_rise < 0 or next_rise >= rise:
+        return None
+    return third - next_rise ** 2 / (next_rise - rise)
+
+
+class WateringResult:
+    """ Bilan d'un arrosage en boucle fermée """
+
+    def __init__(self, duration, reason, trajectory):
+        self.duration = duration
+        self.reason = reason  # "target", "plateau", "max_duration" ou "stopped"
+        self.trajectory = trajectory  # [(secondes écoulées, humidité)]
+
+    @property
+    def final_moisture(self):
+        return self.trajectory[-1][1] if self.trajectory else None
+
+
+class ClosedLoopController:
+    """ Surveille l'humidité d'une zone pendant l'arrosage et décide quand fermer la vanne """
+
+    def __init__(self, read_moisture, poll_interval=60, min_duration=120, max_duration=900, plateau_delta=0.5,
+                 stop_event=None, clock=time.monotonic):
+        self.read_moisture = read_moisture  # () -> humidité, ou None si la lecture échoue
+        self.poll_interval = poll_interval
+        self.min_duration = min_duration
+        self.max_duration = max_duration
+        self.plateau_delta = plateau_delta
+        self.stop_event = stop_event or threading.Event()
+        self.clock = clock
+        self.on_reading = None  # (secondes écoulées, humidité) -> None, appelé après chaque lecture réussie
+
+    @classmethod
+    def from_config(cls, config, read_moisture, stop_event=None):
+        settings = closed_loop_settings(config)
+        return cls(read_moisture, settings["poll_interval"], settings["min_duration"], settings["max_duration"],
+                   settings["plateau_delta"], stop_event)
+
+    def should_stop(self, elapsed, readings, target):
+        """ Raison d'arrêter l'arrosage après une nouvelle lecture, ou None pour continuer """
+        if readings and readings[-1] >= target:
+            return "target"
+        if elapsed >= self.max_duration:
+            return "max_duration"
+        # Tant que la sonde n'a pas réagi, une humidité stable ne signifie pas que le sol est saturé
+        if elapsed < self.min_duration or len(readings) < 3 or readings[-1] - readings[0] < self.plateau_delta:
+            return None
+        if readings[-1] - readings[-3] < self.plateau_delta:
+            return "plateau"
+        plateau = predicted_plateau(readings)
+        if plateau is not None and plateau - readings[-1] < self.plateau_delta:
+            return "plateau"
+        return None
+
+    def run(self, initial_moisture, target):
+        """ Attend (vanne ouverte) jusqu'à la cible, un plateau, la durée maximale ou un arrêt demandé """
+        start = self.clock()
+        trajectory = [(0, initial_moisture)] if initial_moisture is not None else []
+        readings = [moisture for _, moisture in trajectory]
+        while True:
+            elapsed = self.clock() - start
+            wait = min(self.poll_interval, self.max_duration - elapsed)
+            if wait > 0 and self.stop_event.wait(wait):
+                return WateringResult(round(self.clock() - start), "stopped", trajectory)
+            elapsed = self.clock() - start
+            moisture = self.read_moisture()
+            if moisture is not None:
+                # Une lecture manquée n'interrompt pas l'arrosage, la durée maximale reste le garde-fou
+                trajectory.append((round(elapsed), moisture))
+                readings.append(moisture)
+                if self.on_reading is not None:
+                    self.on_reading(elapsed, moisture)
+            reason = self.should_stop(elapsed, readings, target)
+            if reason is not None:
+                return WateringResult(round(elapsed), reason, trajectory)
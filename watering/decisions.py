@@ -0,0 +1,128 @@
+"""
+Décisions d'arrosage tenant compte de la pluie.
+
+Avant chaque arrosage automatique, la pluie mesurée sur les 12 dernières heures, la pluie prévue sur les
+12 prochaines (pondérée par sa probabilité) et l'humidité du sol de la zone donnent l'une des décisions :
+
+- "water" : arrosage normal ;
+- "skip" : sol assez humide, ou assez de pluie tombée ou attendue ;
+- "defer" : une averse probable arrive bientôt, la zone est réévaluée après `defer_hours` heures ;
+- "reduce" : un peu de pluie est tombée ou attendue, l'arrosage est raccourci d'autant.
+
+Réglages dans la section `rain_decision` de config.json.
+"""
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select
+
+from data_management.database import SessionLocal
+from models import HourlyRain
+
+DEFAULT_SETTINGS = {
+    "enabled": True,
+    "skip_rain": 5.0,  # mm (mesurés + attendus) qui rendent l'arrosage inutile
+    "min_rain": 0.5,  # mm en dessous desquels la pluie est ignorée
+    "min_chance": 60,  # % de probabilité à partir duquel une heure de pluie est jugée probable
+    "defer_hours": 3,  # une averse probable dans ce délai reporte l'arrosage d'autant
+    "dry_moisture": 30,  # en dessous, le sol est trop sec pour attendre la pluie
+    "min_factor": 0.3,  # réduction maximale de la durée d'arrosage
+}
+
+
+def rain_decision_settings(config):
+    """ Réglages des décisions de pluie, complétés par les valeurs par défaut """
+    settings = dict(DEFAULT_SETTINGS)
+    settings.update(config.get("rain_decision", {}))
+    return settings
+
+
+class RainOutlook:
+    """ Pluie mesurée et prévue au moment d'un arrosage, commune à toutes les zones """
+
+    def __init__(self, measured, forecast):
+        self.measured = measured or 0.0  # mm tombés sur les 12 dernières heures
+        self.forecast = forecast  # [(heure, mm prévus, probabilité en %)] pour les heures à venir
+
+    @property
+    def forecast_amount(self):
+        return sum(rain for _, rain, _ in self.forecast)
+
+    @property
+    def expected(self):
+        """ Pluie attendue : quantités prévues pondérées par leur probabilité """
+        return sum(rain * chance / 100 for _, rain, chance in self.forecast)
+
+    @property
+    def max_chance(self):
+        return max((chance for _, _, chance in self.forecast), default=0.0)
+
+    def first_likely_rain(self, min_chance, min_rain):
+        """ Rang (en heures) de la première heure de pluie probable, ou None """
+        for index, (_, rain, chance) in enumerate(self.forecast):
+            if chance >= min_chance and rain >= min_rain:
+                return index
+        return None
+
+
+class Decision:
+    """ Décision pour une zone, avec son explication """
+
+    def __init__(self, zone, action, reason, moisture, outlook, factor=1.0):
+        self.zone = zone
+        self.action = action
+        self.reason = reason
+        self.moisture = moisture
+        self.outlook = outlook
+        self.factor = factor  # part de la durée (ou du temps maximal) d'arrosage conservée
+
+    def __repr__(self):
+        return f"Decision({self.zone.name!r}, {self.action!r}, factor={self.factor:.2f})"
+
+
+class RainDecisionEngine:
+    """ Combine pluie mesurée, prévisions et humidité du sol en une décision par zone """
+
+    def __init__(self, settings):
+        self.settings = settings
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(rain_decision_settings(config))
+
+    def decide(self, zone, moisture, outlook, allow_defer=True):
+        """ Décision pour `zone` ; un arrosage déjà reporté (`allow_defer` faux) n'est plus reporté """
+        settings = self.settings
+        if moisture >= zone.moisture_threshold:
+            return Decision(zone, "skip", f"soil moisture {moisture:.1f}% is above the "
+                            f"{zone.moisture_threshold}% threshold", moisture, outlook, factor=0.0)
+        if not settings["enabled"]:
+            return Decision(zone, "water", "rain decisions disabled", moisture, outlook)
+        if moisture < settings["dry_moisture"]:
+            return Decision(zone, "water", f"soil moisture {moisture:.1f}% is too low to wait for rain",
+                            moisture, outlook)
+
+        rain = outlook.measured + outlook.expected
+        if rain >= settings["skip_rain"]:
+            return Decision(zone, "skip", f"{outlook.measured:.1f} mm fell in the last 12 h and "
+                            f"{outlook.expected:.1f} mm are expected (up to {outlook.max_chance:.0f}% "
+                            f"chance of rain)", moisture, outlook, factor=0.0)
+        first_rain = outlook.first_likely_rain(settings["min_chance"], settings["min_rain"])
+        if allow_defer and first_rain is not None and first_rain < settings["defer_hours"]:
+            return Decision(zone, "defer", f"rain likely within {first_rain + 1} h, "
+                            f"re-evaluating in {settings['defer_hours']} h", moisture, outlook, factor=0.0)
+        if rain >= settings["min_rain"]:
+            factor = max(settings["min_factor"], 1 - rain / settings["skip_rain"])
+            return Decision(zone, "reduce", f"{rain:.1f} mm of rain measured or expected, watering "
+                            f"reduced to {factor:.0%}", moisture, outlook, factor=factor)
+        return Decision(zone, "water", f"no significant rain measured or expected ({rain:.1f} mm)",
+                        moisture, outlook)
+
+
+def recent_rain_from_history(hours=12):
+    """ Pluie enregistrée heure par heure sur les `hours` dernières heures, si la station ne répond pas """
+    session = SessionLocal()
+    try:
+        return session.execute(select(func.coalesce(func.sum(HourlyRain.amount), 0.0))
+                               .where(HourlyRain.time >= datetime.now() - timedelta(hours=hours))).scalar()
+    finally:
+        session.close()
@@ -0,0 +1,215 @@
+"""
+File d'attente des arrosages.
+
+Toutes les demandes (programmation, boutons, front-end) deviennent des jobs exécutés un par un par un thread
+dédié, par ordre de priorité puis d'arrivée. Les arrosages manuels passent devant les automatiques ; selon
+`manual_policy`, ils attendent la fin de l'arrosage automatique en cours ("queue") ou l'interrompent
+("preempt"), l'arrosage interrompu reprenant ensuite. Les demandes répétées pour une zone déjà en attente
+ou en cours sont fusionnées, et chaque zone a son propre délai entre deux arrosages manuels.
+Réglages dans la section `job_queue` de config.json.
+"""
+import heapq
+import itertools
+import threading
+import time
+import uuid
+
+DEFAULT_SETTINGS = {
+    "manual_policy": "preempt",
+    "manual_cooldown": 300,  # secondes entre deux arrosages manuels d'une même zone
+    "max_queued": 20,
+}
+
+MANUAL_POLICIES = ("queue", "preempt")
+
+# Les priorités manuelles et automatiques sont décalées : un arrosage manuel passe toujours devant
+MANUAL_PRIORITY = 0
+AUTOMATIC_PRIORITY = 1000
+
+
+def job_queue_settings(config):
+    settings = dict(DEFAULT_SETTINGS)
+    settings.update(config.get("job_queue", {}))
+    return settings
+
+
+class WateringJob:
+    """ Arrosage demandé pour une zone ; `run(job)` l'exécute en surveillant `job.cancel_event` """
+
+    def __init__(self, zone, mode, priority, run, requested_by=None, **kwargs):
+        self.id = uuid.uuid4().hex[:12]
+        self.zone = zone
+        self.mode = mode  # "Manual" ou "Automatic"
+        self.priority = priority
+        self.run = run
+        self.requested_by = requested_by
+        self.kwargs = kwargs  # paramètres de l'arrosage, mis à jour pour une reprise après préemption
+        self.status = "queued"
+        self.submitted = time.time()
+        self.started = None
+        self.cancel_event = threading.Event()
+        self.preempted = False
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "zone": self.zone,
+            "mode": self.mode,
+            "priority": self.priority,
+            "status": self.status,
+            "requested_by": self.requested_by,
+            "submitted": self.submitted,
+            "started": self.started,
+        }
+
+
+class JobQueue:
+    """ File à priorité exécutée par un unique thread : un seul arrosage à la fois """
+
+    def __init__(self, settings=None, logger=None):
+        self.settings = settings or dict(DEFAULT_SETTINGS)
+        self.logger = logger
+        self.heap = []
+        self.sequence = itertools.count()
+        self.running = None
+        self.last_manual = {}  # zone -> fin du dernier arrosage manuel (time.monotonic)
+        self.condition = threading.Condition()
+        self.stopped = False
+        self.worker = threading.Thread(target=self._work, name="watering-jobs", daemon=True)
+
+    def start(self):
+        self.worker.start()
+        return self
+
+    def _log(self, message):
+        if self.logger is not None:
+            self.logger.info(message)
+
+    def _queued_jobs(self):
+        return [job for _, _, job in sorted(self.heap) if job.status == "queued"]
+
+    def submit(self, job):
+        """ Ajoute un job ; renvoie (statut, job) avec statut "queued", "duplicate", "cooldown" ou "full" """
+        with self.condition:
+            for existing in self._queued_jobs() + ([self.running] if self.running else []):
+                if existing.zone == job.zone and existing.mode == job.mode:
+                    return "duplicate", existing
+            if job.mode == "Manual":
+                last = self.last_manual.get(job.zone)
+                if last is not None and time.monotonic() - last < self.settings["manual_cooldown"]:
+                    return "cooldown", None
+            if len(self._queued_jobs()) >= self.settings["max_queued"]:
+                return "full", None
+            heapq.heappush(self.heap, (job.priority, next(self.sequence), job))
+            running = self.running
+            if (running is not None and self.settings["manual_policy"] == "preempt" and job.mode == "Manual"
+                    and running.mode != "Manual"):
+                self._log(f"Preempting {running.mode.lower()} watering of {running.zone} for {job.zone}.")
+                running.preempted = True
+                running.cancel_event.set()
+            self.condition.notify()
+            return "queued", job
+
+    def cooldown_remaining(self, zone):
+        last = self.last_manual.get(zone)
+        if last is None:
+            return 0
+        return max(0, round(self.settings["manual_cooldown"] - (time.monotonic() - last)))
+
+    def cancel(self, job_id):
+        """ Annule un job en attente, ou interrompt le job en cours ; False si l'id est inconnu """
+        with self.condition:
+            if self.running is not None and self.running.id == job_id:
+                self.running.cancel_event.set()
+                return True
+            for job in self._queued_jobs():
+                if job.id == job_id:
+                    job.status = "cancelled"
+                    return True
+            return False
+
+    def cancel_zone(self, zone):
+        """ Annule les jobs d'une zone, en attente ou en cours ; renvoie leur nombre """
+        with self.condition:
+            cancelled = 0
+            for job in self._queued_jobs():
+                if job.zone == zone:
+                    job.status = "cancelled"
+                    cancelled += 1
+            if self.running is not None and self.running.zone == zone:
+                self.running.preempted = False
+                self.running.cancel_event.set()
+                cancelled += 1
+            return cancelled
+
+    def clear(self):
+        """ Vide la file et interrompt le job en cours (arrêt général) ; renvoie le nombre de jobs annulés """
+        with self.condition:
+            cancelled = 0
+            for job in self._queued_jobs():
+                job.status = "cancelled"
+                cancelled += 1
+            self.heap = []
+            if self.running is not None:
+                self.running.preempted = False
+                self.running.cancel_event.set()
+                cancelled += 1
+            return cancelled
+
+    def snapshot(self):
+        """ État de la file pour le front-end """
+        with self.condition:
+            zones = set(self.last_manual)
+            return {
+                "running": self.running.to_dict() if self.running else None,
+                "queued": [job.to_dict() for job in self._queued_jobs()],
+                "cooldowns": {zone: self.cooldown_remaining(zone) for zone in zones
+                              if self.cooldown_remaining(zone) > 0},
+                "manual_policy": self.settings["manual_policy"],
+            }
+
+    def is_busy(self, mode=None):
+        """ Un arrosage (du mode donné) est-il en cours ? """
+        with self.condition:
+            return self.running is not None and (mode is None or self.running.mode == mode)
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        self.clear()
+
+    def _next_job(self):
+        with self.condition:
+            while not self.stopped:
+                while self.heap:
+                    _, _, job = heapq.heappop(self.heap)
+                    if job.status == "queued":
+                        job.status = "running"
+                        job.started = time.time()
+                        self.running = job
+                        return job
+                self.condition.wait()
+            return None
+
+    def _work(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            try:
+                job.run(job)
+            except Exception as e:
+                if self.logger is not None:
+                    self.logger.error(f"Watering job {job.id} for {job.zone} failed: {e}")
+            with self.condition:
+                self.running = None
+                if job.mode == "Manual":
+                    self.last_manual[job.zone] = time.monotonic()
+                if job.preempted and not self.stopped:
+                    # Reprise après l'arrosage prioritaire, avec les paramètres mis à jour par `run`
+                    job.status, job.preempted = "queued", False
+                    job.cancel_event.clear()
+                    heapq.heappush(self.heap, (job.priority, next(self.sequence), job))
+                else:
+                    job.status = "cancelled" if job.cancel_event.is_set() else "done"
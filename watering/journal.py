@@ -0,0 +1,128 @@
+"""
+Journal durable des arrosages.
+
+Chaque arrosage y laisse une ligne JSON au démarrage (avant l'ouverture de la vanne), des lignes de progression
+et une ligne de fin. Le fichier est en ajout seul : les démarrages et les fins sont synchronisés sur disque
+aussitôt, les progressions par lots (un fsync au plus toutes les `flush_interval` secondes).
+Au redémarrage, les arrosages sans ligne de fin sont ceux qu'un plantage ou une coupure a interrompus.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+
+DEFAULT_JOURNAL_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "journal",
+                                    "watering_jobs.jsonl")
+
+
+class JobJournal:
+    """ Journal JSON Lines des arrosages (start, progress, end) """
+
+    def __init__(self, path=DEFAULT_JOURNAL_PATH, flush_interval=1.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.file = open(path, "a", encoding="utf-8")
+        if self.file.tell() and not self._ends_with_newline():
+            # Ligne tronquée par une coupure : les suivantes ne doivent pas s'y coller
+            self.file.write("\n")
+            self.file.flush()
+        self.dirty = False
+        self.closed = threading.Event()
+        self.flusher = threading.Thread(target=self._flush_loop, name="journal-flush", daemon=True)
+        self.flusher.start()
+
+    def _ends_with_newline(self):
+        with open(self.path, "rb") as journal_file:
+            journal_file.seek(-1, os.SEEK_END)
+            return journal_file.read(1) == b"\n"
+
+    def _write(self, record, durable):
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+            if durable:
+                os.fsync(self.file.fileno())
+                self.dirty = False
+            else:
+                self.dirty = True
+
+    def _flush_loop(self):
+        while not self.closed.wait(self.flush_interval):
+            self.sync()
+
+    def sync(self):
+        """ Synchronise sur disque les lignes en attente (progressions) """
+        with self.lock:
+            if self.dirty and not self.file.closed:
+                os.fsync(self.file.fileno())
+                self.dirty = False
+
+    def start(self, zone, mode, job_id=None, **fields):
+        """ Enregistre le démarrage d'un arrosage et renvoie son identifiant """
+        job_id = job_id or uuid.uuid4().hex[:12]
+        self._write(dict(fields, event="start", job=job_id, time=time.time(), zone=zone, mode=mode), durable=True)
+        return job_id
+
+    def progress(self, job_id, elapsed, **fields):
+        self._write(dict(fields, event="progress", job=job_id, time=time.time(), elapsed=round(elapsed)),
+                    durable=False)
+
+    def end(self, job_id, duration, status="done", **fields):
+        self._write(dict(fields, event="end", job=job_id, time=time.time(), duration=round(duration),
+                         status=status), durable=True)
+
+    def read(self):
+        """ Lignes du journal ; une dernière ligne tronquée par une coupure est ignorée """
+        records = []
+        with open(self.path, encoding="utf-8") as journal_file:
+            for line in journal_file:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+        return records
+
+    def unfinished(self):
+        """ Arrosages démarrés mais jamais terminés : {id: ligne de démarrage complétée par la progression} """
+        jobs = {}
+        for record in self.read():
+            job_id = record.get("job")
+            if record.get("event") == "start":
+                jobs[job_id] = dict(record, elapsed=0)
+            elif job_id in jobs and record.get("event") == "progress":
+                jobs[job_id].update({key: value for key, value in record.items() if key not in ("event", "time")})
+            elif record.get("event") == "end":
+                jobs.pop(job_id, None)
+        return jobs
+
+    def compact(self):
+        """ Réécrit le journal avec les seuls arrosages en cours (remplacement atomique) """
+        with self.lock:
+            self.file.flush()
+            keep = self.unfinished()
+            temporary_path = self.path + ".tmp"
+            with open(temporary_path, "w", encoding="utf-8") as temporary_file:
+                for record in self.read():
+                    if record.get("job") in keep:
+                        temporary_file.write(json.dumps(record, separators=(",", ":")) + "\n")
+                temporary_file.flush()
+                os.fsync(temporary_file.fileno())
+            self.file.close()
+            os.replace(temporary_path, self.path)
+            directory = os.open(os.path.dirname(self.path), os.O_RDONLY)
+            try:
+                os.fsync(directory)
+            finally:
+                os.close(directory)
+            self.file = open(self.path, "a", encoding="utf-8")
+            self.dirty = False
+
+    def close(self):
+        self.closed.set()
+        self.sync()
+        with self.lock:
+            self.file.close()
@@ -0,0 +1,119 @@
+"""
+Registre des zones d'arrosage.
+
+Les zones sont déclarées dans la section `zones` de config.json :
+
+    "zones": [
+        {"name": "Tomato", "relay_pin": 22, "soil_channel": "soil_ch1", "moisture_threshold": 62,
+         "manual_duration": 300, "flow_rate": 6, "priority": 1, "button_pin": 5, "target_moisture": 70},
+        {"name": "Annex", "relay_pin": 24, "manual_duration": 600, "automatic": false, "button_pin": 13}
+    ]
+
+Sans section `zones`, les zones historiques (tomates, jardin, robinet annexe) sont construites à partir
+des anciennes clés (tomato_relay_pin, garden_watering_duration, button_pins...).
+"""
+
+DEFAULT_MOISTURE_THRESHOLD = 62
+
+
+class Zone:
+    """ Zone d'arrosage : électrovanne, capteur d'humidité éventuel et réglages """
+
+    def __init__(self, name, relay_pin, soil_channel=None, moisture_threshold=DEFAULT_MOISTURE_THRESHOLD,
+                 manual_duration=300, flow_rate=None, priority=100, button_pin=None, automatic=None,
+                 target_moisture=None, closed_loop=None):
+        self.name = name
+        self.relay_pin = relay_pin
+        self.soil_channel = soil_channel  # canal Ecowitt (ex. "soil_ch1"), None sans capteur
+        self.moisture_threshold = moisture_threshold
+        self.manual_duration = manual_duration
+        self.flow_rate = flow_rate  # litres par minute, None si inconnu
+        self.priority = priority  # les zones de plus petite priorité sont arrosées en premier
+        self.button_pin = button_pin
+        # Une zone sans capteur n'est arrosée qu'à la demande
+        self.automatic = soil_channel is not None if automatic is None else automatic
+        self.target_moisture = target_moisture  # humidité visée en boucle fermée, None : seuil + marge
+        self.closed_loop = closed_loop  # None : suit closed_loop.enabled
+
+    @property
+    def slug(self):
+        """ Identifiant utilisable dans une URL ou un identifiant HTML """
+        return self.name.lower().replace(" ", "_")
+
+    def estimated_volume(self, duration):
+        """ Volume estimé (litres) pour une durée d'arrosage en secondes """
+        return self.flow_rate * duration / 60 if self.flow_rate else None
+
+    def __repr__(self):
+        return f"Zone({self.name!r}, relay_pin={self.relay_pin})"
+
+
+class ZoneRegistry:
+    """ Ensemble ordonné (par priorité) des zones configurées """
+
+    def __init__(self, zones):
+        self.zones = sorted(zones, key=lambda zone: zone.priority)
+        self.by_name = {zone.name.lower(): zone for zone in self.zones}
+        self.by_name.update({zone.slug: zone for zone in self.zones})
+
+    def __iter__(self):
+        return iter(self.zones)
+
+    def __len__(self):
+        return len(self.zones)
+
+    def get(self, name):
+        """ Zone par nom ou identifiant (insensible à la casse) ; None si inconnue """
+        return self.by_name.get(str(name).lower())
+
+    def automatic_zones(self):
+        return [zone for zone in self.zones if zone.automatic]
+
+    def sensed_zones(self):
+        return [zone for zone in self.zones if zone.soil_channel]
+
+    def soil_channels(self):
+        """ {nom de zone: canal Ecowitt} pour une lecture groupée de l'humidité """
+        return {zone.name: zone.soil_channel for zone in self.sensed_zones()}
+
+    def relay_pins(self):
+        return [zone.relay_pin for zone in self.zones]
+
+    def button_pins(self):
+        return {zone.button_pin: zone for zone in self.zones if zone.button_pin is not None}
+
+
+def legacy_zones(config):
+    """ Zones historiques déduites des anciennes clés de config.json """
+    buttons = list(config.get("button_pins", ()))
+    threshold = config.get("moisture_threshold", DEFAULT_MOISTURE_THRESHOLD)
+    return [
+        Zone("Tomato", config["tomato_relay_pin"], "soil_ch1", threshold, config["tomato_watering_duration"],
+             priority=1, button_pin=buttons[0] if len(buttons) > 0 else None),
+        Zone("Garden", config["garden_relay_pin"], "soil_ch3", threshold, config["garden_watering_duration"],
+             priority=2, button_pin=buttons[1] if len(buttons) > 1 else None),
+        Zone("Annex", config["annex_relay_pin"], None, threshold, config["annex_watering_duration"],
+             priority=3, button_pin=buttons[2] if len(buttons) > 2 else None, automatic=False),
+    ]
+
+
+def build_zones(config):
+    """ Construit le registre des zones depuis la section `zones`, ou depuis les anciennes clés """
+    if "zones" not in config:
+        return ZoneRegistry(legacy_zones(config))
+    threshold = config.get("moisture_threshold", DEFAULT_MOISTURE_THRESHOLD)
+    zones = []
+    for index, zone_config in enumerate(config["zones"]):
+        settings = dict(zone_config)
+        settings.setdefault("moisture_threshold", threshold)
+        settings.setdefault("priority", index)
+        zones.append(Zone(**settings))
+    return ZoneRegistry(zones)
+
+
+def stop_button_pin(config):
+    """ Bouton d'arrêt : clé stop_button_pin, sinon quatrième bouton historique """
+    if "stop_button_pin" in config:
+        return config["stop_button_pin"]
+    buttons = config.get("button_pins", ())
+    return buttons[3] if len(buttons) > 3 else None
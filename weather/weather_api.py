@@ -1,69 +1,112 @@
 # weather_api.py
-import requests
 import logging
 from datetime import datetime, timedelta
-from notifications.email_notifications import send_email
-from data_management.data_logger import log_rain_forecast, log_last_12h_rain, log_soil_moisture
+from data_management.data_logger import log_rain_forecast, log_last_12h_rain, log_soil_moistures
+import statistics
 import threading
+import time
+from monitoring.metrics import external_request_seconds, external_request_errors
 
 
 class WeatherAPI:
     lock = threading.Lock()
-    reported_errors = {
-        "soil_moisture_tomato": False,
-        "soil_moisture_garden": False
-    }
+    # Une erreur d'humidité du sol n'est signalée qu'une fois par jour tant que la lecture n'a pas réussi
+    soil_moisture_alert_window = 24 * 3600
 
-    def __init__(self, weatherapi_api_key, latitude, longitude, ecowitt_application_key, ecowitt_api_key, meteo_station_mac_adresse, email_config):
+    def __init__(self, weatherapi_api_key, latitude, longitude, ecowitt_application_key, ecowitt_api_key, meteo_station_mac_adresse, alert_service):
         self.weatherapi_api_key = weatherapi_api_key
         self.latitude = latitude
         self.longitude = longitude
         self.ecowitt_application_key = ecowitt_application_key
         self.ecowitt_api_key = ecowitt_api_key
         self.meteo_station_mac_adresse = meteo_station_mac_adresse
-        self.email_config = email_config
+        self.alert_service = alert_service
+        self._forecast_cache = None  # (instant de la requête, réponse de weatherapi.com)
+        self.ecowitt_budget = None  # RateBudget décomptant toutes les requêtes Ecowitt, si défini
+
+    # Délai maximal d'une requête (secondes) : une API injoignable ne bloque pas le planificateur
+    request_timeout = 10
+
+    def _get(self, api, endpoint, url, params=None):
+        """ Effectue une requête GET en mesurant sa durée et en comptant les échecs """
+        import requests  # Import différé : accélère le démarrage du démon
+        if api == "ecowitt" and self.ecowitt_budget is not None:
+            self.ecowitt_budget.spend()
+        start = time.perf_counter()
+        try:
+            response = requests.get(url, params=params, timeout=self.request_timeout)
+        except Exception:
+            external_request_errors.inc(api=api, endpoint=endpoint)
+            raise
+        finally:
+            external_request_seconds.observe(time.perf_counter() - start, api=api, endpoint=endpoint)
+        if response.status_code != 200:
+            external_request_errors.inc(api=api, endpoint=endpoint)
+        return response
+
+    # Durée de validité des prévisions en cache (weatherapi.com les actualise au mieux toutes les 15 minutes)
+    forecast_ttl = 30 * 60
 
     def get_forecast_data(self):
-        """ Obtient les prévisions météo depuis weatherapi.com """
+        """ Obtient les prévisions météo depuis weatherapi.com (aujourd'hui et demain, gardées en cache) """
+        if self._forecast_cache is not None and time.monotonic() - self._forecast_cache[0] < self.forecast_ttl:
+            return self._forecast_cache[1]
         url = (
             f"http://api.weatherapi.com/v1/forecast.json?"
             f"key={self.weatherapi_api_key}&q={self.latitude},{self.longitude}"
-            f"&days=1&hourly=1"
+            f"&days=2&hourly=1"
         )
-        response = requests.get(url)
+        response = self._get("weatherapi", "forecast", url)
         data = response.json()
+        if response.status_code == 200:
+            self._forecast_cache = (time.monotonic(), data)
         return data
 
-    def extract_rain_forecast(self, data):
-        """ Extrait les données météo obtenues depuis weatherapi.com """
+    def extract_rain_forecast(self, data, hours=12):
+        """
+        Extrait des données de weatherapi.com les `hours` prochaines heures :
+        [(heure "%Y-%m-%d %H:%M", pluie prévue en mm, probabilité de pluie en %)]
+        """
         forecastday = data.get("forecast", {}).get("forecastday", [])
         if not forecastday:
             error_message = "Erreur : Aucune donnée 'forecastday' trouvée."
             logging.error(error_message)
-            send_email(self.email_config, "Erreur dans l'API météo", error_message)
+            self.alert_service.send("weather_forecast", "Erreur dans l'API météo", error_message)
+            return []
+
+        # Les prévisions commencent à minuit : on ne garde que les heures à venir, sur les deux jours
+        current_hour = datetime.now().replace(minute=0, second=0, microsecond=0)
+        rain_forecast = []
+        for day in forecastday:
+            for hour in day.get("hour", []):
+                hour_time = datetime.strptime(hour["time"], "%Y-%m-%d %H:%M")
+                if hour_time >= current_hour:
+                    rain_forecast.append((hour_time.strftime("%Y-%m-%d %H:%M"), hour["precip_mm"],
+                                          float(hour.get("chance_of_rain", 0))))
+        return rain_forecast[:hours]
+
+    def get_hourly_rain_forecast(self, hours=12):
+        """ Prévisions heure par heure pour les `hours` prochaines heures, ou [] si elles sont indisponibles """
+        try:
+            return self.extract_rain_forecast(self.get_forecast_data(), hours)
+        except Exception as e:
+            logging.error(f"Erreur lors de la récupération des prévisions de pluie : {e}")
             return []
 
-        hourly_forecast = forecastday[0].get("hour", [])
-        rain_forecast = [
-            (
-                datetime.strptime(hour["time"], "%Y-%m-%d %H:%M").strftime(
-                    "%Y-%m-%d %H:%M"
-                ),
-                hour["precip_mm"],
-            )
-            for hour in hourly_forecast[:12]
-        ]
-        return rain_forecast
+    def get_cached_rain_forecast(self, hours=12):
+        """ Prévisions déjà en cache, sans requête ; [] si aucune n'a encore été obtenue """
+        if self._forecast_cache is None:
+            return []
+        return self.extract_rain_forecast(self._forecast_cache[1], hours)
 
     def get_next_12_hour_rain_data(self):
         """
         Calcule le volume de pluie prévu pour les 12 prochaines heures
         et enrégistre les données dans la BD
         """
-        data = self.get_forecast_data()
-        rain_forecast = self.extract_rain_forecast(data)
+        rain_forecast = self.get_hourly_rain_forecast(12)
 
-        total_rain = sum(rain for _, rain in rain_forecast)
+        total_rain = sum(rain for _, rain, _ in rain_forecast)
         # log_rain_forecast(total_rain)  # Enregistre les prévisions dans la base de données
 
         logging.info(
@@ -89,7 +132,7 @@ class WeatherAPI:
             "rainfall_unitid": 12,
         }
 
-        response = requests.get(base_url, params=params)
+        response = self._get("ecowitt", "history", base_url, params=params)
 
         # Check if the request was successful
         if response.status_code != 200:
@@ -117,70 +160,99 @@ class WeatherAPI:
 
         return last_12h_rainfall
 
-    def get_soil_moisture_data(self):
+    # Valeur utilisée lorsqu'une lecture d'humidité échoue
+    default_soil_moisture = 50.0
+
+    def get_soil_moisture_data(self, channels):
         """
-        Retrieves soil moisture data for both channels (soil_ch1 and soil_ch3)
-        using the Ecowitt API v3 and returns them as moisture_data_tomato and moisture_data_garden.
+        Retrieves soil moisture for every zone in one Ecowitt API v3 real-time request.
+        `channels` maps zone names to Ecowitt channels ({"Tomato": "soil_ch1", ...});
+        returns {zone: moisture}, with a default value for zones whose reading failed.
         """
+        if not channels:
+            return {}
         with self.lock:
             base_url = "https://api.ecowitt.net/api/v3/device/real_time"
             moisture_data = {}
-
-            for channel, zone in [("soil_ch1", "Tomato"), ("soil_ch3", "Garden")]:
+            measured = {}
+            params = {
+                "application_key": self.ecowitt_application_key,
+                "api_key": self.ecowitt_api_key,
+                "mac": self.meteo_station_mac_adresse,
+                # Tous les canaux en une requête : call_back accepte une liste séparée par des virgules
+                "call_back": ",".join(f"{channel}.soilmoisture" for channel in sorted(set(channels.values()))),
+            }
+
+            try:
+                response = self._get("ecowitt", "real_time", base_url, params=params)
+                if response.status_code != 200:
+                    error_message = f"Erreur : {response.status_code}. Impossible de récupérer les données d'humidité de l'API Ecowitt."
+                    logging.error(error_message)
+                    for zone in channels:
+                        self._report_soil_moisture_error(
+                            zone, "Erreur dans l'API Ecowitt pour la reprise du taux d'humidité", error_message)
+                    return {zone: self.default_soil_moisture for zone in channels}
+                data = response.json().get("data") or {}
+            except Exception as e:
+                logging.error(f"Erreur lors de la récupération des données d'humidité : {str(e)}")
+                for zone in channels:
+                    self._report_soil_moisture_error(
+                        zone, f"Erreur lors de la récupération des données d'humidité pour {zone}", str(e))
+                return {zone: self.default_soil_moisture for zone in channels}
+
+            for zone, channel in channels.items():
                 try:
-                    params = {
-                        "application_key": self.ecowitt_application_key,
-                        "api_key": self.ecowitt_api_key,
-                        "mac": self.meteo_station_mac_adresse,
-                        "call_back": f"{channel}.soilmoisture",
-                    }
-
-                    response = requests.get(base_url, params=params)
-
-                    if response.status_code != 200:
-                        error_message = f"Erreur : {response.status_code}. Impossible de récupérer les données de l'API Ecowitt pour {channel}."
-                        logging.error(error_message)
-                        if not self.reported_errors[f"soil_moisture_{zone.lower()}"]:
-                            send_email(self.email_config,
-                                       f"Erreur dans l'API Ecowitt pour la reprise du taux d'humidité de {channel}",
-                                       error_message)
-                            self.reported_errors[f"soil_moisture_{zone.lower()}"] = True
-                        moisture_data[zone] = 50.0  # Définir une valeur par défaut en cas d'erreur
-                        continue
-
-                    data = response.json()
-
-                    if "data" not in data or channel not in data["data"] or "soilmoisture" not in data["data"][channel] or "value" not in data["data"][channel]["soilmoisture"]:
-                        error_message = f"Erreur : La structure de données attendue pour {channel} n'a pas été trouvée dans la réponse."
-                        logging.error(error_message)
-                        if not self.reported_errors[f"soil_moisture_{zone.lower()}"]:
-                            send_email(self.email_config,
-                                       f"Erreur dans l'API Ecowitt pour la reprise du taux d'humidité de {channel}",
-                                       error_message)
-                            self.reported_errors[f"soil_moisture_{zone.lower()}"] = True
-                        moisture_data[zone] = 50.0  # Définir une valeur par défaut en cas d'erreur
-                        continue
-
-                    moisture_data[zone] = float(data["data"][channel]["soilmoisture"]["value"])
-                    log_soil_moisture(moisture_data[zone], zone)
-                    logging.info(f"Current soil moisture level for {zone}: {moisture_data[zone]}")
-                    self.reported_errors[f"soil_moisture_{zone.lower()}"] = False
-
-                except Exception as e:
-                    logging.error(f"Erreur lors de la récupération des données d'humidité pour {zone}: {str(e)}")
-                    if not self.reported_errors[f"soil_moisture_{zone.lower()}"]:
-                        send_email(self.email_config, f"Erreur lors de la récupération des données d'humidité pour {zone}", str(e))
-                        self.reported_errors[f"soil_moisture_{zone.lower()}"] = True
-                    moisture_data[zone] = 50.0  # Définir une valeur par défaut en cas d'erreur
-
-            return moisture_data.get("Tomato"), moisture_data.get("Garden")
+                    moisture_data[zone] = float(data[channel]["soilmoisture"]["value"])
+                except (KeyError, TypeError, ValueError):
+                    error_message = f"Erreur : La structure de données attendue pour {channel} n'a pas été trouvée dans la réponse."
+                    logging.error(error_message)
+                    self._report_soil_moisture_error(
+                        zone, f"Erreur dans l'API Ecowitt pour la reprise du taux d'humidité de {channel}",
+                        error_message)
+                    moisture_data[zone] = self.default_soil_moisture  # Définir une valeur par défaut en cas d'erreur
+                    continue
+                measured[zone] = moisture_data[zone]
+                logging.info(f"Current soil moisture level for {zone}: {moisture_data[zone]}")
+                self.alert_service.resolve(f"soil_moisture_{zone.lower()}")
+
+            # Les lectures réussies sont enregistrées en un lot (les valeurs par défaut ne le sont jamais)
+            log_soil_moistures(measured)
+            return moisture_data
+
+    def read_soil_moisture(self, channel):
+        """
+        Reads one soil channel while a valve is open (closed-loop watering): returns the moisture,
+        or None if the reading failed. Nothing is logged to the database and no alert is raised.
+        """
+        params = {
+            "application_key": self.ecowitt_application_key,
+            "api_key": self.ecowitt_api_key,
+            "mac": self.meteo_station_mac_adresse,
+            "call_back": f"{channel}.soilmoisture",
+        }
+        with self.lock:
+            try:
+                response = self._get("ecowitt", "real_time", "https://api.ecowitt.net/api/v3/device/real_time",
+                                     params=params)
+                if response.status_code != 200:
+                    logging.warning(f"Soil moisture reading of {channel} failed: HTTP {response.status_code}")
+                    return None
+                return float(response.json()["data"][channel]["soilmoisture"]["value"])
+            except Exception as e:
+                logging.warning(f"Soil moisture reading of {channel} failed: {e}")
+                return None
+
+    def _report_soil_moisture_error(self, zone, subject, message):
+        """ Signale une erreur de lecture d'humidité du sol (au plus une fois par jour et par zone) """
+        self.alert_service.send(f"soil_moisture_{zone.lower()}", subject, message,
+                                dedup_window=self.soil_moisture_alert_window)
 
     def reset_reported_errors(self):
-        self.reported_errors = {key: False for key in self.reported_errors}
+        self.alert_service.reset()
         logging.info("Reported errors reset.")
 
     def get_history_data(self, start_date, end_date, call_back, temp_unitid=None, solar_irradiance_unitid=None,
-                         rainfall_unitid=None, wind_speed_unitid=None):
+                         rainfall_unitid=None, wind_speed_unitid=None, cycle_type="auto"):
         params = {
             "application_key": self.ecowitt_application_key,
             "api_key": self.ecowitt_api_key,
@@ -188,7 +260,7 @@ class WeatherAPI:
             "start_date": start_date.strftime("%Y-%m-%d %H:%M:%S"),
             "end_date": end_date.strftime("%Y-%m-%d %H:%M:%S"),
             "call_back": call_back,
-            "cycle_type": "auto"
+            "cycle_type": cycle_type
         }
         # Optionally include specific unit IDs for temperature, solar irradiance, rainfall, and wind speed
         if temp_unitid:
@@ -200,13 +272,55 @@ class WeatherAPI:
         if wind_speed_unitid:
             params["wind_speed_unitid"] = wind_speed_unitid
 
-        response = requests.get("https://api.ecowitt.net/api/v3/device/history", params=params)
+        response = self._get("ecowitt", "history", "https://api.ecowitt.net/api/v3/device/history", params=params)
         if response.status_code == 200:
             return response.json()
         else:
             logging.error("Failed to fetch data: %s", response.status_code)
             return None
 
+    # Variables de l'historique Ecowitt lues d'une seule requête : (call_back, clé, sous-clé, agrégation)
+    RECENT_WEATHER = {
+        "rain": ("rainfall.hourly", "rainfall", "hourly", sum),
+        "temperature": ("outdoor.temperature", "outdoor", "temperature", statistics.mean),
+        "humidity": ("outdoor.humidity", "outdoor", "humidity", statistics.mean),
+        "wind": ("wind.wind_speed", "wind", "wind_speed", statistics.mean),
+        "sunlight": ("solar_and_uvi.solar", "solar_and_uvi", "solar", statistics.mean),
+    }
+
+    def get_recent_weather_data(self, seconds=3600):
+        """
+        Pluie tombée (mm) et moyennes de température, humidité, vent et ensoleillement sur les `seconds`
+        dernières secondes, en une requête d'historique ; une valeur manquante vaut None
+        """
+        end_date = datetime.utcnow()
+        history = self.get_weather_history(end_date - timedelta(seconds=seconds), end_date)
+        values = {}
+        for name, (_, _, _, aggregate) in self.RECENT_WEATHER.items():
+            samples = list(history.get(name, {}).values())
+            values[name] = aggregate(samples) if samples else None
+        return values
+
+    def get_weather_history(self, start_date, end_date, cycle_type="auto"):
+        """
+        Relevés bruts des variables de RECENT_WEATHER entre deux dates UTC, en une requête d'historique :
+        {variable: {horodatage unix: valeur}} ; une variable absente de la réponse est vide
+        """
+        call_back = ",".join(call_back for call_back, _, _, _ in self.RECENT_WEATHER.values())
+        data = self.get_history_data(start_date, end_date, call_back, temp_unitid=1, solar_irradiance_unitid=16,
+                                     rainfall_unitid=12, wind_speed_unitid=7, cycle_type=cycle_type)
+        data = (data or {}).get("data") or {}
+        history = {}
+        for name, (_, key, sub_key, _) in self.RECENT_WEATHER.items():
+            samples = {}
+            try:
+                for timestamp, value in data[key][sub_key]["list"].items():
+                    samples[int(timestamp)] = float(value)
+            except (KeyError, TypeError, ValueError, AttributeError):
+                samples = {}
+            history[name] = samples
+        return history
+
     def get_last_1_hour_rain_data(self):
         now = datetime.utcnow()
         start_date = now - timedelta(hours=1)